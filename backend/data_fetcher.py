@@ -16,17 +16,67 @@
 
 import utils
 import time
+from bisect import bisect_left
+from bisect import bisect_right
+from math import ceil
+
+import numpy as np
+
+from downsample import AGGREGATE_LEVELS
+from downsample import AGGREGATE_MAX
+from downsample import AGGREGATE_MIN
+from downsample import AGGREGATE_STRATEGIES
+from downsample import AGGREGATES
+from downsample import TIME_BUCKET_STRATEGIES
+from downsample import TIME_BUCKETS
+from downsample import aggregates_to_records
+from level_slices_reader import ChannelReducer
 from level_slices_reader import LevelSlices
-from metadata import Metadata
+from level_slices_reader import MAX_DOWNLOAD_WORKERS
+from metadata_cache import MetadataCache
+from storage_backend import RangeBackend
+from storage_backend import get_backend
+from prefix_sums import get_cumulative
+from slice_format import STATS_MAX
+from slice_format import STATS_MIN
 
 
 class DataFetcher:
     """Class for for fetching data from multiple-level preprocessing."""
 
-    def __init__(self, file_path, root_dir, preprocess_bucket=None):
+    def __init__(self, file_path, root_dir, preprocess_bucket=None,
+                 max_workers=MAX_DOWNLOAD_WORKERS, cache=None, metadata_cache=None,
+                 single_flight=None, disk_cache=None, raw_bucket=None):
+        """Initializes the fetcher.
 
+        Args:
+            file_path: A string of the name of the raw file.
+            root_dir: A string of the directory of preprocess files.
+            preprocess_bucket: A GCP bucket object or StorageBackend object for
+                preprocess files, None if local.
+            max_workers: An int of the maximum number of slices downloaded at once.
+            cache: A SliceCache object shared by fetchers, None to disable caching.
+            metadata_cache: A MetadataCache object shared by fetchers, None to only
+                keep metadata for the lifetime of this fetcher.
+            single_flight: A SingleFlight object shared by fetchers, so that a slice
+                read by concurrent fetches is downloaded once. None to always
+                download.
+            disk_cache: A DiskCache object shared by fetchers, of slices downloaded
+                by this instance. None to always download.
+            raw_bucket: A GCP bucket object or StorageBackend object for the raw
+                file, None if local. Level0 slices are read from it if they are
+                indexed byte ranges of the raw file.
+        """
         self._rawfile = file_path
         self._preprocess_bucket = preprocess_bucket
+        self._max_workers = max_workers
+        self._cache = cache
+        self._single_flight = single_flight
+        self._disk_cache = disk_cache
+        self._raw_bucket = raw_bucket
+        if metadata_cache is None:
+            metadata_cache = MetadataCache(ttl=float('inf'))
+        self._metadata_cache = metadata_cache
 
         original_file_name = utils.get_file_name(file_path)
         self._preprocess_dir = '/'.join([root_dir, original_file_name])
@@ -37,11 +87,76 @@ class DataFetcher:
         Returns:
             A boolean indicating if the raw file is preprocessed.
         """
-        metadata = Metadata(self._preprocess_dir,
-                            bucket=self._preprocess_bucket)
-        return metadata.load()
+        return self._get_metadata() is not None
+
+    def _get_metadata(self):
+        """Gets the indexed metadata of the file.
+
+        Returns:
+            A FileMetadata object, None if the raw file is not preprocessed.
+        """
+        return self._metadata_cache.get(self._preprocess_dir, self._preprocess_bucket)
+
+    def _get_slice_storage(self):
+        """Gets the storage slices are read from.
+
+        Returns:
+            The preprocess bucket, or a RangeBackend object that reads level0
+            slices from the raw file if they are indexed byte ranges of it.
+        """
+        raw_ranges = self._metadata.get_raw_ranges()
+        if not raw_ranges:
+            return self._preprocess_bucket
+        return RangeBackend(get_backend(self._preprocess_bucket),
+                            get_backend(self._raw_bucket),
+                            self._metadata['raw_file'], raw_ranges)
+
+    def get_generation(self):
+        """Gets the generation of the preprocess of the file.
+
+        Returns:
+            The generation of the metadata, None if the raw file is not preprocessed.
+        """
+        metadata = self._get_metadata()
+        return None if metadata is None else metadata.generation
+
+    def snap_timespan(self, number_records, timespan_start, timespan_end):
+        """Widens a timespan to the resolution of the level it is fetched from.
+
+        The start is moved back and the end forward, to multiples of the time
+        between records of the level, or of its bucket width with time buckets.
+        Timespans that differ by less than a record of the level are then fetched
+        as the same timespan, so that their responses can be cached once. A timespan
+        of a single instant is widened to a record of the level of highest frequency.
+
+        Args:
+            number_records: An interger representing number of records to return.
+            timespan_start: An integer of the start of timespan, None for the start
+                of the file.
+            timespan_end: An integer of the end of timespan, None for the end of
+                the file.
 
-    def fetch(self, strategy, number_records, timespan_start, timespan_end):
+        Returns:
+            A tuple of integers of the start and end of the widened timespan.
+        """
+        metadata = self._get_metadata()
+        if timespan_start is None:
+            timespan_start = metadata['start']
+        if timespan_end is None:
+            timespan_end = metadata['end']
+        if timespan_end < timespan_start:
+            return timespan_start, timespan_end
+        level_index = 0
+        if timespan_end > timespan_start:
+            level_index = metadata.find_level(number_records / (timespan_end - timespan_start))
+        level = metadata['levels'][metadata['levels']['names'][level_index]]
+        width = level.get('bucket_width')
+        if width is None:
+            width = max(1, int(1 / level['frequency'])) if level['frequency'] > 0 else 1
+        snapped_start = timespan_start // width * width
+        return snapped_start, max(-(-timespan_end // width) * width, snapped_start + width)
+
+    def fetch(self, strategy, number_records, timespan_start, timespan_end, channels=None):
         """Gets the records in given timespan, downsample the fetched data with
             given strategy if needed.
 
@@ -58,6 +173,7 @@ class DataFetcher:
                 of the start of timespan.
             timespan_end: An integer representing the timestamp in microseconds
                 of the end of timespan.
+            channels: A list of names of channels to return, None for all channels.
 
         Returns:
             A list of downsampled data in the given file, and precision for this result.
@@ -81,10 +197,8 @@ class DataFetcher:
         prevTime = time.time()
         print("fetch data starts", prevTime)
 
-        self._metadata = Metadata(
-            self._preprocess_dir, bucket=self._preprocess_bucket)
-        self._metadata.load()
-        
+        self._metadata = self._get_metadata()
+
         diff = time.time() - prevTime
         prevTime = time.time()
         print("meta data done", diff)
@@ -95,16 +209,10 @@ class DataFetcher:
             timespan_end = self._metadata['end']
 
         if timespan_start > self._metadata['end'] or timespan_end < self._metadata['start']:
-            return []
-
-        required_frequency = number_records / (timespan_end - timespan_start)
-
-        # Finds Downsample Level.
-        target_level_index = self._binary_search(
-            [self._metadata['levels'][level_name]['frequency']
-             for level_name in self._metadata['levels']['names']],
-            required_frequency, True)
+            return [], 0
 
+        target_level_index, level_strategy = self._find_target_level(
+            strategy, number_records, timespan_start, timespan_end)
         target_level = self._metadata['levels'][self._metadata['levels']
                                                 ['names'][target_level_index]]
 
@@ -112,72 +220,51 @@ class DataFetcher:
         prevTime = time.time()
         print("target level located",diff)
 
-        level_metadata = Metadata(
-            self._preprocess_dir, strategy, utils.get_level_name(
-                target_level_index), bucket=self._preprocess_bucket)
-        level_metadata.load()
-        first_slice = self._binary_search([level_metadata[single_slice]
-                                           for single_slice in target_level['names']],
-                                          timespan_start)
-        last_slice = self._binary_search([level_metadata[single_slice]
-                                          for single_slice in target_level['names']],
-                                         timespan_end)
-        target_slices_names = target_level['names'][first_slice:last_slice+1]
-        target_slice_paths = [utils.get_slice_path(
-            self._preprocess_dir,
-            utils.get_level_name(target_level_index),
-            single_slice, strategy) for single_slice in target_slices_names]
+        target_slices_names, target_slice_paths = self._find_target_slices(
+            level_strategy, target_level_index, timespan_start, timespan_end)
         
         diff = time.time() - prevTime
         prevTime = time.time()
         print("all slice found", diff)
 
-        target_slice_paths_min = [utils.get_slice_path(
-            self._preprocess_dir,
-            utils.get_level_name(target_level_index),
-            single_slice, 'min') for single_slice in target_slices_names]
-
-        target_slice_paths_max = [utils.get_slice_path(
-            self._preprocess_dir,
-            utils.get_level_name(target_level_index),
-            single_slice, 'max') for single_slice in target_slices_names]
-
-        diff = time.time() - prevTime
-        prevTime = time.time()
-        print("min max slice found", diff)
-
         # Reads records and downsamples.
         target_slices = LevelSlices(
-            target_slice_paths, self._preprocess_bucket)
-        
-
-
+            target_slice_paths, self._get_slice_storage(), self._max_workers,
+            self._cache, self._metadata.data.get('generation'),
+            self._single_flight, self._disk_cache)
         target_slices.read(timespan_start, timespan_end)
+        if channels is not None:
+            target_slices.select_channels(channels)
 
         diff = time.time() - prevTime
         prevTime = time.time()
         print("main file read", diff)
 
-        target_slices_min = LevelSlices(
-            target_slice_paths_min, self._preprocess_bucket)
-
-        target_slices_max = LevelSlices(
-            target_slice_paths_max, self._preprocess_bucket)
-        target_slices_min.read(timespan_start, timespan_end)
-        target_slices_max.read(timespan_start, timespan_end)
-
-        diff = time.time() - prevTime
-        prevTime = time.time()
-        print("min max file read", diff)
+        def get_target_extremes(extreme):
+            field = 1
+            if level_strategy == AGGREGATES and target_level_index > 0:
+                field = AGGREGATE_MIN if extreme == 'min' else AGGREGATE_MAX
+            return getattr(target_slices, 'get_' + extreme)(field)
 
-        minList = target_slices_min.get_min()
-        maxList = target_slices_max.get_max()
+        minList, maxList = self._get_extremes(
+            level_strategy, target_level_index, target_slices_names,
+            target_slices.get_channels(), get_target_extremes, timespan_start, timespan_end)
 
         diff = time.time() - prevTime
         prevTime = time.time()
         print("min max get", diff)
         number_target_records = target_slices.get_records_count()
-        target_slices.downsample(strategy, max_records=number_records)
+        reduce_strategy, bucket_width = self._get_reduction(
+            strategy, level_strategy, target_level, number_records, timespan_start,
+            timespan_end)
+        if level_strategy == AGGREGATES and reduce_strategy != AGGREGATES:
+            target_slices.convert_aggregates('avg')
+        if bucket_width is not None:
+            target_slices.downsample(reduce_strategy, bucket_width=bucket_width)
+        else:
+            target_slices.downsample(reduce_strategy, max_records=number_records)
+        if reduce_strategy == AGGREGATES:
+            target_slices.convert_aggregates(strategy)
         downsampled_data = target_slices.format_response(minList, maxList)
 
         diff = time.time() - prevTime
@@ -185,13 +272,498 @@ class DataFetcher:
         print("dowmsample finished", diff)
         number_result_records = target_slices.get_records_count()
 
-        if number_target_records == 0:
-            precision = 0
+        return downsampled_data, self._get_precision(
+            target_level, number_target_records, number_result_records)
+
+    def fetch_stream(self, strategy, number_records, timespan_start, timespan_end,
+                     channels=None):
+        """Gets the same records as fetch(), downsampled one slice at a time.
+
+        Records of each slice are built, downsampled and yielded before those of the
+        next slice, so only the records of one slice, and of the partial buckets of
+        each channel, are held at once. With time bins, slices are read as the
+        records are consumed. Buckets of a number of records are sized by the number
+        of records of each channel in the whole timespan, so for them the columns of
+        all slices, the compact form that the slice cache holds, are read first.
+        The min and max of each channel, and the precision, come last.
+
+        Args:
+            strategy: A string representing a downsampling strategy.
+            number_records: An interger representing number of records to return.
+            timespan_start: An integer representing the timestamp in microseconds
+                of the start of timespan.
+            timespan_end: An integer representing the timestamp in microseconds
+                of the end of timespan.
+            channels: A list of names of channels to return, None for all channels.
+
+        Yields:
+            Dicts of the name of a channel and the next of its downsampled records,
+            in order of time for each channel. Then a dict of the precision, and of
+            min and max power keyed by channel, in the order of channels of fetch().
+            Example:
+                {'name': 'sys', 'data': [[time, power], [time, power]]}
+                {'name': 'channel2', 'data': [[time, power]]}
+                {'name': 'sys', 'data': [[time, power]]}
+                {
+                    'frequency_ratio': 0.5,
+                    'min': {'sys': power, 'channel2': power},
+                    'max': {'sys': power, 'channel2': power}
+                }
+        """
+        self._metadata = self._get_metadata()
+        if timespan_start is None:
+            timespan_start = self._metadata['start']
+        if timespan_end is None:
+            timespan_end = self._metadata['end']
+        if timespan_start > self._metadata['end'] or timespan_end < self._metadata['start']:
+            yield {'frequency_ratio': 0, 'min': {}, 'max': {}}
+            return
+
+        target_level_index, level_strategy = self._find_target_level(
+            strategy, number_records, timespan_start, timespan_end)
+        target_level = self._metadata['levels'][self._metadata['levels']
+                                                ['names'][target_level_index]]
+        target_slices_names, target_slice_paths = self._find_target_slices(
+            level_strategy, target_level_index, timespan_start, timespan_end)
+        reduce_strategy, bucket_width = self._get_reduction(
+            strategy, level_strategy, target_level, number_records, timespan_start,
+            timespan_end)
+        target_slices = LevelSlices(
+            target_slice_paths, self._get_slice_storage(), self._max_workers,
+            self._cache, self._metadata.data.get('generation'),
+            self._single_flight, self._disk_cache)
+        counts = dict()
+        if bucket_width is None:
+            slices_columns = target_slices.read_columns(timespan_start, timespan_end)
+            for columns in slices_columns:
+                numbers = np.bincount(columns.codes, minlength=len(columns.channels))
+                for channel, number in zip(columns.channels, numbers.tolist()):
+                    counts[channel] = counts.get(channel, 0) + number
         else:
-            precision = number_result_records / \
-                number_target_records * \
-                (target_level['number']/self._metadata['raw_number'])
-        return downsampled_data, precision
+            slices_columns = target_slices.iter_columns(timespan_start, timespan_end)
+
+        # key: channel name, value: ChannelReducer object, in order channels appear.
+        reducers = dict()
+        # Min and max power of records of the target level, before downsampling.
+        target_extremes = {'min': dict(), 'max': dict()}
+        number_target_records = 0
+        number_result_records = 0
+
+        def to_response(channel, records):
+            if reduce_strategy == AGGREGATES:
+                records = aggregates_to_records(records, strategy)
+            return {'name': channel, 'data': [[record[0], record[1]] for record in records]}
+
+        for columns in slices_columns:
+            stats = columns.get_stats()
+            for channel, records in columns.to_records().items():
+                if channels is not None and channel not in channels:
+                    continue
+                number_target_records += len(records)
+                for extreme, index, reduce in [('min', STATS_MIN, min),
+                                               ('max', STATS_MAX, max)]:
+                    values = target_extremes[extreme]
+                    values[channel] = reduce(values.get(channel, stats[channel][index]),
+                                             stats[channel][index])
+                if channel not in reducers:
+                    reducers[channel] = ChannelReducer(
+                        channel, reduce_strategy,
+                        ceil(counts.get(channel, 0) / number_records), bucket_width)
+                if level_strategy == AGGREGATES and reduce_strategy != AGGREGATES:
+                    records = aggregates_to_records(records, 'avg')
+                downsampled = reducers[channel].add_records(records)
+                if downsampled:
+                    number_result_records += len(downsampled)
+                    yield to_response(channel, downsampled)
+        for channel, reducer in reducers.items():
+            downsampled = reducer.flush()
+            if downsampled:
+                number_result_records += len(downsampled)
+                yield to_response(channel, downsampled)
+
+        minimums, maximums = self._get_extremes(
+            level_strategy, target_level_index, target_slices_names, list(reducers),
+            target_extremes.get, timespan_start, timespan_end)
+        yield {
+            'frequency_ratio': self._get_precision(
+                target_level, number_target_records, number_result_records),
+            'min': {channel: minimums[channel] for channel in reducers},
+            'max': {channel: maximums[channel] for channel in reducers}
+        }
+
+    def _find_target_level(self, strategy, number_records, timespan_start, timespan_end):
+        """Finds the level that records are fetched from, and its strategy.
+
+        Args:
+            strategy: A string representing a downsampling strategy.
+            number_records: An interger representing number of records to return.
+            timespan_start: An integer of the start of timespan.
+            timespan_end: An integer of the end of timespan.
+
+        Returns:
+            A tuple of the index of the level that has frequency the least higher than
+            the required frequency, and the strategy of its slices.
+        """
+        required_frequency = number_records / max(timespan_end - timespan_start, 1)
+        target_level_index = self._metadata.find_level(required_frequency)
+
+        # Time bins have no lttb level, lttb is then applied to the avg level.
+        level_strategy = strategy
+        if self._metadata.data.get('bucket_mode') == TIME_BUCKETS and \
+                strategy not in TIME_BUCKET_STRATEGIES:
+            level_strategy = 'avg'
+        if self._is_aggregate_levels() and level_strategy in AGGREGATE_STRATEGIES:
+            level_strategy = AGGREGATES
+        return target_level_index, level_strategy
+
+    def _find_target_slices(self, level_strategy, level_index, timespan_start,
+                            timespan_end):
+        """Finds the slices of a level that cover the timespan.
+
+        Args:
+            level_strategy: A string of the strategy of slices of the level.
+            level_index: An int of the level index.
+            timespan_start: An integer of the start of timespan.
+            timespan_end: An integer of the end of timespan.
+
+        Returns:
+            A tuple of lists of names and paths of the slices, in order of time.
+        """
+        first_slice, last_slice = self._metadata.find_slices(
+            level_strategy, level_index, timespan_start, timespan_end)
+        slice_names = self._metadata.get_slice_names(
+            level_strategy, level_index)[first_slice:last_slice+1]
+        slice_paths = [utils.get_slice_path(
+            self._preprocess_dir,
+            utils.get_level_name(level_index),
+            single_slice, level_strategy) for single_slice in slice_names]
+        return slice_names, slice_paths
+
+    def _get_reduction(self, strategy, level_strategy, target_level, number_records,
+                       timespan_start, timespan_end):
+        """Gets how the records of the target level are downsampled.
+
+        Aggregates are merged before records of the strategy are derived from
+        them, so that they stay exact. Other strategies are applied to averages.
+        m4 is always binned by time, one bin per pixel column, and so are the
+        strategies of time buckets. Bins are whole multiples of the bins of the
+        level, so that every returned point covers the same time.
+
+        Args:
+            strategy: A string representing a downsampling strategy.
+            level_strategy: A string of the strategy of slices of the target level.
+            target_level: A dict of the metadata of the target level.
+            number_records: An interger representing number of records to return.
+            timespan_start: An integer of the start of timespan.
+            timespan_end: An integer of the end of timespan.
+
+        Returns:
+            A tuple of the strategy to reduce records by, and the width of time bins,
+            None to reduce them by buckets of up to number_records records.
+        """
+        reduce_strategy = strategy
+        if level_strategy == AGGREGATES and strategy in AGGREGATE_STRATEGIES:
+            reduce_strategy = AGGREGATES
+        time_buckets = self._metadata.data.get('bucket_mode') == TIME_BUCKETS
+        if strategy != 'm4' and not (time_buckets and strategy in TIME_BUCKET_STRATEGIES):
+            return reduce_strategy, None
+        level_width = target_level.get('bucket_width', 1)
+        return reduce_strategy, level_width * max(1, ceil(
+            (timespan_end - timespan_start) / number_records / level_width))
+
+    def _get_precision(self, target_level, number_target_records, number_result_records):
+        """Gets the precision of downsampled records.
+
+        Args:
+            target_level: A dict of the metadata of the target level.
+            number_target_records: An int of number of records read from the level.
+            number_result_records: An int of number of records after downsampling.
+
+        Returns:
+            A float of the ratio of returned records to raw records in the timespan.
+        """
+        if number_target_records == 0:
+            return 0
+        return number_result_records / number_target_records * \
+            (target_level['number']/self._metadata['raw_number'])
+
+    def fetch_stats(self, timespan_start, timespan_end):
+        """Gets the number of records, mean power and energy of each channel in a
+            timespan.
+
+        The prefix sums of level0 give the totals up to the start of each slice. The
+        totals up to both ends of the timespan are each found by a binary search
+        for the slice, a lookup of its prefix sums, and the records of that slice
+        up to the end. Only those two slices are read.
+
+        Args:
+            timespan_start: An integer of the start of timespan, None for the start
+                of the file.
+            timespan_end: An integer of the end of timespan, both included, None for
+                the end of the file.
+
+        Returns:
+            A list of dicts with the name, number of records, mean power and energy
+            of each channel, None if the file was preprocessed without prefix sums.
+            Energy is in power times seconds, power being held from one record to
+            the next of the channel, and zero after the last record of the channel.
+            Mean is None if there is no record in the timespan.
+        """
+        self._metadata = self._get_metadata()
+        prefix_sums = self._metadata.get_prefix_sums()
+        if not prefix_sums:
+            return None
+        if timespan_start is None:
+            timespan_start = self._metadata['start']
+        if timespan_end is None:
+            timespan_end = self._metadata['end']
+        # Power is not held beyond the file.
+        timespan_start = max(timespan_start, self._metadata['start'])
+        timespan_end = min(timespan_end, self._metadata['end'])
+        if timespan_start > timespan_end:
+            return []
+
+        slice_names = self._metadata.get_slice_names(None, 0)
+        starts = self._metadata.get_slice_starts(None, 0)
+        # Records before the start are in slices that start before it, records up
+        # to the end are in slices that start at it or before.
+        start_index = max(bisect_left(starts, timespan_start) - 1, 0)
+        end_index = max(bisect_right(starts, timespan_end) - 1, 0)
+        indices = sorted({start_index, end_index})
+        slice_paths = [utils.get_slice_path(
+            self._preprocess_dir, utils.get_level_name(0), slice_names[index])
+                       for index in indices]
+        slices = LevelSlices(slice_paths, self._get_slice_storage(), self._max_workers,
+                             self._cache, self._metadata.data.get('generation'),
+                             self._single_flight, self._disk_cache)
+        columns = dict(zip(indices, slices.read_columns(None, timespan_end)))
+
+        last_times = self._metadata.get_last_times()
+        before = get_cumulative(prefix_sums[slice_names[start_index]],
+                                columns[start_index], timespan_start, False, last_times)
+        until = get_cumulative(prefix_sums[slice_names[end_index]],
+                               columns[end_index], timespan_end, True, last_times)
+        response = list()
+        for channel, (count, total, energy) in until.items():
+            count_before, total_before, energy_before = before.get(channel, (0, 0.0, 0.0))
+            count -= count_before
+            response.append({
+                'name': channel,
+                'count': count,
+                'mean': (total - total_before) / count if count else None,
+                'energy': energy - energy_before
+            })
+        return response
+
+    def search(self, channel, threshold, above, timespan_start, timespan_end, limit=1):
+        """Searches the first records of a channel with power beyond a threshold.
+
+        Level0 slices whose max, or min, does not cross the threshold are skipped by
+        the index of slice stats, so only slices that have matching records are
+        read, in order of time.
+
+        Args:
+            channel: A string of the channel name.
+            threshold: A number of power.
+            above: A boolean indicating if power is searched above the threshold, or
+                below it.
+            timespan_start: An integer of the start of timespan, None for the start
+                of the file.
+            timespan_end: An integer of the end of timespan, both included, None for
+                the end of the file.
+            limit: An int of the maximum number of records to return.
+
+        Returns:
+            A list of up to limit raw records ([time, power]) sorted by time, None if
+            the file was preprocessed without stats.
+        """
+        self._metadata = self._get_metadata()
+        range_extremes = self._metadata.get_range_extremes()
+        if range_extremes is None:
+            return None
+        if timespan_start is None:
+            timespan_start = self._metadata['start']
+        if timespan_end is None:
+            timespan_end = self._metadata['end']
+
+        first_slice, _ = self._metadata.find_slices(None, 0, timespan_start, timespan_end)
+        # The end is included, so a slice that starts at it can hold a match.
+        last_slice = max(bisect_right(
+            self._metadata.get_slice_starts(None, 0), timespan_end) - 1, 0)
+        slice_names = self._metadata.get_slice_names(None, 0)
+        records = list()
+        index = range_extremes.find_first(channel, first_slice, threshold, above)
+        while index is not None and index <= last_slice and len(records) < limit:
+            slice_path = utils.get_slice_path(
+                self._preprocess_dir, utils.get_level_name(0), slice_names[index])
+            level_slice = LevelSlices([slice_path], self._get_slice_storage(), 1,
+                                      self._cache, self._metadata.data.get('generation'),
+                                      self._single_flight, self._disk_cache)
+            columns, = level_slice.read_columns(timespan_start, timespan_end)
+            if channel in columns.channels:
+                matches = columns.codes == columns.channels.index(channel)
+                matches &= (columns.powers > threshold if above
+                            else columns.powers < threshold)
+                matches = np.flatnonzero(matches)[:limit - len(records)]
+                records.extend(zip(columns.times[matches].tolist(),
+                                   columns.powers[matches].tolist()))
+            index = range_extremes.find_first(channel, index + 1, threshold, above)
+        return [list(record) for record in records]
+
+    def _get_extremes(self, strategy, level_index, slice_names, channels,
+                      target_extremes, timespan_start, timespan_end):
+        """Gets the exact min and max power of each channel in the timespan.
+
+        Level0 slices between the first and last one covering the timespan are
+        fully in it, and their min and max come from a sparse table of level0 slice
+        stats. Only the first and last level0 slices are read, and only their
+        records in the timespan. Files preprocessed without stats fall back to the
+        slices of the target level.
+
+        Args:
+            strategy: A string representing the downsampling strategy of target slices.
+            level_index: An int of the index of target level.
+            slice_names: A list of names of slices that cover the timespan.
+            channels: A list of names of channels that have records in target slices.
+            target_extremes: A function of 'min' or 'max', that gets the min or max
+                power of the records of target slices keyed by channel, before
+                downsampling.
+            timespan_start: An integer of the start of timespan.
+            timespan_end: An integer of the end of timespan.
+
+        Returns:
+            A tuple of two dicts, of min and max power keyed by channel.
+        """
+        range_extremes = None
+        if level_index > 0:
+            range_extremes = self._metadata.get_range_extremes()
+        if range_extremes is None:
+            minimums, maximums = self._get_level_extremes(
+                strategy, level_index, slice_names, target_extremes, timespan_start,
+                timespan_end)
+            return self._fill_extremes(channels, target_extremes, minimums, maximums)
+
+        first_slice, last_slice = self._metadata.find_slices(
+            None, 0, timespan_start, timespan_end)
+        minimums, maximums = range_extremes.query(first_slice + 1, last_slice - 1)
+        raw_slice_names = self._metadata.get_slice_names(None, 0)
+        edge_slice_paths = [utils.get_slice_path(
+            self._preprocess_dir, utils.get_level_name(0), raw_slice_names[index])
+                            for index in sorted({first_slice, last_slice})]
+        edge_slices = LevelSlices(
+            edge_slice_paths, self._get_slice_storage(), self._max_workers,
+            self._cache, self._metadata.data.get('generation'),
+            self._single_flight, self._disk_cache)
+        for columns in edge_slices.read_columns(timespan_start, timespan_end):
+            for channel, stats in columns.get_stats().items():
+                minimums[channel] = min(minimums.get(channel, stats[STATS_MIN]),
+                                        stats[STATS_MIN])
+                maximums[channel] = max(maximums.get(channel, stats[STATS_MAX]),
+                                        stats[STATS_MAX])
+        return self._fill_extremes(channels, target_extremes, minimums, maximums)
+
+    @staticmethod
+    def _fill_extremes(channels, target_extremes, minimums, maximums):
+        """Fills in the min and max of channels that have no raw record in the timespan.
+
+        A record of the target level can be in the timespan while the raw records
+        it was reduced from are not, e.g. the average of a sparse channel, or the
+        start of its time bin. The min and max of such a channel are taken from the
+        records of the target level.
+
+        Args:
+            channels: A list of names of channels that have records in target slices.
+            target_extremes: A function of 'min' or 'max', that gets the min or max
+                power of the records of target slices keyed by channel.
+            minimums: A dict of min power keyed by channel.
+            maximums: A dict of max power keyed by channel.
+
+        Returns:
+            A tuple of two dicts, of min and max power keyed by channel.
+        """
+        missing = [channel for channel in channels
+                   if channel not in minimums or channel not in maximums]
+        if not missing:
+            return minimums, maximums
+        level_minimums = target_extremes('min')
+        level_maximums = target_extremes('max')
+        for channel in missing:
+            minimums.setdefault(channel, level_minimums[channel])
+            maximums.setdefault(channel, level_maximums[channel])
+        return minimums, maximums
+
+    def _get_level_extremes(self, strategy, level_index, slice_names, target_extremes,
+                            timespan_start, timespan_end):
+        """Gets min and max power of each channel in the timespan from a level.
+
+        The min comes from the min strategy and the max from the max strategy, so it
+        is the same as in raw data. Slices between the first and last one are fully in
+        the timespan, and their min and max are taken from the slice stats. Only the
+        first and last slices are read, unless the stats of a slice are missing.
+        If the target strategy already holds the records, no slice is read at all,
+        as for m4, which keeps the min and max of every bucket. With aggregate
+        levels, both come from the min and max of aggregates.
+
+        Args:
+            strategy: A string representing the downsampling strategy of target slices.
+            level_index: An int of the index of target level.
+            slice_names: A list of names of slices that cover the timespan.
+            target_extremes: A function of 'min' or 'max', that gets the min or max
+                power of the records of target slices keyed by channel.
+            timespan_start: An integer of the start of timespan.
+            timespan_end: An integer of the end of timespan.
+
+        Returns:
+            A tuple of two dicts, of min and max power keyed by channel.
+        """
+        level_name = utils.get_level_name(level_index)
+        extremes = dict()
+        for extreme, index in [('min', STATS_MIN), ('max', STATS_MAX)]:
+            if level_index == 0:
+                extremes[extreme] = target_extremes(extreme)
+                continue
+            tree, field = extreme, 1
+            if self._is_aggregate_levels():
+                tree = AGGREGATES
+                field = AGGREGATE_MIN if extreme == 'min' else AGGREGATE_MAX
+            if strategy in (tree, 'm4'):
+                extremes[extreme] = target_extremes(extreme)
+                continue
+
+            inner_names = slice_names[1:-1]
+            stats = dict()
+            if inner_names:
+                stats = self._metadata.get_slice_stats(tree, level_index)
+            read_names = slice_names[:1] + [
+                single_slice for single_slice in inner_names
+                if single_slice not in stats] + slice_names[1:][-1:]
+            extreme_slice_paths = [utils.get_slice_path(
+                self._preprocess_dir, level_name, single_slice, tree)
+                                   for single_slice in read_names]
+            extreme_slices = LevelSlices(
+                extreme_slice_paths, self._get_slice_storage(), self._max_workers,
+                self._cache, self._metadata.data.get('generation'),
+                self._single_flight, self._disk_cache)
+            extreme_slices.read(timespan_start, timespan_end)
+            values = getattr(extreme_slices, 'get_' + extreme)(field)
+
+            reduce = min if extreme == 'min' else max
+            for single_slice in inner_names:
+                for channel, channel_stats in stats.get(single_slice, {}).items():
+                    if channel in values:
+                        values[channel] = reduce(values[channel], channel_stats[index])
+                    else:
+                        values[channel] = channel_stats[index]
+            extremes[extreme] = values
+        return extremes['min'], extremes['max']
+
+    def _is_aggregate_levels(self):
+        """Returns if levels of the file keep aggregates in place of max, min and avg.
+
+        Returns:
+            A boolean indicating if the file has aggregate levels.
+        """
+        return self._metadata.data.get('level_mode') == AGGREGATE_LEVELS
 
     def _binary_search(self, data_list, value, reverse=False):
         """Searches the index of the left or right element closest to the given value from the list,
@@ -16,6 +16,66 @@
 
 import pytest
 from data_fetcher import DataFetcher
+from downsample import STRATEGIES
+from multiple_level_preprocess import MultipleLevelPreprocess
+from records_test_utils import START
+from records_test_utils import make_records
+from storage_backend import MemoryBackend
+from utils import convert_to_csv
+
+
+class CountingBackend(MemoryBackend):
+    """A backend in memory that keeps the paths of files read."""
+
+    def __init__(self):
+        super().__init__()
+        self.reads = list()
+
+    def get(self, path):
+        self.reads.append(path)
+        return super().get(path)
+
+
+def preprocess(records, slice_format='csv', bucket_mode='count', level_mode='strategies',
+               preprocess_storage=None):
+    """Preprocesses records in memory, and gives a fetcher of them."""
+    raw_storage = MemoryBackend()
+    raw_storage.put('raw.csv', convert_to_csv(records))
+    if preprocess_storage is None:
+        preprocess_storage = MemoryBackend()
+    assert MultipleLevelPreprocess(
+        'raw.csv', 'mld-preprocess', preprocess_storage, raw_storage).preprocess(
+            100, 10, 10, slice_format, bucket_mode=bucket_mode,
+            level_mode=level_mode) is None
+    return DataFetcher('raw.csv', 'mld-preprocess', preprocess_storage)
+
+
+def assemble_stream(lines):
+    """Assembles the lines of DataFetcher.fetch_stream() into the result of fetch()."""
+    lines = list(lines)
+    data = dict()
+    for line in lines[:-1]:
+        data.setdefault(line['name'], list()).extend(line['data'])
+    summary = lines[-1]
+    return [{'name': channel, 'data': data[channel], 'min': summary['min'][channel],
+             'max': summary['max'][channel]}
+            for channel in summary['min']], summary['frequency_ratio']
+
+
+def expected_stats(records, start, end):
+    """Counts and integrates records of each channel one at a time."""
+    stats = dict()
+    for channel in {record[2] for record in records if record[0] <= end}:
+        channel_records = [record for record in records if record[2] == channel]
+        powers = [record[1] for record in channel_records if start <= record[0] <= end]
+        energy = 0
+        for index, record in enumerate(channel_records[:-1]):
+            duration = min(channel_records[index + 1][0], end) - max(record[0], start)
+            if duration > 0:
+                energy += record[1] * duration
+        stats[channel] = (len(powers), sum(powers) / len(powers) if powers else None,
+                          energy / 1E6)
+    return stats
 
 
 class TestDataFetcher:
@@ -54,3 +114,181 @@ class TestDataFetcher:
         """Tests binary search with list of numbers in decreasing order."""
         preprocess = DataFetcher('dummy', 'dummy')
         assert preprocess._binary_search(numbers, value, True) == expected
+
+    @pytest.fixture(scope='class', params=['csv', 'bin'])
+    def fetcher(self, request):
+        """Gives a fetcher of make_records() preprocessed in each slice format."""
+        return preprocess(make_records(), request.param)
+
+    @pytest.mark.parametrize('start,end', [
+        (None, None),
+        (START + 1234, START + 56789),
+        (START + 500, START + 500),
+        (START - 10 ** 6, START + 10 ** 9),
+        (START + 5000, START + 60000),
+    ])
+    def test_fetch_stats(self, fetcher, start, end):
+        """Tests count, mean and energy of each channel, clipped to the file."""
+        records = make_records()
+        expected = expected_stats(records, START if start is None else start,
+                                  records[-1][0] if end is None else end)
+        stats = {channel['name']: channel for channel in fetcher.fetch_stats(start, end)}
+        assert set(stats) == set(expected)
+        for channel, (count, mean, energy) in expected.items():
+            assert stats[channel]['count'] == count
+            assert stats[channel]['mean'] == pytest.approx(mean)
+            assert stats[channel]['energy'] == pytest.approx(energy)
+        if start is not None and start < START:
+            assert fetcher.fetch_stats(start, end) == fetcher.fetch_stats(None, None)
+
+    def test_fetch_stats_without_records(self, fetcher):
+        """Tests channels without records in the timespan, which ended or are sparse."""
+        stats = {channel['name']: channel
+                 for channel in fetcher.fetch_stats(START + 9800, START + 19000)}
+        # SOC ended at START + 1910, its power is not held after.
+        assert stats['SOC'] == {'name': 'SOC', 'count': 0, 'mean': None, 'energy': 0}
+        # GPU is held from its record at START + 9720 until the next one.
+        assert stats['GPU']['count'] == 0
+        assert stats['GPU']['mean'] is None
+        assert stats['GPU']['energy'] == pytest.approx((200 + 97 % 7) * 9200 / 1E6)
+        assert fetcher.fetch_stats(START - 100, START - 1) == []
+
+    @pytest.mark.parametrize('slice_format', ['csv', 'bin'])
+    @pytest.mark.parametrize('bucket_mode', ['count', 'time'])
+    @pytest.mark.parametrize('level_mode', ['strategies', 'aggregates'])
+    def test_fetch_sparse_channel_extremes(self, slice_format, bucket_mode, level_mode):
+        """Tests min and max of a channel whose level records are in the timespan,
+        but whose raw records are not."""
+        records = [[START + index * 100, index % 50, 'SYS'] for index in range(1000)]
+        records += [[START + index * 2000 + 20, 100 + index % 9, 'GPU']
+                    for index in range(50)]
+        records.sort(key=lambda record: record[0])
+        fetcher = preprocess(records, slice_format, bucket_mode, level_mode)
+
+        channels = set()
+        for strategy in STRATEGIES:
+            # GPU records are at START + 8020 and START + 10020, while its average
+            # and time bins are in between.
+            data, _ = fetcher.fetch(strategy, 1, START + 8500, START + 9500)
+            for channel in data:
+                channels.add(channel['name'])
+                assert channel['min'] <= channel['max']
+                if channel['name'] == 'SYS':
+                    assert (channel['min'], channel['max']) == (35, 44)
+        if bucket_mode == 'time' or level_mode == 'strategies':
+            # Aggregates of count buckets are at the time of their first record.
+            assert 'GPU' in channels
+
+    @pytest.mark.parametrize('slice_format', ['csv', 'bin'])
+    @pytest.mark.parametrize('bucket_mode', ['count', 'time'])
+    @pytest.mark.parametrize('level_mode', ['strategies', 'aggregates'])
+    def test_fetch_stream(self, slice_format, bucket_mode, level_mode):
+        """Tests the streamed records of each slice make up the result of fetch()."""
+        fetcher = preprocess(make_records(), slice_format, bucket_mode, level_mode)
+        for strategy in STRATEGIES:
+            for number, start, end, channels in [
+                    (600, None, None, None),
+                    (7, None, None, None),
+                    (1, START + 8500, START + 9500, None),
+                    (50, START + 1234, START + 77777, None),
+                    (2000, START + 1234, START + 77777, ['GPU', 'SOC']),
+                    (10, START - 5000, START + 500, ['SYS']),
+                    (10, START + 200000, START + 300000, None)]:
+                expected = fetcher.fetch(strategy, number, start, end, channels)
+                assert assemble_stream(fetcher.fetch_stream(
+                    strategy, number, start, end, channels)) == expected
+
+    def test_fetch_stream_reads_slices_lazily(self):
+        """Tests slices of time bins are read as streamed records are consumed."""
+        storage = CountingBackend()
+        fetcher = preprocess(make_records(), 'bin', 'time', preprocess_storage=storage)
+        level0 = 'mld-preprocess/raw/level0/s'
+
+        def slices_read():
+            return [path for path in storage.reads
+                    if path.startswith(level0) and path.endswith('.bin')]
+
+        storage.reads.clear()
+        lines = fetcher.fetch_stream('m4', 2000, None, None)
+        next(lines)
+        assert len(slices_read()) == 1
+        summary = list(lines)[-1]
+        assert len(slices_read()) == len(fetcher._get_metadata().get_slice_names(None, 0))
+        assert set(summary['min']) == {'SYS', 'SOC', 'GPU'}
+
+    @pytest.fixture(scope='class')
+    def search_records(self):
+        """Generates records of a channel with one spike and one dip."""
+        records = list()
+        for index in range(1000):
+            power = index % 50
+            if index == 555:
+                power = 1000
+            elif index == 777:
+                power = -5
+            records.append([START + index * 100, power, 'SYS'])
+            if index % 3 == 0:
+                records.append([START + index * 100 + 10, 600, 'SOC'])
+        return records
+
+    @pytest.mark.parametrize('threshold,above,start,end,limit', [
+        (500, True, None, None, 10),
+        (45, True, None, None, 1),
+        (45, True, None, None, 12),
+        (45, True, START + 10050, START + 40000, 7),
+        (45, True, START + 10050, START + 40000, 10000),
+        (3, False, None, None, 5),
+        (3, False, START + 70000, START + 99900, 100),
+        (0, False, None, None, 10),
+        (1000, True, None, None, 10),
+    ])
+    def test_search(self, search_records, threshold, above, start, end, limit):
+        """Tests the first records beyond a threshold, in a timespan, up to a limit."""
+        fetcher = preprocess(search_records)
+        expected = [
+            [time, power] for time, power, channel in search_records
+            if channel == 'SYS' and (start is None or time >= start) and
+            (end is None or time <= end) and
+            (power > threshold if above else power < threshold)][:limit]
+        assert fetcher.search('SYS', threshold, above, start, end, limit) == expected
+
+    @pytest.mark.parametrize('slice_format', ['csv', 'bin'])
+    def test_search_at_slice_start(self, search_records, slice_format):
+        """Tests a match at the end of the timespan, that starts a slice, is found."""
+        fetcher = preprocess(search_records, slice_format)
+        starts = fetcher._get_metadata().get_slice_starts(None, 0)
+        assert len(starts) > 2
+        for start in starts[1:]:
+            time, power, channel = next(
+                record for record in search_records if record[0] == start)
+            assert fetcher.search(channel, power - 1, True, start, start, 1) == [
+                [time, power]]
+            assert fetcher.search(channel, power - 1, True, start - 50, start, 10)[-1] == [
+                time, power]
+
+    def test_search_prunes_slices(self, search_records):
+        """Tests only level0 slices with records beyond the threshold are read."""
+        storage = CountingBackend()
+        fetcher = preprocess(search_records, 'bin', preprocess_storage=storage)
+        level0 = 'mld-preprocess/raw/level0/s'
+
+        def slices_read():
+            paths = [path for path in storage.reads
+                     if path.startswith(level0) and path.endswith('.bin')]
+            storage.reads.clear()
+            return paths
+
+        slices_read()
+        assert fetcher.search('SYS', 500, True, None, None, 10) == [
+            [START + 55500, 1000]]
+        assert len(slices_read()) == 1
+        assert fetcher.search('SYS', 0, False, None, None, 10) == [[START + 77700, -5]]
+        assert len(slices_read()) == 1
+        # Records beyond the threshold are in the first slices, so the rest are not read.
+        assert len(fetcher.search('SYS', 45, True, None, None, 3)) == 3
+        assert len(slices_read()) == 1
+
+        assert fetcher.search('SYS', 1000, True, None, None, 10) == []
+        assert fetcher.search('SOC', 600, True, None, None, 10) == []
+        assert fetcher.search('GPU', 0, True, None, None, 10) == []
+        assert not slices_read()
@@ -0,0 +1,165 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Module for caching downloaded slices on local disk."""
+import os
+from collections import OrderedDict
+from hashlib import sha1
+from tempfile import mkstemp
+from threading import Lock
+
+from utils import mkdir
+
+TEMPORARY_SUFFIX = '.tmp'
+
+
+class DiskCache:
+    """A thread-safe LRU cache of slice files on local disk, bounded by size.
+
+    Files are keyed by path and the generation of the preprocess that wrote
+    them, like SliceCache, and named by a hash of the key. A file is written
+    under a temporary name and then renamed, so readers never see a partial
+    file. The modification time of a file is its last use, so the LRU order is
+    rebuilt from the directory when the cache is created again, e.g. after a
+    restart.
+    """
+
+    def __init__(self, directory, max_bytes):
+        """Initializes the cache with the files already in the directory.
+
+        Args:
+            directory: A string of the directory of cached files.
+            max_bytes: An int of the budget of disk space for cached files.
+        """
+        self._directory = directory
+        self._max_bytes = max_bytes
+        # key: file name, value: size in bytes, least recently used first.
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        mkdir(directory)
+        files = list()
+        for name in os.listdir(directory):
+            file_path = os.path.join(directory, name)
+            if name.endswith(TEMPORARY_SUFFIX):
+                # Left by a write that did not finish.
+                self._remove_file(file_path)
+                continue
+            stat = os.stat(file_path)
+            files.append((stat.st_mtime_ns, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self.size += size
+        with self._lock:
+            self._evict()
+
+    def get(self, path, generation):
+        """Gets the content of a cached slice.
+
+        Args:
+            path: A string of the path to the slice.
+            generation: The generation of the preprocess that wrote the slice.
+
+        Returns:
+            A bytes object of the content, None if the slice is not cached.
+        """
+        name = self._get_name(path, generation)
+        with self._lock:
+            cached = name in self._entries
+            if cached:
+                self._entries.move_to_end(name)
+        data = None
+        if cached:
+            file_path = os.path.join(self._directory, name)
+            try:
+                with open(file_path, 'rb') as filereader:
+                    data = filereader.read()
+                os.utime(file_path)
+            except FileNotFoundError:
+                # Evicted while it was being read.
+                data = None
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def put(self, path, generation, data):
+        """Caches a slice, evicting least recently used slices when over budget.
+
+        Args:
+            path: A string of the path to the slice.
+            generation: The generation of the preprocess that wrote the slice.
+            data: A bytes object of the content.
+        """
+        if len(data) > self._max_bytes:
+            return
+        name = self._get_name(path, generation)
+        descriptor, temporary_path = mkstemp(suffix=TEMPORARY_SUFFIX, dir=self._directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as filewriter:
+                filewriter.write(data)
+            os.replace(temporary_path, os.path.join(self._directory, name))
+        except OSError:
+            self._remove_file(temporary_path)
+            return
+        with self._lock:
+            self.size -= self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            self.size += len(data)
+            self._evict()
+
+    def get_stats(self):
+        """Gets the counters of the cache.
+
+        Returns:
+            A dict of the number of entries, size in bytes, hits, misses and evictions.
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def _evict(self):
+        """Removes least recently used files until the cache is within budget.
+
+        The lock must be held by the caller.
+        """
+        while self.size > self._max_bytes:
+            name, size = self._entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            self._remove_file(os.path.join(self._directory, name))
+
+    @staticmethod
+    def _get_name(path, generation):
+        """Gets the file name of a cached slice."""
+        return sha1('{}\n{}'.format(path, generation).encode()).hexdigest()
+
+    @staticmethod
+    def _remove_file(file_path):
+        """Removes a file, if it still exists."""
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
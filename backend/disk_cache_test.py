@@ -0,0 +1,96 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Test module for DiskCache Class."""
+# pylint: disable=W0212
+
+import os
+from tempfile import TemporaryDirectory
+
+import pytest
+from disk_cache import DiskCache
+
+
+class TestDiskCache:
+    """A Test Class for DiskCache Class."""
+
+    @pytest.fixture
+    def directory(self):
+        """Gives an empty directory for cached files."""
+        with TemporaryDirectory() as directory:
+            yield directory
+
+    def set_last_use(self, cache, path, generation, time):
+        """Sets the time a cached file was last used, as seen after a restart."""
+        file_path = os.path.join(cache._directory, cache._get_name(path, generation))
+        os.utime(file_path, ns=(time, time))
+
+    def test_get_put(self, directory):
+        """Tests hits and misses, by path and generation."""
+        cache = DiskCache(directory, 1000)
+        assert cache.get('f/level0/s0.bin', 1) is None
+        cache.put('f/level0/s0.bin', 1, b'0123456789')
+        assert cache.get('f/level0/s0.bin', 1) == b'0123456789'
+        assert cache.get('f/level0/s0.bin', 2) is None
+        assert cache.get_stats() == {
+            'entries': 1,
+            'size': 10,
+            'hits': 1,
+            'misses': 2,
+            'evictions': 0
+        }
+        assert len(os.listdir(directory)) == 1
+
+    def test_evict_least_recently_used(self, directory):
+        """Tests the least recently used files are removed when over budget."""
+        cache = DiskCache(directory, 30)
+        for index in range(3):
+            cache.put('s{}'.format(index), 1, b'0123456789')
+        cache.get('s0', 1)
+        cache.put('s3', 1, b'0123456789')
+
+        assert cache.get('s1', 1) is None
+        for index in [0, 2, 3]:
+            assert cache.get('s{}'.format(index), 1) == b'0123456789'
+        assert cache.evictions == 1
+        assert cache.size == 30
+        assert len(os.listdir(directory)) == 3
+
+    def test_too_large(self, directory):
+        """Tests files larger than the budget are not cached."""
+        cache = DiskCache(directory, 5)
+        cache.put('s0', 1, b'0123456789')
+        assert cache.get('s0', 1) is None
+        assert os.listdir(directory) == []
+
+    def test_restart(self, directory):
+        """Tests cached files and their order of use are kept by a new cache."""
+        cache = DiskCache(directory, 30)
+        for index in range(3):
+            cache.put('s{}'.format(index), 1, b'0123456789')
+        for index, time in [(1, 1), (2, 2), (0, 3)]:
+            self.set_last_use(cache, 's{}'.format(index), 1, time * 10 ** 9)
+        with open(os.path.join(directory, 'partial.tmp'), 'wb') as filewriter:
+            filewriter.write(b'01234')
+
+        cache = DiskCache(directory, 30)
+        assert cache.size == 30
+        assert not os.path.exists(os.path.join(directory, 'partial.tmp'))
+        cache.put('s3', 1, b'0123456789')
+        assert cache.get('s1', 1) is None
+        for index in [0, 2, 3]:
+            assert cache.get('s{}'.format(index), 1) == b'0123456789'
+
+        cache = DiskCache(directory, 15)
+        assert cache.get_stats()['entries'] == 1
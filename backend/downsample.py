@@ -18,12 +18,119 @@ Contains all of the downsample strategies. Use downsample(), and
 secondary_downsample() for downsampling records stored in files.
 """
 
+from itertools import repeat
 from math import ceil
+from operator import itemgetter
+
+import numpy as np
 
 
 FLOAT_PRECISION = 4
 SECOND_TO_MICROSECOND = 1E6
-STRATEGIES = ['max', 'min', 'avg']
+STRATEGIES = ['max', 'min', 'avg', 'lttb', 'm4']
+# Records are grouped into buckets of a constant number of records, or of a
+# constant time width.
+COUNT_BUCKETS = 'count'
+TIME_BUCKETS = 'time'
+BUCKET_MODES = [COUNT_BUCKETS, TIME_BUCKETS]
+# Strategies that time bins can be reduced by.
+TIME_BUCKET_STRATEGIES = ['max', 'min', 'avg', 'm4']
+# Aggregates keep the count, sum, min and max of buckets, so that they merge
+# exactly, and records of AGGREGATE_STRATEGIES are derived from them.
+AGGREGATES = 'agg'
+AGGREGATE_STRATEGIES = ['max', 'min', 'avg']
+# Fields of an aggregate record ([time, avg, channel, count, sum, min, max]).
+AGGREGATE_COUNT, AGGREGATE_SUM, AGGREGATE_MIN, AGGREGATE_MAX = range(3, 7)
+# Levels keep records of each strategy in a tree of its own, or aggregates in
+# one tree for all of AGGREGATE_STRATEGIES.
+STRATEGY_LEVELS = 'strategies'
+AGGREGATE_LEVELS = 'aggregates'
+LEVEL_MODES = [STRATEGY_LEVELS, AGGREGATE_LEVELS]
+
+
+def _column(records, index):
+    """Copies one field of the records into a contiguous array.
+
+    Args:
+        records: A list of records ([time, power, channel]).
+        index: An int of the field to copy, 0 for time and 1 for power.
+
+    Returns:
+        A numpy array. Integer timestamps are kept as int64 so that their sums
+        stay exact, everything else is float64.
+    """
+    if index == 0 and isinstance(records[0][0], int):
+        return np.array([record[0] for record in records])
+    return np.fromiter(map(itemgetter(index), records), np.float64, len(records))
+
+
+def _to_buckets(column, downsample_factor, fill_value):
+    """Reshapes a column into rows of downsample_factor values.
+
+    The tail bucket is padded with fill_value, so that every bucket can be
+    reduced by a single call on the 2-D array.
+
+    Args:
+        column: A 1-D numpy array.
+        downsample_factor: An int of number of values per bucket.
+        fill_value: The value used to pad the tail bucket.
+
+    Returns:
+        A 2-D numpy array of shape (number of buckets, downsample_factor).
+    """
+    number_buckets = ceil(len(column) / downsample_factor)
+    padded = np.full(number_buckets * downsample_factor,
+                     fill_value, dtype=column.dtype)
+    padded[:len(column)] = column
+    return padded.reshape(number_buckets, downsample_factor)
+
+
+def _bucket_sums(column, downsample_factor):
+    """Sums the values of each bucket.
+
+    Floats are accumulated left to right (cumsum rather than the pairwise
+    sum), so that the result is bit for bit the same as adding the values
+    one at a time.
+
+    Args:
+        column: A 1-D numpy array.
+        downsample_factor: An int of number of values per bucket.
+
+    Returns:
+        A numpy array of sums, one per bucket.
+    """
+    buckets = _to_buckets(column, downsample_factor, 0)
+    if np.issubdtype(column.dtype, np.integer):
+        return buckets.sum(axis=1)
+    return buckets.cumsum(axis=1)[:, -1]
+
+
+def max_min_indices(powers, is_max, downsample_factor):
+    """Finds the index of the maximum or minimum value of each bucket.
+
+    Args:
+        powers: A 1-D numpy array of power values.
+        is_max: A boolean indicating if using max or not.
+        downsample_factor: An int of number of values per bucket.
+
+    Returns:
+        A numpy array of indices into powers, one per bucket. Ties resolve
+        to the earliest value, the same as the builtin max and min.
+    """
+    if is_max:
+        buckets = _to_buckets(powers.astype(np.float64),
+                              downsample_factor, -np.inf)
+        offsets = buckets.argmax(axis=1)
+    else:
+        buckets = _to_buckets(powers.astype(np.float64),
+                              downsample_factor, np.inf)
+        offsets = buckets.argmin(axis=1)
+    return offsets + np.arange(len(offsets)) * downsample_factor
+
+
+def _select(records, indices):
+    """Picks the records at the given indices."""
+    return [records[index] for index in indices.tolist()]
 
 
 def _max_min_downsample(records, is_max, downsample_factor):
@@ -43,21 +150,11 @@ def _max_min_downsample(records, is_max, downsample_factor):
                 [time,power,channel1]
             ]
     """
-    if downsample_factor <= 1:
+    if downsample_factor <= 1 or not records:
         return records
 
-    number_records = ceil(len(records) / downsample_factor)
-    result = list()
-    for index in range(number_records):
-        records_in_timespan = records[index *
-                                      downsample_factor: (index+1)*downsample_factor]
-        if is_max:
-            result.append(
-                max(records_in_timespan, key=lambda record: record[1]))
-        else:
-            result.append(
-                min(records_in_timespan, key=lambda record: record[1]))
-    return result
+    return _select(records, max_min_indices(
+        _column(records, 1), is_max, downsample_factor))
 
 
 def _average_downsample(records, downsample_factor):
@@ -76,27 +173,247 @@ def _average_downsample(records, downsample_factor):
                 [time,power,channel1]
             ]
     """
-    if downsample_factor <= 1:
+    if downsample_factor <= 1 or not records:
         return records
+    return _average_columns(records, _column(records, 1), downsample_factor)
 
-    number_records = ceil(len(records) / downsample_factor)
-    result = list()
-    for index in range(number_records):
-        records_in_timespan = records[index *
-                                      downsample_factor: (index+1)*downsample_factor]
-        average = [0, 0, records_in_timespan[0][2]]
 
-        for record in records_in_timespan:
-            average[0] += record[0]
-            average[1] += record[1]
+def _average_columns(records, powers, downsample_factor):
+    """Averages records by buckets, reusing an already extracted power column.
 
-        average[0] /= len(records_in_timespan)
-        average[1] /= len(records_in_timespan)
+    Args:
+        records: A non-empty list of records ([time, power, channel]).
+        powers: A numpy array of the power values of the records.
+        downsample_factor: An int larger than 1 of number of records per bucket.
 
-        average[0] = int(average[0])
-        average[1] = round(average[1], FLOAT_PRECISION)
-        result.append(average)
-    return result
+    Returns:
+        A list of downsampled records.
+    """
+    counts = np.full(ceil(len(records) / downsample_factor), downsample_factor)
+    counts[-1] = len(records) - (len(counts) - 1) * downsample_factor
+
+    times = _column(records, 0)
+    if np.issubdtype(times.dtype, np.integer):
+        # Sums offsets from the first timestamp, so that int64 cannot overflow,
+        # and divides exact Python ints like the builtin arithmetic does.
+        base = int(times[0])
+        time_sums = _bucket_sums(times - base, downsample_factor)
+        average_times = [int((time_sum + base * count) / count)
+                         for time_sum, count in zip(time_sums.tolist(), counts.tolist())]
+    else:
+        time_sums = _bucket_sums(times, downsample_factor)
+        average_times = (time_sums / counts).astype(np.int64).tolist()
+    power_sums = _bucket_sums(powers, downsample_factor)
+    average_powers = [round(power, FLOAT_PRECISION)
+                      for power in (power_sums / counts).tolist()]
+    channels = [record[2] for record in records[::downsample_factor]]
+    return [list(average) for average in zip(average_times, average_powers, channels)]
+
+
+def lttb_indices(times, powers, downsample_factor, previous=None, next_average=None):
+    """Selects one record per bucket by Largest-Triangle-Three-Buckets.
+
+    Buckets hold downsample_factor records each, like the other strategies. The
+    record of each bucket that forms the largest triangle with the record selected
+    from the bucket before and the average of the bucket after is selected, which
+    keeps the visual shape of the records. Areas of all records of a bucket are
+    computed at once.
+
+    Args:
+        times: A numpy array of timestamps.
+        powers: A numpy array of power values.
+        downsample_factor: An int of number of records per bucket.
+        previous (optional): A tuple of time and power of the record selected before
+            the first bucket. None to select the first record of the first bucket.
+        next_average (optional): A tuple of average time and power of the bucket after
+            the last one. None to select the last record of the last bucket.
+
+    Returns:
+        A numpy array of indices into the records, one per bucket.
+    """
+    number_buckets = ceil(len(times) / downsample_factor)
+    times = times.astype(np.float64)
+    powers = powers.astype(np.float64)
+    full = len(times) // downsample_factor * downsample_factor
+    average_times = list(times[:full].reshape(-1, downsample_factor).mean(axis=1))
+    average_powers = list(powers[:full].reshape(-1, downsample_factor).mean(axis=1))
+    if full < len(times):
+        average_times.append(times[full:].mean())
+        average_powers.append(powers[full:].mean())
+
+    indices = np.empty(number_buckets, dtype=np.int64)
+    for bucket in range(number_buckets):
+        start = bucket * downsample_factor
+        end = min(start + downsample_factor, len(times))
+        if bucket == 0 and previous is None:
+            indices[bucket] = start
+            previous = (times[start], powers[start])
+            continue
+        if bucket + 1 < number_buckets:
+            next_time, next_power = average_times[bucket+1], average_powers[bucket+1]
+        elif next_average is not None:
+            next_time, next_power = next_average
+        else:
+            indices[bucket] = end - 1
+            break
+        # Twice the triangle area, with times relative to the previous record.
+        areas = np.abs((next_time - previous[0]) * (powers[start:end] - previous[1]) -
+                       (times[start:end] - previous[0]) * (next_power - previous[1]))
+        indices[bucket] = start + int(areas.argmax())
+        previous = (times[indices[bucket]], powers[indices[bucket]])
+    return indices
+
+
+def lttb_downsample(records, downsample_factor, previous=None, next_average=None):
+    """Downsamples records by Largest-Triangle-Three-Buckets.
+
+    Args:
+        records: A list of records ([time, power, channel]).
+        downsample_factor: Take one record per "downsample_factor" records.
+        previous (optional): A tuple of time and power of the record selected before
+            the records, see lttb_indices().
+        next_average (optional): A tuple of average time and power of the bucket
+            after the records, see lttb_indices().
+
+    Returns:
+        A list of downsampled records.
+    """
+    if downsample_factor <= 1 or not records:
+        return records
+    return _select(records, lttb_indices(
+        _column(records, 0), _column(records, 1), downsample_factor,
+        previous, next_average))
+
+
+def m4_indices(groups, powers):
+    """Selects the first, last, min and max record of each group.
+
+    Args:
+        groups: A sorted numpy array of the group of each record.
+        powers: A numpy array of power values.
+
+    Returns:
+        A sorted numpy array of indices of up to 4 records per group. Ties of min
+        and max resolve to the earliest record.
+    """
+    if len(groups) == 0:
+        return np.array([], dtype=np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(groups)) + 1))
+    lengths = np.diff(np.append(starts, len(groups)))
+    indices = [starts, starts + lengths - 1]
+    for reduce in [np.minimum, np.maximum]:
+        extremes = np.repeat(reduce.reduceat(powers, starts), lengths)
+        candidates = np.flatnonzero(powers == extremes)
+        indices.append(candidates[np.searchsorted(candidates, starts)])
+    return np.unique(np.concatenate(indices))
+
+
+def m4_downsample(records, downsample_factor):
+    """Downsamples records to the first, last, min and max record of each bucket.
+
+    Args:
+        records: A list of records ([time, power, channel]).
+        downsample_factor: An int of number of records per bucket.
+
+    Returns:
+        A list of up to 4 records per bucket, sorted by time.
+    """
+    if downsample_factor <= 1 or not records:
+        return records
+    return _select(records, m4_indices(
+        np.arange(len(records)) // downsample_factor, _column(records, 1)))
+
+
+def _aggregate_columns(records):
+    """Gets the count, sum, min and max of records or of aggregate records.
+
+    A record is the aggregate of count 1, with its power as sum, min and max.
+
+    Args:
+        records: A non-empty list of records, or of aggregate records.
+
+    Returns:
+        A tuple of numpy arrays of count (int64), sum, min and max.
+    """
+    if len(records[0]) > AGGREGATE_MAX:
+        return (_column(records, AGGREGATE_COUNT).astype(np.int64),
+                _column(records, AGGREGATE_SUM), _column(records, AGGREGATE_MIN),
+                _column(records, AGGREGATE_MAX))
+    powers = _column(records, 1)
+    return np.ones(len(records), dtype=np.int64), powers, powers, powers
+
+
+def _to_aggregates(times, channels, counts, sums, mins, maxs):
+    """Builds aggregate records, with the average as power.
+
+    Args:
+        times: A list of timestamps.
+        channels: An iterable of channel names.
+        counts: A numpy array of number of records of each aggregate.
+        sums: A numpy array of sum of power of each aggregate.
+        mins: A numpy array of min power of each aggregate.
+        maxs: A numpy array of max power of each aggregate.
+
+    Returns:
+        A list of aggregate records ([time, avg, channel, count, sum, min, max]).
+    """
+    return [
+        [time, round(total / count, FLOAT_PRECISION), channel, count, total,
+         minimum, maximum]
+        for time, channel, count, total, minimum, maximum in zip(
+            times, channels, counts.tolist(), sums.tolist(), mins.tolist(),
+            maxs.tolist())
+    ]
+
+
+def aggregate_downsample(records, downsample_factor):
+    """Merges buckets of records into aggregates.
+
+    Records can themselves be aggregates, whose counts and sums add up, so
+    merging aggregates of aggregates gives the same count, sum, min and max
+    as merging the records at once, whatever the size of the last bucket.
+    A bucket is timestamped by its first record, and ends where the next
+    bucket starts.
+
+    Args:
+        records: A list of records, or of aggregate records, of one channel.
+        downsample_factor: An int of number of records per bucket.
+
+    Returns:
+        A list of aggregate records ([time, avg, channel, count, sum, min, max]).
+    """
+    if not records:
+        return records
+    starts = np.arange(0, len(records), max(downsample_factor, 1))
+    counts, sums, mins, maxs = _aggregate_columns(records)
+    return _to_aggregates(
+        [records[index][0] for index in starts.tolist()],
+        [records[index][2] for index in starts.tolist()],
+        np.add.reduceat(counts, starts), np.add.reduceat(sums, starts),
+        np.minimum.reduceat(mins, starts), np.maximum.reduceat(maxs, starts))
+
+
+def aggregates_to_records(records, strategy):
+    """Derives records of a strategy from aggregate records.
+
+    Args:
+        records: A list of aggregate records.
+        strategy: A string of one of AGGREGATE_STRATEGIES.
+
+    Returns:
+        A list of records ([time, power, channel]), timestamped by start of bucket.
+    Raises:
+        TypeError: if strategy cannot be derived from aggregates.
+    """
+    if strategy == 'max':
+        index = AGGREGATE_MAX
+    elif strategy == 'min':
+        index = AGGREGATE_MIN
+    elif strategy == 'avg':
+        index = 1
+    else:
+        raise TypeError
+    return [[record[0], record[index], record[2]] for record in records]
 
 
 def strategy_reducer(records, strategy, downsample_factor):
@@ -127,6 +444,145 @@ def strategy_reducer(records, strategy, downsample_factor):
     elif strategy == 'avg':
         res = _average_downsample(
             records, downsample_factor=downsample_factor)
+    elif strategy == 'lttb':
+        res = lttb_downsample(records, downsample_factor)
+    elif strategy == 'm4':
+        res = m4_downsample(records, downsample_factor)
+    elif strategy == AGGREGATES:
+        res = aggregate_downsample(records, downsample_factor)
     else:
         raise TypeError
     return res
+
+
+def multi_strategy_reducer(records, strategies, downsample_factor):
+    """Applies several downsample strategies in a single pass over the records.
+
+    The power column is extracted once and shared by every strategy, so
+    downsampling one slice by all strategies costs about as much as by one.
+
+    Args:
+        records: A list of records ([time, power, channel]).
+        strategies: A list of strings representing downsampling strategies.
+        downsample_factor: Take one record per "downsample_factor" records.
+
+    Returns:
+        A dict of downsampled records keyed by strategy, each the same as
+        strategy_reducer(records, strategy, downsample_factor).
+    Raises:
+        TypeError: if any strategy is undefined.
+    """
+    if any(strategy not in STRATEGIES + [AGGREGATES] for strategy in strategies):
+        raise TypeError
+    if downsample_factor <= 1 or not records:
+        return {strategy: records for strategy in strategies}
+
+    powers = _column(records, 1)
+    result = dict()
+    for strategy in strategies:
+        if strategy == 'max':
+            result[strategy] = _select(records, max_min_indices(
+                powers, True, downsample_factor))
+        elif strategy == 'min':
+            result[strategy] = _select(records, max_min_indices(
+                powers, False, downsample_factor))
+        elif strategy == 'lttb':
+            result[strategy] = _select(records, lttb_indices(
+                _column(records, 0), powers, downsample_factor))
+        elif strategy == 'm4':
+            result[strategy] = _select(records, m4_indices(
+                np.arange(len(records)) // downsample_factor, powers))
+        elif strategy == AGGREGATES:
+            result[strategy] = aggregate_downsample(records, downsample_factor)
+        else:
+            result[strategy] = _average_columns(
+                records, powers, downsample_factor)
+    return result
+
+
+def time_bins(times, counts, sums, mins, maxs, bucket_width):
+    """Merges aggregates of records into fixed-width time bins.
+
+    Bins start at multiples of bucket_width, so bins of a width that is a multiple
+    of another are unions of whole bins of the other. Empty bins are skipped.
+    A record is the aggregate of count 1, with its power as sum, min and max.
+
+    Args:
+        times: A sorted numpy array of timestamps, or of starts of smaller bins.
+        counts: A numpy array of number of records of each aggregate.
+        sums: A numpy array of sum of power of each aggregate.
+        mins: A numpy array of min power of each aggregate.
+        maxs: A numpy array of max power of each aggregate.
+        bucket_width: An int of the width of bins in microseconds.
+
+    Returns:
+        A tuple of numpy arrays of non-empty bins: start time (int64), count, sum,
+        min and max.
+    """
+    if len(times) == 0:
+        return (np.array([], dtype=np.int64), counts[:0], sums[:0], mins[:0], maxs[:0])
+    bins = np.floor_divide(times, bucket_width).astype(np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bins)) + 1))
+    return (bins[starts] * bucket_width,
+            np.add.reduceat(counts, starts),
+            np.add.reduceat(sums, starts),
+            np.minimum.reduceat(mins, starts),
+            np.maximum.reduceat(maxs, starts))
+
+
+def bins_to_records(bins, strategy, channel):
+    """Converts time bins to records of a strategy, timestamped by start of bin.
+
+    Args:
+        bins: A tuple of numpy arrays as returned by time_bins().
+        strategy: A string representing downsampling strategy.
+        channel: A string of the channel of records.
+
+    Returns:
+        A list of records ([time, power, channel]), or of aggregate records for
+        AGGREGATES.
+    Raises:
+        TypeError: if strategy is undefined.
+    """
+    starts, counts, sums, mins, maxs = bins
+    if strategy == AGGREGATES:
+        return _to_aggregates(starts.tolist(), repeat(channel), counts, sums, mins, maxs)
+    if strategy == 'max':
+        powers = maxs.tolist()
+    elif strategy == 'min':
+        powers = mins.tolist()
+    elif strategy == 'avg':
+        powers = [round(power, FLOAT_PRECISION) for power in (sums / counts).tolist()]
+    else:
+        raise TypeError
+    return [[start, power, channel] for start, power in zip(starts.tolist(), powers)]
+
+
+def time_bucket_reducer(records, strategy, bucket_width):
+    """Downsamples records into fixed-width time bins, one record per non-empty bin.
+
+    Unlike strategy_reducer, the number of records in a bin depends on the
+    sampling rate, and records of all channels and strategies line up in time.
+    With m4, the first, last, min and max records of each bin are kept as they are.
+
+    Args:
+        records: A list of records ([time, power, channel]) of one channel, sorted
+            by time, or of aggregate records unless the strategy is m4.
+        strategy: A string representing downsampling strategy, or AGGREGATES.
+        bucket_width: An int of the width of bins in microseconds.
+
+    Returns:
+        A list of downsampled records, timestamped by the start of their bin unless
+        the strategy is m4.
+    Raises:
+        TypeError: if strategy is undefined, or cannot reduce time bins.
+    """
+    if strategy not in TIME_BUCKET_STRATEGIES + [AGGREGATES]:
+        raise TypeError
+    if not records:
+        return records
+    if strategy == 'm4':
+        return _select(records, m4_indices(
+            np.floor_divide(_column(records, 0), bucket_width), _column(records, 1)))
+    bins = time_bins(_column(records, 0), *_aggregate_columns(records), bucket_width)
+    return bins_to_records(bins, strategy, records[0][2])
@@ -20,7 +20,16 @@ import pytest
 
 from downsample import _average_downsample
 from downsample import _max_min_downsample
+from downsample import AGGREGATES
+from downsample import aggregate_downsample
+from downsample import aggregates_to_records
+from downsample import lttb_downsample
+from downsample import m4_downsample
+from downsample import max_min_indices
+from downsample import multi_strategy_reducer
 from downsample import strategy_reducer
+from downsample import time_bucket_reducer
+import numpy as np
 
 
 class TestDownsampleClass:
@@ -134,6 +143,38 @@ class TestDownsampleClass:
                             for index in expected_records_indices]
         assert downsample_results == expected_records
 
+    @pytest.mark.parametrize('is_max', [True, False])
+    @pytest.mark.parametrize('downsample_factor', [1, 3, 7, 10, 11])
+    def test_max_min_indices_padded_tail(self, records, is_max, downsample_factor):
+        """Tests max_min_indices picks the first extreme of every bucket,
+        including the partial tail bucket."""
+        powers = np.array([record[1] for record in records])
+        indices = max_min_indices(powers, is_max, downsample_factor)
+
+        reducer = max if is_max else min
+        expected = list()
+        for start in range(0, len(records), downsample_factor):
+            bucket = list(range(start, min(start+downsample_factor, len(records))))
+            expected.append(reducer(bucket, key=lambda index: powers[index]))
+        assert indices.tolist() == expected
+
+    def test_average_downsample_float_sequential_sum(self, records_one_channel_complex):
+        """Tests averages of float records are the same as adding them one at a time."""
+        downsample_factor = 7
+        test_result = _average_downsample(
+            records_one_channel_complex, downsample_factor)
+
+        expected = list()
+        for start in range(0, len(records_one_channel_complex), downsample_factor):
+            bucket = records_one_channel_complex[start:start+downsample_factor]
+            time_sum = power_sum = 0
+            for record in bucket:
+                time_sum += record[0]
+                power_sum += record[1]
+            expected.append([int(time_sum / len(bucket)),
+                             round(power_sum / len(bucket), 4), bucket[0][2]])
+        assert test_result == expected
+
     def test_average_downsample_max_zero_factor(self, records):
         """Tests on _average_downsample method, with max_records=0."""
         downsample_factor = 0
@@ -233,3 +274,139 @@ class TestDownsampleClass:
             assert False
         except TypeError as err:
             assert isinstance(err, TypeError)
+
+    @pytest.mark.parametrize('downsample_factor', [0, 1, 2, 3, 7, 100])
+    def test_multi_strategy_reducer(self, records_multi_channel_complex, downsample_factor):
+        """Tests multi_strategy_reducer gives the same records as each single strategy."""
+        strategies = ['max', 'min', 'avg', 'lttb', 'm4']
+        results = multi_strategy_reducer(
+            records_multi_channel_complex, strategies, downsample_factor)
+        assert sorted(results.keys()) == sorted(strategies)
+        for strategy in strategies:
+            assert results[strategy] == strategy_reducer(
+                records_multi_channel_complex, strategy, downsample_factor)
+
+        with pytest.raises(TypeError):
+            multi_strategy_reducer(
+                records_multi_channel_complex, ['max', 'not_exist'], downsample_factor)
+
+    def lttb_reference(self, records, downsample_factor):
+        """Selects records by Largest-Triangle-Three-Buckets one at a time."""
+        buckets = [records[index:index+downsample_factor]
+                   for index in range(0, len(records), downsample_factor)]
+        selected = [buckets[0][0]]
+        for index in range(1, len(buckets) - 1):
+            next_bucket = buckets[index+1]
+            next_time = sum(record[0] for record in next_bucket) / len(next_bucket)
+            next_power = sum(record[1] for record in next_bucket) / len(next_bucket)
+            previous = selected[-1]
+            selected.append(max(buckets[index], key=lambda record: abs(
+                (next_time - previous[0]) * (record[1] - previous[1]) -
+                (record[0] - previous[0]) * (next_power - previous[1]))))
+        if len(buckets) > 1:
+            selected.append(buckets[-1][-1])
+        return selected
+
+    @pytest.mark.parametrize('downsample_factor', [2, 3, 7, 10, 100])
+    def test_lttb_downsample(self, records_multi_channel_complex, downsample_factor):
+        """Tests lttb selects the same records as computing areas one at a time."""
+        records = [record for record in records_multi_channel_complex
+                   if record[2] == records_multi_channel_complex[0][2]]
+        assert strategy_reducer(records, 'lttb', downsample_factor) == \
+            self.lttb_reference(records, downsample_factor)
+
+    def test_lttb_downsample_keeps_spike(self):
+        """Tests lttb keeps a spike that avg smooths out."""
+        records = [[1573149236256988 + index * 100, 100, 'SYS'] for index in range(30)]
+        records[14][1] = 900
+        downsampled = lttb_downsample(records, 10)
+        assert [record[1] for record in downsampled] == [100, 900, 100]
+        assert downsampled[0] is records[0]
+        assert downsampled[-1] is records[-1]
+
+    def test_lttb_downsample_context(self, records_multi_channel_complex):
+        """Tests reducing records in two parts with context is the same as all at once."""
+        records = [record for record in records_multi_channel_complex
+                   if record[2] == records_multi_channel_complex[0][2]][:50]
+        first = lttb_downsample(records[:20], 5, next_average=(
+            np.mean([record[0] for record in records[20:25]]),
+            np.mean([record[1] for record in records[20:25]])))
+        second = lttb_downsample(records[20:], 5, previous=tuple(first[-1][:2]))
+        assert first + second == lttb_downsample(records, 5)
+
+    def m4_reference(self, buckets):
+        """Selects the first, last, min and max record of each bucket."""
+        selected = list()
+        for bucket in buckets:
+            powers = [record[1] for record in bucket]
+            picks = {0, len(bucket) - 1, powers.index(min(powers)), powers.index(max(powers))}
+            selected.extend(bucket[index] for index in sorted(picks))
+        return selected
+
+    @pytest.mark.parametrize('downsample_factor', [2, 3, 7, 10, 100])
+    def test_m4_downsample(self, records_multi_channel_complex, downsample_factor):
+        """Tests m4 keeps the first, last, min and max record of each bucket."""
+        records = [record for record in records_multi_channel_complex
+                   if record[2] == records_multi_channel_complex[0][2]]
+        buckets = [records[index:index+downsample_factor]
+                   for index in range(0, len(records), downsample_factor)]
+        assert m4_downsample(records, downsample_factor) == self.m4_reference(buckets)
+
+    def test_m4_downsample_time_bins(self, records):
+        """Tests m4 by time bins keeps records of each bin as they are."""
+        bucket_width = 250
+        buckets = list()
+        for record in records:
+            if not buckets or buckets[-1][0][0] // bucket_width != record[0] // bucket_width:
+                buckets.append(list())
+            buckets[-1].append(record)
+        assert time_bucket_reducer(records, 'm4', bucket_width) == self.m4_reference(buckets)
+
+    @pytest.mark.parametrize('strategy', ['max', 'min', 'avg'])
+    def test_time_bucket_reducer(self, records, strategy):
+        """Tests reducing records into time bins, timestamped by start of bin."""
+        bucket_width = 250
+        expected = list()
+        for record in records:
+            start = record[0] // bucket_width * bucket_width
+            if not expected or expected[-1][0][0] != start:
+                expected.append([[start, record[1], record[2]]])
+            expected[-1].append(record)
+        expected = [
+            [bucket[0][0], {'max': max, 'min': min}.get(
+                strategy, lambda powers: round(sum(powers) / len(powers), 4))(
+                    [record[1] for record in bucket[1:]]), bucket[0][2]]
+            for bucket in expected
+        ]
+        assert time_bucket_reducer(records, strategy, bucket_width) == expected
+
+        with pytest.raises(TypeError):
+            time_bucket_reducer(records, 'lttb', bucket_width)
+
+    @pytest.mark.parametrize('downsample_factor', [2, 3, 7, 100])
+    def test_aggregate_downsample(self, records, downsample_factor):
+        """Tests aggregates of aggregates are the same as aggregates of records."""
+        expected = list()
+        for index in range(0, len(records), downsample_factor * 4):
+            bucket = records[index:index+downsample_factor*4]
+            powers = [record[1] for record in bucket]
+            expected.append([bucket[0][0], round(sum(powers) / len(powers), 4), bucket[0][2],
+                             len(powers), sum(powers), min(powers), max(powers)])
+        merged = aggregate_downsample(
+            aggregate_downsample(records, downsample_factor), 4)
+        assert merged == expected
+        assert aggregate_downsample(records, downsample_factor * 4) == expected
+
+        assert aggregates_to_records(merged, 'max') == [
+            [record[0], record[6], record[2]] for record in expected]
+        assert aggregates_to_records(merged, 'avg') == [record[:3] for record in expected]
+        with pytest.raises(TypeError):
+            aggregates_to_records(merged, 'lttb')
+
+    def test_time_bucket_reducer_aggregates(self, records):
+        """Tests reducing aggregates into time bins is the same as reducing records."""
+        aggregates = time_bucket_reducer(records, AGGREGATES, 250)
+        for strategy in ['max', 'min', 'avg']:
+            assert aggregates_to_records(time_bucket_reducer(aggregates, AGGREGATES, 1000),
+                                         strategy) == \
+                time_bucket_reducer(records, strategy, 1000)
@@ -0,0 +1,829 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Module for building downsample levels from a stream of records.
+
+Records flow through a chain of reducers, one per level, that keep partial
+buckets in memory. Each level's slices are written as soon as they fill, so
+the whole pyramid is built without reading any level back.
+"""
+from collections import defaultdict
+from heapq import merge
+from operator import itemgetter
+
+import numpy as np
+
+from downsample import bins_to_records
+from downsample import lttb_downsample
+from downsample import m4_indices
+from downsample import multi_strategy_reducer
+from downsample import time_bins
+from level_slice import LevelSlice
+from slice_format import CSV_FORMAT
+from slice_format import from_records
+import utils
+
+
+class LevelReducer:
+    """Downsamples a stream of records by a constant factor.
+
+    Records of each channel are grouped into buckets of downsample_factor
+    records. Buckets are only reduced once they are full, the records of the
+    last, partial bucket are kept until more records arrive or flush() is called.
+    With lttb, a bucket is reduced by the average of the bucket after it, so the
+    last full bucket is kept as well.
+    With max_lag, a channel that gets no records while more than max_lag records
+    of other channels are added has its pending records reduced early, so that a
+    sparse channel, or one that ended, does not hold back the watermark. Its next
+    records start a new bucket.
+    """
+
+    def __init__(self, strategies, downsample_factor, max_lag=None):
+        """Initializes the reducer.
+
+        Args:
+            strategies: A list of strings representing downsampling strategies.
+            downsample_factor: An int of number of records per bucket.
+            max_lag: An int of number of records of other channels after which
+                pending records of a channel are reduced, None to keep them until
+                flush().
+        """
+        self._strategies = strategies
+        self._downsample_factor = downsample_factor
+        self._max_lag = max_lag
+        # key: channel name, value: records of the partial bucket.
+        self._pending = defaultdict(list)
+        # key: channel name, value: time and power of the last record selected by lttb.
+        self._lttb_previous = dict()
+        # Number of records added, and the number after the last call in which each
+        # channel got records.
+        self._number_added = 0
+        self._last_added = dict()
+
+    def add_records(self, records):
+        """Adds records and reduces all buckets that are full.
+
+        Args:
+            records: A dict of records keyed by channel, sorted by time.
+
+        Returns:
+            A dict keyed by strategy, of dicts of downsampled records keyed by channel.
+        """
+        result = {strategy: dict() for strategy in self._strategies}
+        for channel, channel_records in records.items():
+            self._number_added += len(channel_records)
+            pending = self._pending[channel]
+            pending.extend(channel_records)
+            number_full = len(pending) // self._downsample_factor * self._downsample_factor
+            if 'lttb' in self._strategies:
+                number_full -= self._downsample_factor
+            if number_full <= 0:
+                continue
+            downsampled = self._reduce(channel, pending[:number_full], pending[number_full:])
+            for strategy in self._strategies:
+                result[strategy][channel] = downsampled[strategy]
+            self._pending[channel] = pending[number_full:]
+        for channel, channel_records in records.items():
+            if channel_records:
+                self._last_added[channel] = self._number_added
+        if self._max_lag is not None:
+            self._reduce_lagging(result)
+        return result
+
+    def flush(self):
+        """Reduces the partial buckets of every channel.
+
+        Returns:
+            A dict keyed by strategy, of dicts of downsampled records keyed by channel.
+        """
+        result = {strategy: dict() for strategy in self._strategies}
+        for channel, pending in self._pending.items():
+            if not pending:
+                continue
+            downsampled = self._reduce(channel, pending, [])
+            for strategy in self._strategies:
+                result[strategy][channel] = downsampled[strategy]
+        self._pending.clear()
+        self._lttb_previous.clear()
+        return result
+
+    def watermark(self):
+        """Gets the earliest time that a future output record can have.
+
+        Returns:
+            The time of the earliest record in partial buckets, inf if there is none.
+        """
+        return min((pending[0][0] for pending in self._pending.values() if pending),
+                   default=float('inf'))
+
+    def _reduce_lagging(self, result):
+        """Reduces the pending records of channels that lag behind by over max_lag.
+
+        Args:
+            result: A dict keyed by strategy, of dicts of downsampled records keyed
+                by channel, to add the records to.
+        """
+        for channel, pending in self._pending.items():
+            if not pending or \
+                    self._number_added - self._last_added[channel] <= self._max_lag:
+                continue
+            downsampled = self._reduce(channel, pending, [])
+            for strategy in self._strategies:
+                result[strategy][channel] = \
+                    result[strategy].get(channel, []) + downsampled[strategy]
+            self._pending[channel] = list()
+
+    def _reduce(self, channel, records, next_records):
+        """Reduces buckets of records of a channel by every strategy.
+
+        Args:
+            channel: A string of the channel name.
+            records: A list of records to reduce.
+            next_records: A list of the records after them, of which the first
+                bucket is the next bucket for lttb, empty if there are none.
+
+        Returns:
+            A dict of downsampled records keyed by strategy.
+        """
+        strategies = [strategy for strategy in self._strategies if strategy != 'lttb']
+        downsampled = multi_strategy_reducer(records, strategies, self._downsample_factor)
+        if len(strategies) < len(self._strategies):
+            next_average = None
+            if next_records:
+                next_bucket = next_records[:self._downsample_factor]
+                next_average = tuple(
+                    np.fromiter(map(itemgetter(index), next_bucket), np.float64,
+                                len(next_bucket)).mean()
+                    for index in [0, 1])
+            downsampled['lttb'] = lttb_downsample(
+                records, self._downsample_factor, self._lttb_previous.get(channel),
+                next_average)
+            if downsampled['lttb']:
+                self._lttb_previous[channel] = tuple(downsampled['lttb'][-1][:2])
+        return downsampled
+
+
+class TimeLevelReducer:
+    """Downsamples a stream of aggregates into fixed-width time bins.
+
+    Aggregates are tuples of numpy arrays as returned by downsample.time_bins(),
+    so that a level can be reduced from the bins of the level below without
+    losing the number of records behind each average. The last bin of each
+    channel stays open until an aggregate of a later bin arrives, the bin ends
+    before every aggregate still to come, or flush() is called.
+    """
+
+    def __init__(self, bucket_width):
+        """Initializes the reducer.
+
+        Args:
+            bucket_width: An int of the width of bins in microseconds.
+        """
+        self.bucket_width = bucket_width
+        # key: channel name, value: aggregates of the open bin.
+        self._open = dict()
+
+    def add_bins(self, bins, earliest_next=float('-inf')):
+        """Adds aggregates and returns the bins that are complete.
+
+        Args:
+            bins: A dict of aggregates keyed by channel, sorted by time.
+            earliest_next: A number of the earliest time of aggregates added later.
+                Open bins that end before it are complete, even for channels that
+                get no aggregates, e.g. channels that ended.
+
+        Returns:
+            A dict of aggregates of complete bins keyed by channel.
+        """
+        result = dict()
+        for channel, channel_bins in bins.items():
+            if len(channel_bins[0]) == 0:
+                continue
+            if channel in self._open:
+                channel_bins = tuple(np.concatenate(columns) for columns in zip(
+                    self._open[channel], channel_bins))
+            merged = time_bins(*channel_bins, self.bucket_width)
+            self._open[channel] = tuple(column[-1:] for column in merged)
+            if len(merged[0]) > 1:
+                result[channel] = tuple(column[:-1] for column in merged)
+        for channel, open_bin in list(self._open.items()):
+            if int(open_bin[0][0]) + self.bucket_width > earliest_next:
+                continue
+            if channel in result:
+                open_bin = tuple(np.concatenate(columns) for columns in zip(
+                    result[channel], open_bin))
+            result[channel] = open_bin
+            del self._open[channel]
+        return result
+
+    def flush(self):
+        """Closes the open bin of every channel.
+
+        Returns:
+            A dict of aggregates of the open bins keyed by channel.
+        """
+        result = self._open
+        self._open = dict()
+        return result
+
+    def watermark(self):
+        """Gets the earliest time that a future output bin can start at.
+
+        Returns:
+            The earliest start of open bins, inf if there is none.
+        """
+        return min((int(channel_bins[0][0]) for channel_bins in self._open.values()),
+                   default=float('inf'))
+
+    def floor(self, time):
+        """Gets the start of the bin of a time.
+
+        Args:
+            time: A number of timestamp, or inf.
+
+        Returns:
+            The start of the bin, inf if time is inf.
+        """
+        if time == float('inf'):
+            return time
+        return time // self.bucket_width * self.bucket_width
+
+
+class M4LevelReducer:
+    """Keeps the first, last, min and max records of each group of level0 records.
+
+    Groups are group_size consecutive level0 records of a channel, or group_size
+    microseconds. A group of a level is a union of whole groups of the level below,
+    so reducing the m4 records of the level below is the same as reducing level0.
+    The last group of each channel stays open until a record of a later group
+    arrives or flush() is called. Like the buckets of LevelReducer, an open group
+    is also reduced when it ends before every record still to come, for time
+    groups, or when its channel lags behind by over max_lag records. Later records
+    of such a count group are reduced on their own, and a level above still
+    reduces the whole group from both parts.
+    """
+
+    def __init__(self, group_size, by_time, max_lag=None):
+        """Initializes the reducer.
+
+        Args:
+            group_size: An int of number of level0 records, or microseconds, per group.
+            by_time: A boolean indicating if groups are time bins.
+            max_lag: An int of number of records of other channels after which the
+                open group of a channel is reduced, None to keep it until flush().
+        """
+        self._group_size = group_size
+        self._by_time = by_time
+        self._max_lag = max_lag
+        # key: channel name, value: records of the open group and their indices.
+        self._pending = dict()
+        # Number of records added, and the number after the last call in which each
+        # channel got records.
+        self._number_added = 0
+        self._last_added = dict()
+
+    def add_records(self, records, earliest_next=float('-inf')):
+        """Adds records and reduces all groups that are complete.
+
+        Args:
+            records: A dict keyed by channel, of tuples of records sorted by time and
+                their indices among level0 records of the channel.
+            earliest_next: A number of the earliest time of records added later, so
+                that time groups that end before it are complete.
+
+        Returns:
+            A dict of tuples of m4 records and their indices, keyed by channel.
+        """
+        result = dict()
+        for channel, (channel_records, indices) in records.items():
+            if not channel_records:
+                continue
+            self._number_added += len(channel_records)
+            if channel in self._pending:
+                pending_records, pending_indices = self._pending[channel]
+                channel_records = pending_records + channel_records
+                indices = np.concatenate((pending_indices, indices))
+            if self._by_time:
+                times = np.fromiter(map(itemgetter(0), channel_records), np.float64,
+                                    len(channel_records))
+                groups = np.floor_divide(times, self._group_size).astype(np.int64)
+            else:
+                groups = indices // self._group_size
+            number_complete = int(np.searchsorted(groups, groups[-1]))
+            self._pending[channel] = (channel_records[number_complete:],
+                                      indices[number_complete:])
+            if number_complete == 0:
+                continue
+            powers = np.fromiter(map(itemgetter(1), channel_records), np.float64,
+                                 number_complete)
+            selected = m4_indices(groups[:number_complete], powers).tolist()
+            result[channel] = ([channel_records[index] for index in selected],
+                               indices[selected])
+        for channel, (channel_records, _) in records.items():
+            if channel_records:
+                self._last_added[channel] = self._number_added
+        for channel in list(self._pending):
+            channel_records, indices = self._pending[channel]
+            if self._by_time:
+                complete = (channel_records[0][0] // self._group_size + 1) * \
+                    self._group_size <= earliest_next
+            else:
+                complete = self._max_lag is not None and \
+                    self._number_added - self._last_added[channel] > self._max_lag
+            if complete:
+                group_records, group_indices = self._reduce_group(channel_records, indices)
+                if channel in result:
+                    group_records = result[channel][0] + group_records
+                    group_indices = np.concatenate((result[channel][1], group_indices))
+                result[channel] = (group_records, group_indices)
+                del self._pending[channel]
+        return result
+
+    def flush(self):
+        """Reduces the open group of every channel.
+
+        Returns:
+            A dict of tuples of m4 records and their indices, keyed by channel.
+        """
+        result = {channel: self._reduce_group(channel_records, indices)
+                  for channel, (channel_records, indices) in self._pending.items()}
+        self._pending = dict()
+        return result
+
+    @staticmethod
+    def _reduce_group(records, indices):
+        """Reduces the records of one group to its m4 records.
+
+        Args:
+            records: A list of records of the group sorted by time.
+            indices: A numpy array of their indices among level0 records.
+
+        Returns:
+            A tuple of m4 records and their indices.
+        """
+        powers = np.fromiter(map(itemgetter(1), records), np.float64, len(records))
+        selected = m4_indices(np.zeros(len(records), dtype=np.int64), powers).tolist()
+        return [records[index] for index in selected], indices[selected]
+
+    def watermark(self):
+        """Gets the earliest time that a future output record can have.
+
+        Returns:
+            The time of the earliest record in open groups, inf if there is none.
+        """
+        return min((channel_records[0][0]
+                    for channel_records, _ in self._pending.values()),
+                   default=float('inf'))
+
+
+def to_bins(records):
+    """Converts records of one channel to aggregates of one record each.
+
+    Args:
+        records: A list of records ([time, power, channel]) sorted by time.
+
+    Returns:
+        A tuple of numpy arrays of time, count, sum, min and max.
+    """
+    times = np.fromiter(map(itemgetter(0), records), np.float64, len(records))
+    powers = np.fromiter(map(itemgetter(1), records), np.float64, len(records))
+    return (times.astype(np.int64), np.ones(len(records), dtype=np.int64),
+            powers, powers, powers)
+
+
+def bins_to_strategies(bins, strategies):
+    """Converts aggregates to records of each strategy.
+
+    Args:
+        bins: A dict of aggregates keyed by channel.
+        strategies: A list of strings representing downsampling strategies.
+
+    Returns:
+        A dict keyed by strategy, of dicts of records keyed by channel.
+    """
+    return {
+        strategy: {channel: bins_to_records(channel_bins, strategy, channel)
+                   for channel, channel_bins in bins.items()}
+        for strategy in strategies
+    }
+
+
+class LevelSliceWriter:
+    """Writes the records of one level of one strategy into slices as they fill."""
+
+    def __init__(self, preprocess_dir, level, strategy, number_per_slice, bucket=None,
+                 slice_format=CSV_FORMAT, power_dtype='float64'):
+        """Initializes the writer.
+
+        Args:
+            preprocess_dir: A string of the directory of preprocess files.
+            level: A string of the level name.
+            strategy: A string representing a downsampling strategy.
+            number_per_slice: An int of records to keep for each slice.
+            bucket: A GCP bucket object or StorageBackend object for preprocess
+                files, None if local.
+            slice_format: A string of the format of saved slices.
+            power_dtype: A string of the dtype of saved power values, for binary slices.
+        """
+        self._preprocess_dir = preprocess_dir
+        self._level = level
+        self._strategy = strategy
+        self._number_per_slice = number_per_slice
+        self._bucket = bucket
+        self._slice_format = slice_format
+        self._power_dtype = power_dtype
+        # Records not saved yet, sorted by time.
+        self._pending = list()
+        # Lists of records sorted by time, added since pending records were merged.
+        self._batches = list()
+        self._number_batched = 0
+        # Number of pending records at which to look for full slices again.
+        self._next_check = number_per_slice
+
+        self.number = 0
+        self.slice_names = list()
+        self.slice_starts = list()
+        self.slice_stats = list()
+
+    def add_records(self, records, watermark):
+        """Adds records, and saves slices that are full.
+
+        Records of different channels do not arrive in time order, so only records
+        earlier than watermark are written, which keeps slices sorted across channels.
+
+        Args:
+            records: A dict of records keyed by channel, each sorted by time.
+            watermark: Every record added after this call is no earlier than it.
+        """
+        for channel_records in records.values():
+            if channel_records:
+                self._batches.append(channel_records)
+                self._number_batched += len(channel_records)
+                self.number += len(channel_records)
+        if len(self._pending) + self._number_batched < self._next_check:
+            return
+        self._merge_batches()
+        number_saved = 0
+        # Pending records are sorted, so a slice is ready if its last record is.
+        while len(self._pending) - number_saved >= self._number_per_slice and \
+                self._pending[number_saved + self._number_per_slice - 1][0] < watermark:
+            self._save(
+                self._pending[number_saved:number_saved+self._number_per_slice])
+            number_saved += self._number_per_slice
+        self._pending = self._pending[number_saved:]
+        # A lagging channel holds the watermark back, so waits for more records
+        # instead of sorting again on every call.
+        self._next_check = len(self._pending) + self._number_per_slice // 2 + 1
+
+    def close(self):
+        """Saves all remaining records."""
+        self._merge_batches()
+        for index in range(0, len(self._pending), self._number_per_slice):
+            self._save(self._pending[index:index+self._number_per_slice])
+        self._pending = list()
+
+    def _merge_batches(self):
+        """Merges the sorted batches of records into the sorted pending records."""
+        if self._batches:
+            self._pending = list(merge(self._pending, *self._batches, key=itemgetter(0)))
+            self._batches = list()
+            self._number_batched = 0
+
+    def _save(self, records):
+        """Saves records as the next slice of this level.
+
+        Args:
+            records: A list of records sorted by time.
+        """
+        slice_name = '/'.join([self._level, utils.get_slice_name(
+            len(self.slice_names), self._slice_format)])
+        slice_path = utils.get_slice_path(
+            self._preprocess_dir, self._level, slice_name, self._strategy)
+        LevelSlice(slice_path, self._bucket, self._power_dtype).save(records)
+        self.slice_names.append(slice_name)
+        self.slice_starts.append(records[0][0])
+        self.slice_stats.append(from_records(records).get_stats())
+
+
+class LevelCascade:
+    """Builds all downsample levels above level0 from a stream of level0 records.
+
+    Level1 of every strategy is reduced from level0 in a single pass, each level
+    above is reduced from the level below in the same strategy. Levels are created
+    when the level below emits its first records.
+    With a bucket width, records are reduced into time bins instead, level1 bins
+    are bucket_width wide and each level above is downsample_factor times wider.
+    Every strategy shares the same bins, which carry their counts up the levels.
+    Levels of m4 keep up to four records per bucket, and are reduced separately
+    by M4LevelReducer.
+    """
+
+    def __init__(self, preprocess_dir, strategies, downsample_factor, number_per_slice,
+                 bucket=None, slice_format=CSV_FORMAT, power_dtype='float64',
+                 bucket_width=None):
+        """Initializes the cascade.
+
+        Args:
+            preprocess_dir: A string of the directory of preprocess files.
+            strategies: A list of strings representing downsampling strategies, which
+                may include AGGREGATES for a tree of aggregate records.
+            downsample_factor: An int of downsample factor between levels.
+            number_per_slice: An int of records to keep for each slice.
+            bucket: A GCP bucket object or StorageBackend object for preprocess
+                files, None if local.
+            slice_format: A string of the format of saved slices.
+            power_dtype: A string of the dtype of saved power values, for binary slices.
+            bucket_width: An int of the width of level1 time bins in microseconds,
+                None to reduce by number of records.
+        """
+        self._preprocess_dir = preprocess_dir
+        self._strategies = strategies
+        self._downsample_factor = downsample_factor
+        self._number_per_slice = number_per_slice
+        self._bucket = bucket
+        self._slice_format = slice_format
+        self._power_dtype = power_dtype
+        self._last_time = float('-inf')
+
+        # m4 keeps records rather than one record per bucket, see M4LevelReducer.
+        self._reduced_strategies = [strategy for strategy in strategies if strategy != 'm4']
+        # A channel that lags a slice behind the others has its partial bucket
+        # reduced, so that it does not hold back the slices of every level.
+        self._raw_reducer = LevelReducer(self._reduced_strategies, downsample_factor,
+                                         number_per_slice)
+        # One dict of reducers keyed by strategy per level, feeding level2 and above.
+        self._reducers = list()
+        # One dict of writers keyed by strategy per level, from level1.
+        self._writers = list()
+        self._bucket_width = bucket_width
+        # One TimeLevelReducer per level from level1, with a bucket width.
+        self._time_reducers = list()
+        # One M4LevelReducer per level from level1, with m4.
+        self._m4_reducers = list()
+        # key: channel name, value: number of level0 records added.
+        self._raw_counts = defaultdict(int)
+
+    def add_records(self, records):
+        """Adds level0 records to the cascade.
+
+        Args:
+            records: A dict of records keyed by channel, each later than all records
+                added before.
+        """
+        for channel_records in records.values():
+            if channel_records:
+                self._last_time = max(self._last_time, channel_records[-1][0])
+        if 'm4' in self._strategies:
+            m4_records = dict()
+            for channel, channel_records in records.items():
+                if channel_records:
+                    m4_records[channel] = (channel_records, np.arange(
+                        self._raw_counts[channel],
+                        self._raw_counts[channel] + len(channel_records)))
+                    self._raw_counts[channel] += len(channel_records)
+            self._propagate_m4(m4_records)
+        if self._bucket_width is not None:
+            self._propagate_bins({channel: to_bins(channel_records)
+                                  for channel, channel_records in records.items()
+                                  if channel_records})
+            return
+        downsampled = self._raw_reducer.add_records(records)
+        watermark = min(self._last_time, self._raw_reducer.watermark())
+        self._propagate(downsampled, dict.fromkeys(self._reduced_strategies, watermark))
+
+    def close(self, number_levels):
+        """Flushes all partial buckets and saves remaining records.
+
+        Args:
+            number_levels: An int of number of levels to keep, including level0.
+                Records of levels above are dropped.
+
+        Returns:
+            A list of dicts of LevelSliceWriter objects keyed by strategy, one for
+            each level from level1.
+        """
+        if 'm4' in self._strategies:
+            self._close_m4(number_levels)
+        if self._bucket_width is not None:
+            return self._close_bins(number_levels)
+        downsampled = self._raw_reducer.flush()
+        for index in range(number_levels - 1):
+            writers = self._writer(index)
+            reducers = self._reducer(index)
+            next_downsampled = dict()
+            for strategy in self._reduced_strategies:
+                writers[strategy].add_records(downsampled[strategy], float('inf'))
+                writers[strategy].close()
+                full = reducers[strategy].add_records(
+                    downsampled[strategy])[strategy]
+                partial = reducers[strategy].flush()[strategy]
+                next_downsampled[strategy] = {
+                    channel: full.get(channel, []) + partial.get(channel, [])
+                    for channel in set(full) | set(partial)
+                }
+            downsampled = next_downsampled
+        return self._writers[:number_levels - 1]
+
+    def get_bucket_width(self, index):
+        """Gets the width of time bins of a level.
+
+        Args:
+            index: An int of the level number minus one.
+
+        Returns:
+            An int of the width in microseconds, None if reducing by number of records.
+        """
+        if self._bucket_width is None:
+            return None
+        return self._bucket_width * self._downsample_factor ** index
+
+    def _propagate(self, downsampled, watermarks):
+        """Passes downsampled records up through the levels.
+
+        Args:
+            downsampled: A dict of level1 records keyed by strategy, then by channel.
+            watermarks: A dict of level1 watermarks keyed by strategy.
+        """
+        index = 0
+        while any(downsampled[strategy] for strategy in self._reduced_strategies):
+            writers = self._writer(index)
+            reducers = self._reducer(index)
+            next_downsampled = dict()
+            next_watermarks = dict()
+            for strategy in self._reduced_strategies:
+                writers[strategy].add_records(
+                    downsampled[strategy], watermarks[strategy])
+                next_downsampled[strategy] = reducers[strategy].add_records(
+                    downsampled[strategy])[strategy]
+                next_watermarks[strategy] = min(
+                    watermarks[strategy], reducers[strategy].watermark())
+            downsampled = next_downsampled
+            watermarks = next_watermarks
+            index += 1
+
+    def _propagate_bins(self, bins):
+        """Passes level0 aggregates up through the time bin levels.
+
+        A level can only emit bins later than the open bins of the levels below
+        and the last level0 record, which bounds the records written to its slices.
+
+        Args:
+            bins: A dict of level0 aggregates keyed by channel.
+        """
+        index = 0
+        earliest_open = self._last_time
+        while bins:
+            reducer = self._time_reducer(index)
+            bins = reducer.add_bins(bins, earliest_open)
+            earliest_open = min(earliest_open, reducer.watermark())
+            watermark = reducer.floor(earliest_open)
+            writers = self._writer(index)
+            downsampled = bins_to_strategies(bins, self._reduced_strategies)
+            for strategy in self._reduced_strategies:
+                writers[strategy].add_records(downsampled[strategy], watermark)
+            index += 1
+
+    def _close_bins(self, number_levels):
+        """Closes all open time bins and saves remaining records.
+
+        Args:
+            number_levels: An int of number of levels to keep, including level0.
+
+        Returns:
+            A list of dicts of LevelSliceWriter objects keyed by strategy, one for
+            each level from level1.
+        """
+        bins = dict()
+        for index in range(number_levels - 1):
+            reducer = self._time_reducer(index)
+            complete = reducer.add_bins(bins)
+            for channel, channel_bins in reducer.flush().items():
+                if channel in complete:
+                    channel_bins = tuple(np.concatenate(columns) for columns in zip(
+                        complete[channel], channel_bins))
+                complete[channel] = channel_bins
+            bins = complete
+            writers = self._writer(index)
+            downsampled = bins_to_strategies(bins, self._reduced_strategies)
+            for strategy in self._reduced_strategies:
+                writers[strategy].add_records(downsampled[strategy], float('inf'))
+                writers[strategy].close()
+        return self._writers[:number_levels - 1]
+
+    def _propagate_m4(self, records):
+        """Passes level0 records up through the m4 levels.
+
+        Args:
+            records: A dict keyed by channel, of tuples of level0 records and their
+                indices among level0 records of the channel.
+        """
+        index = 0
+        watermark = self._last_time
+        while records:
+            reducer = self._m4_reducer(index)
+            records = reducer.add_records(records, watermark)
+            watermark = min(watermark, reducer.watermark())
+            self._writer(index)['m4'].add_records(
+                {channel: channel_records for channel, (channel_records, _) in records.items()},
+                watermark)
+            index += 1
+
+    def _close_m4(self, number_levels):
+        """Closes all open m4 groups and saves remaining records of m4 levels.
+
+        Args:
+            number_levels: An int of number of levels to keep, including level0.
+        """
+        records = dict()
+        for index in range(number_levels - 1):
+            reducer = self._m4_reducer(index)
+            complete = reducer.add_records(records)
+            for channel, (channel_records, indices) in reducer.flush().items():
+                if channel in complete:
+                    channel_records = complete[channel][0] + channel_records
+                    indices = np.concatenate((complete[channel][1], indices))
+                complete[channel] = (channel_records, indices)
+            records = complete
+            writer = self._writer(index)['m4']
+            writer.add_records(
+                {channel: channel_records for channel, (channel_records, _) in records.items()},
+                float('inf'))
+            writer.close()
+
+    def _m4_reducer(self, index):
+        """Gets the m4 reducer of the level at given index.
+
+        Args:
+            index: An int of the level number minus one.
+
+        Returns:
+            An M4LevelReducer object.
+        """
+        if index == len(self._m4_reducers):
+            if self._bucket_width is None:
+                self._m4_reducers.append(M4LevelReducer(
+                    self._downsample_factor ** (index + 1), False, self._number_per_slice))
+            else:
+                self._m4_reducers.append(M4LevelReducer(
+                    self.get_bucket_width(index), True))
+        return self._m4_reducers[index]
+
+    def _time_reducer(self, index):
+        """Gets the reducer of time bins of the level at given index.
+
+        Args:
+            index: An int of the level number minus one.
+
+        Returns:
+            A TimeLevelReducer object.
+        """
+        if index == len(self._time_reducers):
+            self._time_reducers.append(TimeLevelReducer(self.get_bucket_width(index)))
+        return self._time_reducers[index]
+
+    def _writer(self, index):
+        """Gets the writers of the level at given index, creating them if needed.
+
+        Args:
+            index: An int of the level number minus one.
+
+        Returns:
+            A dict of LevelSliceWriter objects keyed by strategy.
+        """
+        if index == len(self._writers):
+            level = utils.get_level_name(index + 1)
+            self._writers.append({
+                strategy: LevelSliceWriter(self._preprocess_dir, level, strategy,
+                                           self._number_per_slice, self._bucket,
+                                           self._slice_format, self._power_dtype)
+                for strategy in self._strategies
+            })
+        return self._writers[index]
+
+    def _reducer(self, index):
+        """Gets the reducers feeding the level above the one at given index.
+
+        Args:
+            index: An int of the level number minus one.
+
+        Returns:
+            A dict of LevelReducer objects keyed by strategy.
+        """
+        if index == len(self._reducers):
+            self._reducers.append({
+                strategy: LevelReducer([strategy], self._downsample_factor,
+                                       self._number_per_slice)
+                for strategy in self._reduced_strategies
+            })
+        return self._reducers[index]
@@ -0,0 +1,239 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Test module for LevelCascade Class."""
+# pylint: disable=W0212
+
+import os
+from collections import defaultdict
+from random import randint
+from random import seed
+from tempfile import TemporaryDirectory
+
+import pytest
+from downsample import AGGREGATES
+from downsample import STRATEGIES
+from downsample import TIME_BUCKET_STRATEGIES
+from downsample import aggregate_downsample
+from downsample import strategy_reducer
+from downsample import time_bucket_reducer
+from level_cascade import LevelCascade
+from level_cascade import LevelReducer
+from level_slice import LevelSlice
+from slice_format import from_records
+import utils
+
+
+class TestLevelCascade:
+    """A Test Class for LevelCascade Class."""
+
+    @pytest.fixture
+    def records(self):
+        """Generates sorted records of three interleaved channels."""
+        seed(0)
+        channels = ['SYS', 'PPX_ASYS', 'PP1800_SOC']
+        records = list()
+        time = 1573149236256988
+        for index in range(1000):
+            time += randint(1, 1000)
+            records.append([time, randint(0, 500), channels[index % 3]])
+        return records
+
+    def split_channels(self, records):
+        """Groups records by channel."""
+        channeled = defaultdict(list)
+        for record in records:
+            channeled[record[2]].append(record)
+        return channeled
+
+    def read_level(self, preprocess_dir, level, strategy, writer):
+        """Reads all slices written by the writer and checks they are sorted."""
+        records = list()
+        for slice_name in writer.slice_names:
+            level_slice = LevelSlice(utils.get_slice_path(
+                preprocess_dir, level, slice_name, strategy))
+            level_slice.read()
+            slice_records = sorted(
+                [record for channel in level_slice._records.values() for record in channel],
+                key=lambda record: record[0])
+            if records:
+                assert records[-1][0] <= slice_records[0][0]
+            records.extend(slice_records)
+        return records
+
+    @pytest.mark.parametrize('chunk_size', [1, 7, 100, 1000])
+    def test_level_reducer_chunks(self, records, chunk_size):
+        """Tests reducing records in chunks is the same as reducing them all at once."""
+        reducer = LevelReducer(STRATEGIES, 7)
+        results = {strategy: defaultdict(list) for strategy in STRATEGIES}
+        for index in range(0, len(records), chunk_size):
+            downsampled = reducer.add_records(
+                self.split_channels(records[index:index+chunk_size]))
+            for strategy in STRATEGIES:
+                for channel, channel_records in downsampled[strategy].items():
+                    results[strategy][channel].extend(channel_records)
+        downsampled = reducer.flush()
+        for strategy in STRATEGIES:
+            for channel, channel_records in downsampled[strategy].items():
+                results[strategy][channel].extend(channel_records)
+
+        for channel, channel_records in self.split_channels(records).items():
+            for strategy in STRATEGIES:
+                assert results[strategy][channel] == strategy_reducer(
+                    channel_records, strategy, 7)
+
+    def test_cascade_levels(self, records):
+        """Tests every level is the downsampled level below, saved in sorted slices."""
+        downsample_factor = 5
+        with TemporaryDirectory() as preprocess_dir:
+            for strategy in STRATEGIES:
+                for level in ['level1', 'level2']:
+                    os.makedirs('/'.join([preprocess_dir, strategy, level]))
+
+            cascade = LevelCascade(preprocess_dir, STRATEGIES, downsample_factor, 40)
+            for index in range(0, len(records), 64):
+                cascade.add_records(self.split_channels(records[index:index+64]))
+            level_writers = cascade.close(3)
+            assert len(level_writers) == 2
+
+            for strategy in STRATEGIES:
+                expected = self.split_channels(records)
+                for index, level in enumerate(['level1', 'level2']):
+                    writer = level_writers[index][strategy]
+                    level_records = self.read_level(
+                        preprocess_dir, level, strategy, writer)
+                    assert writer.number == len(level_records)
+                    assert writer.slice_starts == [
+                        level_records[position][0]
+                        for position in range(0, len(level_records), 40)]
+                    assert writer.slice_stats == [
+                        from_records(level_records[position:position+40]).get_stats()
+                        for position in range(0, len(level_records), 40)]
+
+                    if strategy == 'm4':
+                        # m4 groups of a level are whole groups of level0 records.
+                        group_size = downsample_factor ** (index + 1)
+                        expected = {
+                            channel: strategy_reducer(channel_records, strategy, group_size)
+                            for channel, channel_records in self.split_channels(records).items()
+                        }
+                    else:
+                        expected = {
+                            channel: strategy_reducer(channel_records, strategy,
+                                                      downsample_factor)
+                            for channel, channel_records in expected.items()
+                        }
+                    assert self.split_channels(level_records) == expected
+
+    @pytest.mark.parametrize('chunk_size', [1, 64, 1000])
+    def test_cascade_aggregates(self, records, chunk_size):
+        """Tests every level of aggregates is the same as aggregating level0 at once."""
+        downsample_factor = 3
+        with TemporaryDirectory() as preprocess_dir:
+            for level in ['level1', 'level2', 'level3', 'level4', 'level5']:
+                os.makedirs('/'.join([preprocess_dir, AGGREGATES, level]))
+
+            cascade = LevelCascade(preprocess_dir, [AGGREGATES], downsample_factor, 40)
+            for index in range(0, len(records), chunk_size):
+                cascade.add_records(self.split_channels(records[index:index+chunk_size]))
+            level_writers = cascade.close(3)
+
+            for index, level in enumerate(['level1', 'level2']):
+                writer = level_writers[index][AGGREGATES]
+                level_records = self.read_level(preprocess_dir, level, AGGREGATES, writer)
+                expected = {
+                    channel: aggregate_downsample(
+                        channel_records, downsample_factor ** (index + 1))
+                    for channel, channel_records in self.split_channels(records).items()
+                }
+                assert self.split_channels(level_records) == expected
+                assert writer.slice_stats[0]['SYS'][0] == \
+                    sum(record[3] for record in level_records[:40] if record[2] == 'SYS')
+
+    @pytest.mark.parametrize('chunk_size', [1, 64, 1000])
+    def test_cascade_time_bins(self, records, chunk_size):
+        """Tests every level is the raw records reduced into time bins of its width."""
+        downsample_factor = 4
+        bucket_width = 2000
+        strategies = TIME_BUCKET_STRATEGIES + [AGGREGATES]
+        with TemporaryDirectory() as preprocess_dir:
+            for strategy in strategies:
+                # Levels above the kept ones may fill slices before close().
+                for level in ['level1', 'level2', 'level3', 'level4', 'level5']:
+                    os.makedirs('/'.join([preprocess_dir, strategy, level]))
+
+            cascade = LevelCascade(preprocess_dir, strategies, downsample_factor, 40,
+                                   bucket_width=bucket_width)
+            for index in range(0, len(records), chunk_size):
+                cascade.add_records(self.split_channels(records[index:index+chunk_size]))
+            level_writers = cascade.close(3)
+            assert len(level_writers) == 2
+
+            for strategy in strategies:
+                for index, level in enumerate(['level1', 'level2']):
+                    writer = level_writers[index][strategy]
+                    level_records = self.read_level(
+                        preprocess_dir, level, strategy, writer)
+                    assert writer.number == len(level_records)
+
+                    width = bucket_width * downsample_factor ** index
+                    expected = {
+                        channel: time_bucket_reducer(channel_records, strategy, width)
+                        for channel, channel_records in self.split_channels(records).items()
+                    }
+                    assert self.split_channels(level_records) == expected
+                    if strategy != 'm4':
+                        assert all(record[0] % width == 0 for record in level_records)
+
+    @pytest.mark.parametrize('bucket_width', [None, 2000])
+    @pytest.mark.parametrize('sparse_every', [None, 200])
+    def test_cascade_lagging_channel(self, bucket_width, sparse_every):
+        """Tests slices are saved before close() when a channel ends early or is sparse."""
+        records = list()
+        time = 1573149236256988
+        for index in range(20000):
+            time += 100
+            if (index < 5) if sparse_every is None else (index % sparse_every == 0):
+                records.append([time, index % 7, 'SOC'])
+            records.append([time, index % 11, 'SYS'])
+        strategies = STRATEGIES + [AGGREGATES] if bucket_width is None else \
+            TIME_BUCKET_STRATEGIES + [AGGREGATES]
+        with TemporaryDirectory() as preprocess_dir:
+            for strategy in strategies:
+                for level in ['level1', 'level2', 'level3', 'level4', 'level5']:
+                    os.makedirs('/'.join([preprocess_dir, strategy, level]))
+
+            cascade = LevelCascade(preprocess_dir, strategies, 4, 40,
+                                   bucket_width=bucket_width)
+            for index in range(0, len(records), 64):
+                cascade.add_records(self.split_channels(records[index:index+64]))
+            for strategy in strategies:
+                writer = cascade._writers[0][strategy]
+                assert len(writer.slice_names) >= writer.number // 40 - 3
+                assert len(writer._pending) + writer._number_batched < 4 * 40
+            level_writers = cascade.close(3)
+
+            for strategy in strategies:
+                for index, level in enumerate(['level1', 'level2']):
+                    writer = level_writers[index][strategy]
+                    level_records = self.read_level(
+                        preprocess_dir, level, strategy, writer)
+                    assert writer.number == len(level_records)
+                    if bucket_width is not None:
+                        # Bins are closed once every record after them is later.
+                        width = bucket_width * 4 ** index
+                        assert self.split_channels(level_records) == {
+                            channel: time_bucket_reducer(channel_records, strategy, width)
+                            for channel, channel_records in
+                            self.split_channels(records).items()}
@@ -17,28 +17,31 @@ from collections import defaultdict
 from math import ceil
 
 from downsample import strategy_reducer
-from utils import convert_to_csv
-from utils import parse_csv_line
+import slice_format
+from storage_backend import get_backend
 
 
 class LevelSlice:
     """A class for processing slice and its records."""
 
-    def __init__(self, filename, bucket=None):
+    def __init__(self, filename, bucket=None, power_dtype='float64'):
         """Initialises slice object.
 
         filename is used to load and save for single slice, and filenames is used to
-        read multiple slices at the same time.
+        read multiple slices at the same time. The slice format is given by the
+        extension of filename.
 
         Args:
             filename: A string of the path to the slice.
-            bucket: An bucket object.
+            bucket: A bucket object or a StorageBackend object, None for local disk.
+            power_dtype: A string of the dtype of saved power values, for binary slices.
 
         Raises:
             TypeError: Both arguments are None.
         """
         self._filename = filename
-        self._bucket = bucket
+        self._storage = get_backend(bucket)
+        self._power_dtype = power_dtype
 
         # key: channel name, value: list of records.
         self._records = defaultdict(list)
@@ -48,19 +51,15 @@ class LevelSlice:
         """Reads records from slice file."""
         if self._filename is None:
             return
-        lines = []
-        if self._bucket is None:
-            with open(self._filename, 'r') as filereader:
-                lines = filereader.readlines()
-        else:
-            blob = self._bucket.blob(self._filename)
-            lines = blob.download_as_string().decode().split('\n')
-        for line in lines:
-            record = parse_csv_line(line)
-            if record:
-                if self._start == -1:
-                    self._start = record[0]
-                self._records[record[2]].append(record)
+        data = self._storage.get(self._filename)
+        columns = slice_format.decode(
+            data, slice_format.get_slice_format(self._filename))
+        if len(columns) == 0:
+            return
+        if self._start == -1:
+            self._start = columns.times[0].item()
+        for channel, records in columns.to_records().items():
+            self._records[channel].extend(records)
 
     def get_first_timestamp(self):
         """Gets the earliest time of record in this slice, or all slices from _filenames."""
@@ -79,14 +78,9 @@ class LevelSlice:
                 records_list.extend(channeled_records)
             records_list = sorted(records_list, key=lambda record: record[0])
 
-        data_csv = convert_to_csv(records_list)
-        if self._bucket is None:
-            with open(self._filename, 'w') as filewriter:
-                filewriter.write(data_csv)
-                filewriter.flush()
-        else:
-            blob = self._bucket.blob(self._filename)
-            blob.upload_from_string(data_csv)
+        data = slice_format.encode(
+            records_list, slice_format.get_slice_format(self._filename), self._power_dtype)
+        self._storage.put(self._filename, data)
 
     def get_records_count(self):
         """Gets number of records in this slice."""
@@ -160,6 +160,24 @@ class TestLevelClass:
 
         tmpfile.close()
 
+    @pytest.mark.parametrize('power_dtype', ['float32', 'float64'])
+    def test_save_binary(self, test_records1, test_records2, power_dtype):
+        """Tests if records saved in binary format are read back."""
+        tmpfile = NamedTemporaryFile(suffix='.bin')
+        test_save_slice = LevelSlice(tmpfile.name, power_dtype=power_dtype)
+
+        formatted_test_records = {
+            test_records1[0][2]: test_records1, test_records2[0][2]: test_records2}
+        test_save_slice.add_records(formatted_test_records)
+        test_save_slice.save()
+
+        test_read_slice = LevelSlice(tmpfile.name)
+        test_read_slice.read()
+        assert test_read_slice._records == formatted_test_records
+        assert test_read_slice.get_first_timestamp() == test_records1[0][0]
+
+        tmpfile.close()
+
     @pytest.mark.parametrize('strategy', ['max', 'min', 'avg'])
     @pytest.mark.parametrize('factor', [1, 2, 4, 6, 8, 10, 100])
     def test_downsample_factor(self, test_records1, strategy, factor):
@@ -14,18 +14,48 @@
 
 """A Module for reading multiple slices."""
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from math import ceil
+from operator import itemgetter
 
+import numpy as np
+
+from downsample import aggregates_to_records
 from downsample import strategy_reducer
-from utils import parse_csv_line
+from downsample import time_bucket_reducer
+from level_cascade import LevelReducer
+import slice_format
+from storage_backend import get_backend
+
+MAX_DOWNLOAD_WORKERS = 8
 
 
 class LevelSlices:
     """A class for reading reacords from multiple slices."""
 
-    def __init__(self, filenames, bucket=None):
+    def __init__(self, filenames, bucket=None, max_workers=MAX_DOWNLOAD_WORKERS,
+                 cache=None, generation=None, single_flight=None, disk_cache=None):
+        """Initializes the reader.
+
+        Args:
+            filenames: A list of paths to slices, sorted by time.
+            bucket: A GCP bucket object or a StorageBackend object for slices, None
+                if they are stored locally.
+            max_workers: An int of the maximum number of slices downloaded at once.
+            cache: A SliceCache object of decoded slices, None to always download.
+            generation: The generation of the preprocess that wrote the slices.
+            single_flight: A SingleFlight object, so that a slice read by concurrent
+                readers is downloaded once, None to always download.
+            disk_cache: A DiskCache object of downloaded slices, checked when a slice
+                is not in cache, None to always download.
+        """
         self._filenames = filenames
-        self._bucket = bucket
+        self._storage = get_backend(bucket)
+        self._max_workers = max_workers
+        self._cache = cache
+        self._generation = generation
+        self._single_flight = single_flight
+        self._disk_cache = disk_cache
         self._records = defaultdict(list)
         self._minList = defaultdict(float)
         self._maxList = defaultdict(float)
@@ -34,42 +64,159 @@ class LevelSlices:
         """Reads and loads records from a set of slices, only records in the range
         are included.
 
+        Slices are sorted and consecutive in time, so only the first and the last
+        slice can have records out of the range. Records of the other slices are
+        all included without looking at their timestamps.
+        Slices are downloaded concurrently, up to max_workers at a time, and their
+        records are merged in slice order.
+
         Args:
             start: An int for start time.
             end: An int for end time.
         """
-        for slice_path in self._filenames:
-            lines = []
-            if self._bucket is None:
-                with open(slice_path, 'r') as filereader:
-                    lines = filereader.readlines()
-            else:
-                blob = self._bucket.blob(slice_path)
-                lines = blob.download_as_string().decode().split('\n')
-            for line in lines:
-                record = parse_csv_line(line)
-                if record and (start is None or start <=
-                               record[0]) and (end is None or record[0] <= end):
-                    self._records[record[2]].append(record)
+        for columns in self.read_columns(start, end):
+            for channel, records in columns.to_records().items():
+                self._records[channel].extend(records)
+
+    def read_columns(self, start, end):
+        """Reads the columns of each slice, only records in the range are included.
+
+        Args:
+            start: An int for start time, None if unbounded.
+            end: An int for end time, None if unbounded.
+
+        Returns:
+            A list of SliceColumns objects, one per slice in order.
+        """
+        last_index = len(self._filenames) - 1
+
+        def read_slice(index):
+            return self._read_slice(self._filenames[index],
+                                    start if index == 0 else None,
+                                    end if index == last_index else None)
+
+        number_workers = min(self._max_workers, len(self._filenames))
+        if number_workers > 1:
+            with ThreadPoolExecutor(number_workers) as executor:
+                return list(executor.map(read_slice, range(len(self._filenames))))
+        return [read_slice(index) for index in range(len(self._filenames))]
+
+    def iter_columns(self, start, end):
+        """Reads the columns of each slice as they are consumed, one slice at a time.
+
+        Args:
+            start: An int for start time, None if unbounded.
+            end: An int for end time, None if unbounded.
+
+        Yields:
+            A SliceColumns object of each slice in order, only records in the range
+            included.
+        """
+        last_index = len(self._filenames) - 1
+        for index, slice_path in enumerate(self._filenames):
+            yield self._read_slice(slice_path, start if index == 0 else None,
+                                   end if index == last_index else None)
+
+    def _read_slice(self, slice_path, start, end):
+        """Reads the records of one slice in the range.
+
+        Args:
+            slice_path: A string of the path to the slice.
+            start: An int for start time, None if unbounded.
+            end: An int for end time, None if unbounded.
+
+        Returns:
+            A SliceColumns object.
+        """
+        if self._cache is not None:
+            columns = self._cache.get(slice_path, self._generation)
+            if columns is not None:
+                return columns.trim(start, end)
+
+        if self._single_flight is not None:
+            columns = self._single_flight.do((slice_path, self._generation),
+                                             lambda: self._load_slice(slice_path))
+            return columns.trim(start, end)
+        if self._cache is None:
+            return slice_format.decode(self._get_slice_data(slice_path),
+                                       slice_format.get_slice_format(slice_path),
+                                       start, end)
+        return self._load_slice(slice_path).trim(start, end)
+
+    def _load_slice(self, slice_path):
+        """Downloads and decodes all records of one slice, and caches them.
+
+        Args:
+            slice_path: A string of the path to the slice.
+
+        Returns:
+            A SliceColumns object.
+        """
+        columns = slice_format.decode(self._get_slice_data(slice_path),
+                                      slice_format.get_slice_format(slice_path))
+        if self._cache is not None:
+            self._cache.put(slice_path, self._generation, columns)
+        return columns
+
+    def _get_slice_data(self, slice_path):
+        """Gets the content of one slice, from disk cache or else from storage.
+
+        Args:
+            slice_path: A string of the path to the slice.
+
+        Returns:
+            A bytes object of the content of the slice.
+        """
+        if self._disk_cache is None:
+            return self._storage.get(slice_path)
+        data = self._disk_cache.get(slice_path, self._generation)
+        if data is None:
+            data = self._storage.get(slice_path)
+            self._disk_cache.put(slice_path, self._generation, data)
+        return data
+
+    def select_channels(self, channels):
+        """Drops the records of channels that are not selected.
+
+        Args:
+            channels: A list of names of channels to keep.
+        """
+        for channel in [channel for channel in self._records if channel not in channels]:
+            del self._records[channel]
+
+    def get_channels(self):
+        """Gets the channels of the records read.
+
+        Returns:
+            A list of channel names.
+        """
+        return list(self._records.keys())
 
     def get_records_count(self):
         """Gets number of records in this slice."""
         number = sum(len(channel) for channel in self._records.values())
         return number
 
-    def downsample(self, strategy, downsample_factor=1, max_records=None):
+    def downsample(self, strategy, downsample_factor=1, max_records=None, bucket_width=None):
         """Downsamples the records in this slice.
 
         Args:
             strategy: A string representing downsampling strategy.
             downsample_factor: Take one record per "downsample_factor" records.
             max_records: An int of threshold for each channel after downsampling.
+            bucket_width: An int of the width of time bins in microseconds. If given,
+                records are reduced by time bin, and the other arguments are
+                ignored.
 
         Returns:
             A dict of downsampled records.
         """
 
         for channel in self._records.keys():
+            if bucket_width is not None:
+                self._records[channel] = time_bucket_reducer(
+                    self._records[channel], strategy, bucket_width)
+                continue
             if max_records is not None:
                 downsample_factor = ceil(
                     len(self._records[channel]) / max_records)
@@ -77,40 +224,130 @@ class LevelSlices:
                 self._records[channel], strategy, downsample_factor)
         return self._records
 
-    def format_response(self, minList: defaultdict(float), maxList: defaultdict(float)):
+    def convert_aggregates(self, strategy):
+        """Converts aggregate records to records of a strategy.
+
+        Args:
+            strategy: A string of one of AGGREGATE_STRATEGIES.
+
+        Returns:
+            A dict of converted records.
+        """
+        for channel in self._records.keys():
+            self._records[channel] = aggregates_to_records(self._records[channel], strategy)
+        return self._records
+
+    def format_response(self, minList=None, maxList=None):
         """Gets current data in dict type for http response.
 
+        Args:
+            minList: A dict of min power keyed by channel, None to leave it out.
+            maxList: A dict of max power keyed by channel, None to leave it out.
+
         Returns:
             A dict of data indicating the name of channel and its data.
         """
         response = list()
         for channel in self._records.keys():
-            response.append({
+            channel_response = {
                 'name': channel,
                 'data': [[record[0], record[1]] for record in self._records[channel]],
-                'min': minList[channel],
-                'max': maxList[channel],
-            })
+            }
+            if minList is not None:
+                channel_response['min'] = minList[channel]
+            if maxList is not None:
+                channel_response['max'] = maxList[channel]
+            response.append(channel_response)
         return response
 
-    def get_min(self):
+    def get_min(self, index=1):
         if self._records is not None:
             for channel in self._records.keys():
                 channelData = self._records[channel]
-                min = channelData[0][1]
+                min = channelData[0][index]
                 for data in channelData:
-                    if data[1] < min:
-                        min = data[1]
+                    if data[index] < min:
+                        min = data[index]
                 self._minList[channel] = min
         return self._minList
 
-    def get_max(self):
+    def get_max(self, index=1):
         if self._records is not None:
             for channel in self._records.keys():
                 channelData = self._records[channel]
-                max = channelData[0][1]
+                max = channelData[0][index]
                 for data in channelData:
-                    if data[1] > max:
-                        max = data[1]
-                self._minList[channel] = max
-        return self._minList
\ No newline at end of file
+                    if data[index] > max:
+                        max = data[index]
+                self._maxList[channel] = max
+        return self._maxList
+
+
+class ChannelReducer:
+    """Downsamples the records of one channel as they are read, slice by slice.
+
+    Records are reduced the same as LevelSlices.downsample() reduces all records of
+    the channel at once, by buckets of downsample_factor records, or by time bins of
+    bucket_width. Only the records of the partial bucket, or of the open bin, are
+    kept until more records are added or flush() is called.
+    """
+
+    def __init__(self, channel, strategy, downsample_factor=1, bucket_width=None):
+        """Initializes the reducer.
+
+        Args:
+            channel: A string of the channel name.
+            strategy: A string representing downsampling strategy.
+            downsample_factor: An int of number of records per bucket.
+            bucket_width: An int of the width of time bins in microseconds. If given,
+                records are reduced by time bin, and downsample_factor is ignored.
+        """
+        self._channel = channel
+        self._strategy = strategy
+        self._downsample_factor = downsample_factor
+        self._bucket_width = bucket_width
+        self._reducer = None
+        # Buckets of one record are reduced on their own.
+        if bucket_width is None and downsample_factor > 1:
+            self._reducer = LevelReducer([strategy], downsample_factor)
+        # Records of the open time bin.
+        self._pending = list()
+
+    def add_records(self, records):
+        """Adds records and reduces the buckets, or time bins, that are complete.
+
+        Args:
+            records: A list of records of the channel, sorted by time, after the
+                records added before.
+
+        Returns:
+            A list of downsampled records.
+        """
+        if self._reducer is not None:
+            downsampled = self._reducer.add_records({self._channel: records})
+            return downsampled[self._strategy].get(self._channel, [])
+        if self._bucket_width is None:
+            return strategy_reducer(records, self._strategy, self._downsample_factor)
+        records = self._pending + records
+        if not records:
+            return records
+        bins = np.floor_divide(np.fromiter(map(itemgetter(0), records), np.int64,
+                                           len(records)), self._bucket_width)
+        number_complete = int(np.searchsorted(bins, bins[-1]))
+        self._pending = records[number_complete:]
+        return time_bucket_reducer(records[:number_complete], self._strategy,
+                                   self._bucket_width)
+
+    def flush(self):
+        """Reduces the partial bucket, or the open time bin.
+
+        Returns:
+            A list of downsampled records.
+        """
+        if self._reducer is not None:
+            return self._reducer.flush()[self._strategy].get(self._channel, [])
+        if self._bucket_width is None:
+            return list()
+        records = self._pending
+        self._pending = list()
+        return time_bucket_reducer(records, self._strategy, self._bucket_width)
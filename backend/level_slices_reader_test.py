@@ -17,9 +17,19 @@
 
 import os
 from tempfile import NamedTemporaryFile
+from tempfile import TemporaryDirectory
 
 import pytest
+from downsample import AGGREGATES
+from downsample import STRATEGIES
+from downsample import TIME_BUCKET_STRATEGIES
+from downsample import strategy_reducer
+from downsample import time_bucket_reducer
+from level_slices_reader import ChannelReducer
 from level_slices_reader import LevelSlices
+from disk_cache import DiskCache
+from single_flight import SingleFlight
+from slice_cache import SliceCache
 from utils import convert_to_csv
 
 
@@ -119,3 +129,101 @@ class TestLevelSlices:
 
         tmpfile1.close()
         tmpfile2.close()
+
+    @pytest.mark.parametrize('max_workers', [1, 2, 8])
+    def test_read_slices_in_order(self, test_records1, test_records2, max_workers):
+        """Tests records of concurrently read slices are merged in slice order."""
+        chunks = [test_records1[index:index+3] for index in range(0, len(test_records1), 3)]
+        chunks += [test_records2[index:index+2] for index in range(0, len(test_records2), 2)]
+        tmpfiles = [self.write_to_tmpfile(chunk) for chunk in chunks]
+
+        test_slice = LevelSlices([tmpfile.name for tmpfile in tmpfiles],
+                                 max_workers=max_workers)
+        test_slice.read(None, None)
+        assert test_slice._records['PPX_ASYS'] == test_records1
+        assert test_slice._records['SYS'] == test_records2
+
+        for tmpfile in tmpfiles:
+            tmpfile.close()
+
+    def test_read_slices_cached(self, test_records1, test_records2):
+        """Tests cached slices are read without opening the files again."""
+        tmpfile1 = self.write_to_tmpfile(test_records1)
+        tmpfile2 = self.write_to_tmpfile(test_records2)
+        cache = SliceCache(1024 * 1024)
+
+        test_slice = LevelSlices([tmpfile1.name, tmpfile2.name], cache=cache, generation=1)
+        test_slice.read(None, None)
+        tmpfile1.close()
+        tmpfile2.close()
+
+        test_slice = LevelSlices([tmpfile1.name, tmpfile2.name], cache=cache, generation=1)
+        test_slice.read(test_records1[-1][0], test_records2[0][0])
+        assert test_slice._records['PPX_ASYS'] == [test_records1[-1]]
+        assert test_slice._records['SYS'] == [test_records2[0]]
+        assert cache.hits == 2
+        assert cache.misses == 2
+
+        with pytest.raises(FileNotFoundError):
+            LevelSlices([tmpfile1.name], cache=cache, generation=2).read(None, None)
+
+    @pytest.mark.parametrize('cached', [False, True])
+    def test_read_slices_single_flight(self, test_records1, test_records2, cached):
+        """Tests slices read through single flight are trimmed for each reader."""
+        tmpfile1 = self.write_to_tmpfile(test_records1)
+        tmpfile2 = self.write_to_tmpfile(test_records2)
+        single_flight = SingleFlight()
+        cache = SliceCache(1024 * 1024) if cached else None
+
+        test_slice = LevelSlices([tmpfile1.name, tmpfile2.name], cache=cache,
+                                 generation=1, single_flight=single_flight)
+        test_slice.read(test_records1[-1][0], test_records2[0][0])
+        assert test_slice._records['PPX_ASYS'] == [test_records1[-1]]
+        assert test_slice._records['SYS'] == [test_records2[0]]
+        assert single_flight.calls == 2
+        if cached:
+            assert cache.size > 0
+
+        tmpfile1.close()
+        tmpfile2.close()
+
+    def test_read_slices_disk_cached(self, test_records1, test_records2):
+        """Tests slices on disk cache are read without opening the files again."""
+        tmpfile1 = self.write_to_tmpfile(test_records1)
+        tmpfile2 = self.write_to_tmpfile(test_records2)
+        with TemporaryDirectory() as directory:
+            disk_cache = DiskCache(directory, 1024 * 1024)
+            test_slice = LevelSlices([tmpfile1.name, tmpfile2.name], generation=1,
+                                     disk_cache=disk_cache)
+            test_slice.read(None, None)
+            tmpfile1.close()
+            tmpfile2.close()
+
+            test_slice = LevelSlices([tmpfile1.name, tmpfile2.name], generation=1,
+                                     cache=SliceCache(1024 * 1024), disk_cache=disk_cache)
+            test_slice.read(test_records1[-1][0], test_records2[0][0])
+            assert test_slice._records['PPX_ASYS'] == [test_records1[-1]]
+            assert test_slice._records['SYS'] == [test_records2[0]]
+            assert disk_cache.hits == 2
+            assert disk_cache.misses == 2
+
+    @pytest.mark.parametrize('strategy,downsample_factor,bucket_width', [
+        (strategy, downsample_factor, None) for strategy in STRATEGIES + [AGGREGATES]
+        for downsample_factor in [1, 3, 10]] + [
+            (strategy, 1, bucket_width) for strategy in TIME_BUCKET_STRATEGIES + [AGGREGATES]
+            for bucket_width in [250, 1000]])
+    def test_channel_reducer(self, strategy, downsample_factor, bucket_width):
+        """Tests records reduced slice by slice are the same as reduced at once."""
+        records = [[1573149236256988 + index * 100 + index % 7, (index * 37) % 101, 'SYS']
+                   for index in range(200)]
+        if bucket_width is None:
+            expected = strategy_reducer(records, strategy, downsample_factor)
+        else:
+            expected = time_bucket_reducer(records, strategy, bucket_width)
+
+        reducer = ChannelReducer('SYS', strategy, downsample_factor, bucket_width)
+        downsampled = list()
+        for start, end in [(0, 7), (7, 7), (7, 50), (50, 51), (51, 130), (130, 200)]:
+            downsampled.extend(reducer.add_records(records[start:end]))
+        downsampled.extend(reducer.flush())
+        assert downsampled == expected
@@ -15,29 +15,80 @@
 
 Expose HTTP endpoints for triggering preprocess and send downsampled data.
 """
+from json import dumps
 from json import loads
+from os import environ
+from flask import Response
 from flask import redirect
 from flask import request
 from flask import jsonify
+from flask import stream_with_context
 from flask import Flask
 from flask_cors import CORS
-from google.cloud import storage
 
 from data_fetcher import DataFetcher
+from disk_cache import DiskCache
+from downsample import BUCKET_MODES
+from downsample import COUNT_BUCKETS
+from downsample import LEVEL_MODES
 from downsample import STRATEGIES
+from downsample import STRATEGY_LEVELS
+from metadata import COPY_LEVEL0
+from metadata import LEVEL0_MODES
+from metadata_cache import MetadataCache
 from multiple_level_preprocess import MultipleLevelPreprocess
+from response_cache import ResponseCache
+from response_encoding import BINARY_MIMETYPE
+from response_encoding import encode_binary
+from single_flight import SingleFlight
+from slice_cache import SliceCache
+from slice_format import POWER_DTYPES
+from slice_format import SLICE_FORMATS
+from storage_backend import get_backend
+from storage_client import StorageClient
 from utils import warning
 
 DOWNSAMPLE_LEVEL_FACTOR = 100
+MAX_DOWNLOAD_WORKERS = 8
 MINIMUM_NUMBER_OF_RECORDS_LEVEL = 600
 NUMBER_OF_RECORDS_PER_REQUEST = 600
 NUMBER_OF_RECORDS_PER_SLICE = 100000
 PREPROCESS_BUCKET = 'power-data-preprocess'
 PREPROCESS_DIR = 'mld-preprocess'
 RAW_BUCKET = 'power-data-raw'
+SLICE_FORMAT = 'bin'
+POWER_DTYPE = 'float64'
+BUCKET_MODE = COUNT_BUCKETS
+LEVEL_MODE = STRATEGY_LEVELS
+LEVEL0_MODE = COPY_LEVEL0
+# Memory of the instance class, 1GB for the B4 of app.yaml. The caches below are
+# sized from it, and take 320MB in total on a B4, leaving the rest to requests
+# and preprocessing.
+INSTANCE_MEMORY_BYTES = int(environ.get('INSTANCE_MEMORY_MB', 1024)) * 1024 * 1024
+SLICE_CACHE_BYTES = INSTANCE_MEMORY_BYTES // 4
+# Connections kept open to GCS, shared by concurrent requests and downloads.
+STORAGE_POOL_SIZE = 32
+RESPONSE_CACHE_BYTES = INSTANCE_MEMORY_BYTES // 16
+# Downloaded slices are kept on the disk of each instance. /tmp of App Engine
+# standard is in memory, where the slice cache already holds them, so the disk
+# cache is disabled there.
+DISK_CACHE_DIR = '/tmp/slice-cache'
+DISK_CACHE_BYTES = 0 if environ.get('GAE_ENV') == 'standard' else 512 * 1024 * 1024
+SEARCH_DIRECTIONS = ['above', 'below']
+# A json document at once, or streamed as the document or as lines of records.
+RESPONSE_FORMATS = ['json', 'chunked', 'ndjson']
+STREAM_RECORDS_PER_CHUNK = 1000
+MAX_SEARCH_RESULTS = 10000
 
 app = Flask(__name__)
 CORS(app)
+storage_client = StorageClient(STORAGE_POOL_SIZE)
+slice_cache = SliceCache(SLICE_CACHE_BYTES)
+metadata_cache = MetadataCache()
+response_cache = ResponseCache(RESPONSE_CACHE_BYTES)
+disk_cache = DiskCache(DISK_CACHE_DIR, DISK_CACHE_BYTES) if DISK_CACHE_BYTES > 0 else None
+slice_flight = SingleFlight()
+response_flight = SingleFlight()
 
 
 @app.route('/data', methods=['GET'])
@@ -53,14 +104,31 @@ def get_data():
         strategy: A string representing the selected downsample strategy.
         start: An int representing the start of time span user wish to view.
         end: An int representing the end of time span user wish to view.
+        format: A string of the response format. json for a document sent at
+            once, chunked for the same document streamed once slices are
+            downsampled, ndjson for a line of records of a channel as each slice
+            is downsampled, followed by a line of frequency ratio and the min and
+            max of each channel.
+            A json response is encoded in binary instead, if the Accept header
+            prefers application/octet-stream.
+        channels: A comma separated string of names of channels to return, all
+            channels if not given.
+
+    The timespan is widened to the resolution of the level it is fetched from.
+    Json and binary responses are cached by query, and have an ETag, so that
+    repeated views are answered from memory, or with 304 Not Modified.
     """
 
     name = request.args.get('name', type=str)
     strategy = request.args.get('strategy', default='avg', type=str)
+    response_format = request.args.get('format', default='json', type=str)
     start = request.args.get('start', default=None, type=int)
     end = request.args.get('end', default=None, type=int)
     number = request.args.get(
         'number', default=NUMBER_OF_RECORDS_PER_REQUEST, type=int)
+    channels = request.args.get('channels', default=None, type=str)
+    if channels is not None:
+        channels = sorted(set(channels.split(',')))
     if name is None:
         warning('Empty file name.')
         response = make_response('Empty file name')
@@ -69,21 +137,184 @@ def get_data():
         warning('Incorrect Strategy: %s', strategy)
         response = make_response('Incorrect Strategy: {}'.format(strategy))
         return response, 400
+    if response_format not in RESPONSE_FORMATS:
+        warning('Incorrect format: %s', response_format)
+        response = make_response('Incorrect format: {}'.format(response_format))
+        return response, 400
+
+    fetcher = DataFetcher(name, PREPROCESS_DIR,
+                          storage_client.bucket(PREPROCESS_BUCKET), MAX_DOWNLOAD_WORKERS,
+                          slice_cache, metadata_cache, slice_flight, disk_cache,
+                          storage_client.bucket(RAW_BUCKET))
+    # Metadata is cached, so the raw file is only looked up when it is missing.
+    if not fetcher.is_preprocessed():
+        if not get_backend(storage_client.bucket(RAW_BUCKET)).exists(name):
+            response = make_response('Target file does not exist, please check file name')
+            return response, 404
+        response = make_response('Preprocessing incomplete.')
+        return response, 404
+    start, end = fetcher.snap_timespan(number, start, end)
+    if response_format != 'json':
+        lines = fetcher.fetch_stream(strategy, number, start, end, channels=channels)
+        if response_format == 'ndjson':
+            response = Response(stream_with_context(stream_ndjson(lines)),
+                                mimetype='application/x-ndjson')
+        else:
+            response = Response(stream_with_context(stream_json(lines)),
+                                mimetype='application/json')
+        response.headers['Access-Control-Allow-Credentials'] = 'true'
+        return response
+    mimetype = request.accept_mimetypes.best_match(['application/json', BINARY_MIMETYPE])
+    if mimetype != BINARY_MIMETYPE:
+        mimetype = 'application/json'
+    key = (name, fetcher.get_generation(), strategy, number, start, end,
+           None if channels is None else tuple(channels), mimetype)
+
+    def encode_response():
+        data, frequency_ratio = fetcher.fetch(strategy, number, start, end,
+                                              channels=channels)
+        if mimetype == BINARY_MIMETYPE:
+            body = encode_binary(data, frequency_ratio)
+        else:
+            body = jsonify({'data': data, 'frequency_ratio': frequency_ratio}).get_data()
+        return body, response_cache.put(key, body, mimetype)
+
+    cached = response_cache.get(key)
+    if cached is None:
+        # Identical requests that come while the response is built wait for it.
+        body, etag = response_flight.do(key, encode_response)
+    else:
+        body, mimetype, etag = cached
+    response = app.make_response(body)
+    response.mimetype = mimetype
+    response.set_etag(etag)
+    response.headers['Access-Control-Allow-Credentials'] = 'true'
+    response.vary.add('Accept')
+    return response.make_conditional(request)
+
+
+def stream_json(lines):
+    """Streams the json document of downsampled data, a few records at a time.
+
+    A channel is only complete once every slice is downsampled, so records are
+    gathered by channel, and the channels are sent after the last slice.
+
+    Args:
+        lines: An iterator of dicts as yielded by DataFetcher.fetch_stream().
+
+    Yields:
+        Strings that make up the same document as the json response format.
+    """
+    yield '{"data":['
+    data = dict()
+    for line in lines:
+        if 'name' in line:
+            data.setdefault(line['name'], list()).extend(line['data'])
+            continue
+        for index, channel in enumerate(line['min']):
+            records = data.pop(channel, [])
+            yield ('' if index == 0 else ',') + dumps({
+                'name': channel, 'min': line['min'][channel],
+                'max': line['max'][channel]})[:-1] + ',"data":['
+            for position in range(0, len(records), STREAM_RECORDS_PER_CHUNK):
+                yield ('' if position == 0 else ',') + \
+                    dumps(records[position:position+STREAM_RECORDS_PER_CHUNK])[1:-1]
+            yield ']}'
+        yield '],"frequency_ratio":' + dumps(line['frequency_ratio']) + '}'
+
+
+def stream_ndjson(lines):
+    """Streams downsampled data as newline delimited json.
+
+    Args:
+        lines: An iterator of dicts as yielded by DataFetcher.fetch_stream().
+
+    Yields:
+        A line of the name and next records of a channel, as each slice is
+        downsampled, then a line of the frequency ratio and the min and max of
+        each channel.
+    """
+    for line in lines:
+        yield dumps(line) + '\n'
+
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """HTTP endpoint to get the mean power and energy of each channel.
+
+    HTTP Args:
+        name: A string representing the fill name of the file user wish to
+            view. (example: DMM_res.csv)
+        start: An int representing the start of time span, in microseconds.
+        end: An int representing the end of time span, in microseconds.
+    """
+    name = request.args.get('name', type=str)
+    start = request.args.get('start', default=None, type=int)
+    end = request.args.get('end', default=None, type=int)
+    if name is None:
+        warning('Empty file name.')
+        response = make_response('Empty file name')
+        return response, 400
 
-    client = storage.Client()
     fetcher = DataFetcher(name, PREPROCESS_DIR,
-                          client.bucket(PREPROCESS_BUCKET))
-    bucket = client.bucket(RAW_BUCKET)
-    file =  bucket.blob(name)
-    if not file.exists():
-        response = make_response('Target file does not exist, please check file name')
+                          storage_client.bucket(PREPROCESS_BUCKET), MAX_DOWNLOAD_WORKERS,
+                          slice_cache, metadata_cache, slice_flight, disk_cache,
+                          storage_client.bucket(RAW_BUCKET))
+    if not fetcher.is_preprocessed():
+        response = make_response('Preprocessing incomplete.')
+        return response, 404
+    data = fetcher.fetch_stats(start, end)
+    if data is None:
+        response = make_response('File was preprocessed without prefix sums.')
         return response, 404
+    response = app.make_response(jsonify({'data': data}))
+    response.headers['Access-Control-Allow-Credentials'] = 'true'
+    return response
+
+
+@app.route('/search', methods=['GET'])
+def search():
+    """HTTP endpoint to search records of a channel beyond a threshold.
+
+    HTTP Args:
+        name: A string representing the fill name of the file user wish to
+            view. (example: DMM_res.csv)
+        channel: A string of the channel to search.
+        threshold: A float of the power to search beyond.
+        direction: A string, above or below the threshold.
+        start: An int representing the start of time span, in microseconds.
+        end: An int representing the end of time span, in microseconds.
+        limit: An int of the maximum number of records to return.
+    """
+    name = request.args.get('name', type=str)
+    channel = request.args.get('channel', type=str)
+    threshold = request.args.get('threshold', type=float)
+    direction = request.args.get('direction', default='above', type=str)
+    start = request.args.get('start', default=None, type=int)
+    end = request.args.get('end', default=None, type=int)
+    limit = request.args.get('limit', default=1, type=int)
+    if name is None or channel is None or threshold is None:
+        warning('Empty file name, channel or threshold.')
+        response = make_response('Empty file name, channel or threshold')
+        return response, 400
+    if direction not in SEARCH_DIRECTIONS:
+        warning('Incorrect direction: %s', direction)
+        response = make_response('Incorrect direction: {}'.format(direction))
+        return response, 400
+    limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+
+    fetcher = DataFetcher(name, PREPROCESS_DIR,
+                          storage_client.bucket(PREPROCESS_BUCKET), MAX_DOWNLOAD_WORKERS,
+                          slice_cache, metadata_cache, slice_flight, disk_cache,
+                          storage_client.bucket(RAW_BUCKET))
     if not fetcher.is_preprocessed():
         response = make_response('Preprocessing incomplete.')
         return response, 404
-    data, frequency_ratio = fetcher.fetch(strategy, number, start, end)
-    response_data = {'data': data, 'frequency_ratio': frequency_ratio}
-    response = app.make_response(jsonify(response_data))
+    data = fetcher.search(channel, threshold, direction == 'above', start, end, limit)
+    if data is None:
+        response = make_response('File was preprocessed without stats.')
+        return response, 404
+    response = app.make_response(jsonify({'data': data}))
     response.headers['Access-Control-Allow-Credentials'] = 'true'
     return response
 
@@ -99,6 +330,14 @@ def mlp_preprocess():
         levels.
         min_number: An int that represents the minimum number of records for a
         level.
+        slice_format: A string of the format of preprocessed slices, csv or bin.
+        power_dtype: A string of the dtype of power values in binary slices,
+        float32 or float64.
+        bucket_mode: A string of how records are grouped for downsampling, count
+        or time.
+        level_mode: A string of how levels are stored, strategies or aggregates.
+        level0_mode: A string of how level0 is stored, copy for slices copied from
+        the raw file, or index for byte ranges read from the raw file in place.
     """
 
     print('Start preprocessing the file')
@@ -109,18 +348,44 @@ def mlp_preprocess():
     downsample_factor = form.get('downsample_factor', DOWNSAMPLE_LEVEL_FACTOR)
     minimum_number_level = form.get('min_number',
                                     MINIMUM_NUMBER_OF_RECORDS_LEVEL)
+    slice_format = form.get('slice_format', SLICE_FORMAT)
+    power_dtype = form.get('power_dtype', POWER_DTYPE)
+    bucket_mode = form.get('bucket_mode', BUCKET_MODE)
+    level_mode = form.get('level_mode', LEVEL_MODE)
+    level0_mode = form.get('level0_mode', LEVEL0_MODE)
 
     if name is None:
         warning('No file name!')
         response = make_response('No file name!')
         return response, 400
+    if slice_format not in SLICE_FORMATS or power_dtype not in POWER_DTYPES:
+        warning('Incorrect slice format: %s, %s', slice_format, power_dtype)
+        response = make_response('Incorrect slice format: {}, {}'.format(
+            slice_format, power_dtype))
+        return response, 400
+    if bucket_mode not in BUCKET_MODES:
+        warning('Incorrect bucket mode: %s', bucket_mode)
+        response = make_response('Incorrect bucket mode: {}'.format(bucket_mode))
+        return response, 400
+    if level_mode not in LEVEL_MODES:
+        warning('Incorrect level mode: %s', level_mode)
+        response = make_response('Incorrect level mode: {}'.format(level_mode))
+        return response, 400
+    if level0_mode not in LEVEL0_MODES:
+        warning('Incorrect level0 mode: %s', level0_mode)
+        response = make_response('Incorrect level0 mode: {}'.format(level0_mode))
+        return response, 400
 
-    client = storage.Client()
     preprocess = MultipleLevelPreprocess(name, PREPROCESS_DIR,
-                                         client.bucket(PREPROCESS_BUCKET),
-                                         client.bucket(RAW_BUCKET))
+                                         storage_client.bucket(PREPROCESS_BUCKET),
+                                         storage_client.bucket(RAW_BUCKET))
     error = preprocess.preprocess(number_per_slice, downsample_factor,
-                                  minimum_number_level)
+                                  minimum_number_level, slice_format, power_dtype,
+                                  bucket_mode, level_mode, level0_mode)
+    slice_cache.invalidate(preprocess.get_preprocess_dir())
+    metadata_cache.invalidate(preprocess.get_preprocess_dir(),
+                              storage_client.bucket(PREPROCESS_BUCKET))
+    response_cache.invalidate(name)
 
     if error is not None:
         response = make_response(error)
@@ -133,10 +398,9 @@ def mlp_preprocess():
 @app.route('/fileinfo')
 def get_file_info():
     """HTTP endpoint to get all file names stored in bucket."""
-    client = storage.Client()
-    raw_bucket = client.bucket(RAW_BUCKET)
-    preprocess_bucket = client.bucket(PREPROCESS_BUCKET)
-    blobs = client.list_blobs(RAW_BUCKET)
+    raw_bucket = storage_client.bucket(RAW_BUCKET)
+    preprocess_bucket = storage_client.bucket(PREPROCESS_BUCKET)
+    blobs = storage_client.list_blobs(RAW_BUCKET)
 
     names = [blob.name for blob in blobs]
     files_preprocess = [
@@ -156,6 +420,20 @@ def get_file_info():
     return response
 
 
+@app.route('/cache')
+def get_cache_stats():
+    """HTTP endpoint to get the counters of the caches of this instance."""
+    response = make_response(jsonify({
+        'slices': slice_cache.get_stats(),
+        'disk': None if disk_cache is None else disk_cache.get_stats(),
+        'metadata': metadata_cache.get_stats(),
+        'responses': response_cache.get_stats(),
+        'slice_flights': slice_flight.get_stats(),
+        'response_flights': response_flight.get_stats()
+    }))
+    return response
+
+
 @app.route('/test')
 def test():
     response = make_response('OK')
@@ -193,10 +471,9 @@ def make_response(response_body):
 @app.route('/downsample')
 def scan_files():
     """Scans for new files that need downsampling and preprocess them."""
-    client = storage.Client()
-    raw_bucket = client.bucket(RAW_BUCKET)
-    preprocess_bucket = client.bucket(PREPROCESS_BUCKET)
-    blobs = client.list_blobs(RAW_BUCKET)
+    raw_bucket = storage_client.bucket(RAW_BUCKET)
+    preprocess_bucket = storage_client.bucket(PREPROCESS_BUCKET)
+    blobs = storage_client.list_blobs(RAW_BUCKET)
 
     names = [blob.name for blob in blobs]
     files_preprocess = [
@@ -210,12 +487,10 @@ def scan_files():
             number_per_slice = NUMBER_OF_RECORDS_PER_SLICE
             downsample_factor = DOWNSAMPLE_LEVEL_FACTOR
             minimum_number_level = MINIMUM_NUMBER_OF_RECORDS_LEVEL
-            client = storage.Client()
-            preprocess = MultipleLevelPreprocess(
-                name, PREPROCESS_DIR, client.bucket(PREPROCESS_BUCKET),
-                client.bucket(RAW_BUCKET))
             error = preprocess.preprocess(number_per_slice, downsample_factor,
-                                          minimum_number_level)
+                                          minimum_number_level, SLICE_FORMAT,
+                                          POWER_DTYPE, BUCKET_MODE, LEVEL_MODE,
+                                          LEVEL0_MODE)
 
             if error is not None:
                 response = make_response(error)
@@ -0,0 +1,211 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Test module for the HTTP endpoints of main.py"""
+# pylint: disable=W0212
+
+import json
+from collections import defaultdict
+
+import pytest
+import main
+from metadata_cache import MetadataCache
+from records_test_utils import START
+from records_test_utils import make_records
+from response_cache import ResponseCache
+from slice_cache import SliceCache
+from storage_backend import MemoryBackend
+from utils import convert_to_csv
+
+
+class FakeStorageClient:
+    """A storage client of buckets in memory."""
+
+    def __init__(self):
+        self._buckets = defaultdict(MemoryBackend)
+
+    def bucket(self, name):
+        return self._buckets[name]
+
+
+class TestMain:
+    """A Test Class for the HTTP endpoints of main.py"""
+
+    @pytest.fixture
+    def client(self, monkeypatch):
+        """Gives a test client of the app, with a raw file preprocessed in memory."""
+        monkeypatch.setattr(main, 'storage_client', FakeStorageClient())
+        monkeypatch.setattr(main, 'slice_cache', SliceCache(main.SLICE_CACHE_BYTES))
+        monkeypatch.setattr(main, 'metadata_cache', MetadataCache())
+        monkeypatch.setattr(main, 'response_cache', ResponseCache(main.RESPONSE_CACHE_BYTES))
+        monkeypatch.setattr(main, 'disk_cache', None)
+        main.storage_client.bucket(main.RAW_BUCKET).put(
+            'raw.csv', convert_to_csv(make_records()))
+        with main.app.test_client() as client:
+            response = client.post('/data', data=json.dumps({
+                'name': 'raw.csv', 'slice_size': 100, 'downsample_factor': 10,
+                'min_number': 10}))
+            assert response.data == b'preprocess complete!'
+            yield client
+
+    def test_stats(self, client):
+        """Tests the stats of each channel in a timespan."""
+        response = client.get('/stats', query_string={
+            'name': 'raw.csv', 'start': START + 1000, 'end': START + 2999})
+        assert response.status_code == 200
+        stats = {channel['name']: channel for channel in response.get_json()['data']}
+        assert stats['SYS']['count'] == 20
+        assert stats['SYS']['mean'] == pytest.approx(sum(range(10, 30)) / 20)
+        assert stats['SYS']['energy'] == pytest.approx(
+            sum(power * 100 for power in range(10, 29)) / 1E6 + 29 * 99 / 1E6)
+        # SOC ends at START + 1910, and its power is not held after.
+        assert stats['SOC']['count'] == 10
+        assert stats['SOC']['energy'] == pytest.approx(
+            ((5 + 9 % 3) * 10 + sum((5 + index % 3) * 100 for index in range(10, 19))) / 1E6)
+
+        assert client.get('/stats', query_string={'name': 'raw.csv'}).status_code == 200
+        assert client.get('/stats').status_code == 400
+        assert client.get('/stats', query_string={'name': 'missing.csv'}).status_code == 404
+        response = client.get('/data', query_string={'name': 'missing.csv'})
+        assert response.status_code == 404
+        assert response.data == b'Target file does not exist, please check file name'
+        main.storage_client.bucket(main.RAW_BUCKET).put('other.csv', b'')
+        response = client.get('/data', query_string={'name': 'other.csv'})
+        assert response.status_code == 404
+        assert response.data == b'Preprocessing incomplete.'
+
+    def test_search(self, client):
+        """Tests the records of a channel beyond a threshold."""
+        response = client.get('/search', query_string={
+            'name': 'raw.csv', 'channel': 'SYS', 'threshold': 47, 'limit': 4})
+        assert response.status_code == 200
+        assert response.get_json()['data'] == [
+            [START + index * 100, index % 50] for index in (48, 49, 98, 99)]
+        response = client.get('/search', query_string={
+            'name': 'raw.csv', 'channel': 'SOC', 'threshold': 6, 'direction': 'below',
+            'start': START + 1000, 'limit': 100})
+        assert response.get_json()['data'] == [
+            [START + index * 100 + 10, 5 + index % 3] for index in range(10, 20)
+            if 5 + index % 3 < 6]
+        response = client.get('/search', query_string={
+            'name': 'raw.csv', 'channel': 'SYS', 'threshold': 47})
+        assert response.get_json()['data'] == [[START + 4800, 48]]
+
+        assert client.get('/search', query_string={
+            'name': 'raw.csv', 'channel': 'SYS'}).status_code == 400
+        assert client.get('/search', query_string={
+            'name': 'raw.csv', 'channel': 'SYS', 'threshold': 1,
+            'direction': 'sideways'}).status_code == 400
+        assert client.get('/search', query_string={
+            'name': 'missing.csv', 'channel': 'SYS', 'threshold': 1}).status_code == 404
+
+    def test_data_snapped_timespan(self, client):
+        """Tests nearby timespans are fetched as the same timespan."""
+        response = client.get('/data', query_string={
+            'name': 'raw.csv', 'number': 20, 'start': START + 3000, 'end': START + 60000})
+        assert response.status_code == 200
+        nearby = client.get('/data', query_string={
+            'name': 'raw.csv', 'number': 20, 'start': START + 3010, 'end': START + 59990})
+        assert nearby.data == response.data
+        assert nearby.headers['ETag'] == response.headers['ETag']
+        assert main.response_cache.get_stats()['entries'] == 1
+
+        # A single instant is widened to a record of level0.
+        response = client.get('/data', query_string={
+            'name': 'raw.csv', 'start': START + 5000, 'end': START + 5000})
+        assert response.status_code == 200
+        assert response.get_json()['data'] == [{
+            'name': 'SYS', 'data': [[START + 5000, 0]], 'min': 0, 'max': 0}]
+
+    def test_data_etag(self, client):
+        """Tests conditional requests, and the ETag of a file preprocessed again."""
+        query = {'name': 'raw.csv', 'number': 20}
+        response = client.get('/data', query_string=query)
+        etag = response.headers['ETag']
+        response = client.get('/data', query_string=query, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert not response.data
+        response = client.get('/data', query_string=query,
+                              headers={'If-None-Match': '"stale"'})
+        assert response.status_code == 200
+
+        records = [[time, power * 2, channel] for time, power, channel in make_records()]
+        main.storage_client.bucket(main.RAW_BUCKET).put('raw.csv', convert_to_csv(records))
+        response = client.post('/data', data=json.dumps({
+            'name': 'raw.csv', 'slice_size': 100, 'downsample_factor': 10,
+            'min_number': 10}))
+        assert response.data == b'preprocess complete!'
+        response = client.get('/data', query_string=query, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_cache_stats(self, client):
+        """Tests the counters of the caches, without the disk cache."""
+        client.get('/data', query_string={'name': 'raw.csv'})
+        stats = client.get('/cache').get_json()
+        assert stats['disk'] is None
+        assert stats['responses']['entries'] == 1
+        assert stats['slices']['entries'] > 0
+
+    @pytest.mark.parametrize('query', [
+        {'strategy': 'avg'},
+        {'strategy': 'lttb', 'number': 7, 'start': START + 1234, 'end': START + 77777},
+        {'strategy': 'm4', 'number': 30, 'channels': 'SOC'},
+        {'strategy': 'max', 'start': START + 200000, 'end': START + 300000}])
+    def test_data_stream(self, client, query):
+        """Tests streamed responses hold the same data as the json response."""
+        query = dict(query, name='raw.csv')
+        expected = client.get('/data', query_string=query).get_json()
+
+        response = client.get('/data', query_string=dict(query, format='chunked'))
+        assert response.is_streamed
+        assert response.get_json() == expected
+
+        response = client.get('/data', query_string=dict(query, format='ndjson'))
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        data = dict()
+        for line in lines[:-1]:
+            data.setdefault(line['name'], list()).extend(line['data'])
+        summary = lines[-1]
+        assert {
+            'data': [{'name': channel, 'data': data[channel], 'min': summary['min'][channel],
+                      'max': summary['max'][channel]} for channel in summary['min']],
+            'frequency_ratio': summary['frequency_ratio']
+        } == expected
+
+        assert client.get('/data', query_string=dict(
+            query, format='xml')).status_code == 400
+
+    def test_stream_json(self, monkeypatch):
+        """Tests the streamed document of lines of records of each slice."""
+        lines = [
+            {'name': 'SYS', 'data': [[1, 2.0], [3, 4.0]]},
+            {'name': 'SOC', 'data': [[2, 5.0]]},
+            {'name': 'SYS', 'data': [[5, 6.0]]},
+            {'frequency_ratio': 0.5, 'min': {'SOC': 5.0, 'SYS': 1.0},
+             'max': {'SOC': 5.0, 'SYS': 9.0}}]
+        expected = {
+            'data': [
+                {'name': 'SOC', 'data': [[2, 5.0]], 'min': 5.0, 'max': 5.0},
+                {'name': 'SYS', 'data': [[1, 2.0], [3, 4.0], [5, 6.0]], 'min': 1.0,
+                 'max': 9.0}],
+            'frequency_ratio': 0.5}
+        monkeypatch.setattr(main, 'STREAM_RECORDS_PER_CHUNK', 2)
+        assert json.loads(''.join(main.stream_json(iter(lines)))) == expected
+        assert [json.loads(line) for line in ''.join(
+            main.stream_ndjson(iter(lines))).splitlines()] == lines
+        assert json.loads(''.join(main.stream_json(iter([
+            {'frequency_ratio': 0, 'min': {}, 'max': {}}])))) == {
+                'data': [], 'frequency_ratio': 0}
@@ -13,21 +13,26 @@
 # =============================================================================
 
 """Metadata module."""
-from json import dump
 from json import dumps
-from json import load
 from json import loads
 
-from google.api_core.exceptions import NotFound
-from utils import mkdir
+from storage_backend import get_backend
 
 METADATA = 'metadata.json'
+STATS = 'stats.json'
+PREFIX_SUMS = 'prefix_sums.json'
+RAW_INDEX = 'raw_index.json'
+# Level0 slices are copies of the raw file, or byte ranges of it, found by an
+# index of slices saved in RAW_INDEX.
+COPY_LEVEL0 = 'copy'
+INDEX_LEVEL0 = 'index'
+LEVEL0_MODES = [COPY_LEVEL0, INDEX_LEVEL0]
 
 
 class Metadata:
     """Class for managing metadata."""
 
-    def __init__(self, root_dir, strategy=None, level=None, bucket=None):
+    def __init__(self, root_dir, strategy=None, level=None, bucket=None, filename=METADATA):
         """Initilizes metadata object.
 
         Args:
@@ -35,8 +40,11 @@ class Metadata:
             strategy (optional): A string of downsampling strategy. None if it is a file metadata
                 or level0 metadata.
             level (optional): A string of level name. None if it is a file metadata..
-            bucket (optional): The gcp bucket object for preprocessed files. None if files
-                are stored locally on disk.
+            bucket (optional): The gcp bucket object or StorageBackend object for
+                preprocessed files. None if files are stored locally on disk.
+            filename (optional): A string of the json file name, STATS for the slice
+                summaries of a level, PREFIX_SUMS for the prefix sums of level0,
+                RAW_INDEX for the byte ranges of level0 slices in the raw file.
         """
         path = ''
         if root_dir is not None:
@@ -44,13 +52,13 @@ class Metadata:
 
         if level is not None:
             if level != 'level0':
-                path = '/'.join([path, strategy, level, METADATA])
+                path = '/'.join([path, strategy, level, filename])
             else:
-                path = '/'.join([path, level, METADATA])
+                path = '/'.join([path, level, filename])
         else:
-            path = '/'.join([path, METADATA])
+            path = '/'.join([path, filename])
         self._path = path
-        self._bucket = bucket
+        self._storage = get_backend(bucket)
         self.data = dict()
 
     def __getitem__(self, key):
@@ -61,14 +69,7 @@ class Metadata:
 
     def save(self):
         """Saves metadata to bucket or disk."""
-        if self._bucket is None:
-            with open(self._path, 'w') as filewriter:
-                mkdir(self._path)
-                dump(self.data, filewriter)
-                return
-        blob = self._bucket.blob(self._path)
-        metadata_string = dumps(self.data)
-        blob.upload_from_string(metadata_string)
+        self._storage.put(self._path, dumps(self.data))
 
     def load(self):
         """Loads metadata from bucket or disk.
@@ -76,14 +77,17 @@ class Metadata:
         Returns:
             Returns a boolean indicating if load is successful.
         """
-        if self._bucket is None:
-            with open(self._path, 'r') as filereader:
-                self.data = load(filereader)
-                return None
         try:
-            blob = self._bucket.blob(self._path)
-            metadata_string = blob.download_as_string()
-            self.data = loads(metadata_string)
+            self.data = loads(self._storage.get(self._path))
             return True
-        except NotFound:
+        except FileNotFoundError:
             return False
+
+    def get_generation(self):
+        """Gets the generation of saved metadata, which changes every time it is saved.
+
+        Returns:
+            An int of the blob generation, or the modification time in nanoseconds if
+            stored locally. None if metadata does not exist.
+        """
+        return self._storage.get_generation(self._path)
@@ -0,0 +1,368 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Module for caching metadata of preprocessed files."""
+from bisect import bisect_left
+from bisect import bisect_right
+from threading import Lock
+from time import monotonic
+
+from metadata import Metadata
+from metadata import INDEX_LEVEL0
+from metadata import PREFIX_SUMS
+from metadata import RAW_INDEX
+from metadata import STATS
+from range_extremes import RangeExtremes
+from slice_format import STATS_LAST
+import utils
+
+RAW_LEVEL_DIR = 'level0'
+METADATA_TTL_SECONDS = 30
+
+
+class FileMetadata:
+    """Metadata of a preprocessed file, indexed for searching levels and slices.
+
+    Metadata of levels is loaded the first time a level of a strategy is searched,
+    and kept for the lifetime of this object.
+    """
+
+    def __init__(self, preprocess_dir, bucket, metadata, generation):
+        """Indexes the file metadata.
+
+        Args:
+            preprocess_dir: A string of the directory of preprocess files.
+            bucket: A GCP bucket object or StorageBackend object for preprocess
+                files, None if local.
+            metadata: A loaded Metadata object of the file.
+            generation: The generation of the loaded metadata.
+        """
+        self._preprocess_dir = preprocess_dir
+        self._bucket = bucket
+        self.data = metadata.data
+        self.generation = generation
+
+        levels = self.data['levels']
+        self.level_names = levels['names']
+        # Frequencies decrease from level0, negated to be searched with bisect.
+        self._negative_frequencies = [
+            -levels[level_name]['frequency'] for level_name in self.level_names]
+        # key: (strategy, level name), value: a tuple of lists of slice names and
+        # start times of slices.
+        self._slices = dict()
+        # key: (strategy, level name), value: a dict of slice stats keyed by slice name.
+        self._slice_stats = dict()
+        # A dict of prefix sums keyed by level0 slice name, None until loaded.
+        self._prefix_sums = None
+        # A RangeExtremes object of level0 slices, None until built.
+        self._range_extremes = None
+        # A dict of byte ranges in the raw file keyed by level0 slice path, None
+        # until loaded.
+        self._raw_ranges = None
+        # A dict of the time of the last record of each channel, None until built.
+        self._last_times = None
+        self._lock = Lock()
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def find_level(self, frequency):
+        """Finds the level of the lowest frequency that is not lower than the given one.
+
+        Args:
+            frequency: A float of the required number of records per microsecond.
+
+        Returns:
+            An int of the level index, 0 if every level is of lower frequency.
+        """
+        number_higher = bisect_right(self._negative_frequencies, -frequency)
+        return max(number_higher - 1, 0)
+
+    def find_slices(self, strategy, level_index, start, end):
+        """Finds the range of slices of a level that covers a timespan.
+
+        Args:
+            strategy: A string representing a downsampling strategy.
+            level_index: An int of the level index.
+            start: An int of the start of timespan.
+            end: An int of the end of timespan.
+
+        Returns:
+            A tuple of indices of the first and last slices, both included.
+        """
+        starts = self.get_slice_starts(strategy, level_index)
+        first_slice = max(bisect_left(starts, start) - 1, 0)
+        last_slice = max(bisect_left(starts, end) - 1, 0)
+        return first_slice, last_slice
+
+    def get_slice_names(self, strategy, level_index):
+        """Gets the names of slices of a level.
+
+        Slices of m4 levels differ from those of other strategies, so names are
+        taken from the level metadata of the strategy.
+
+        Args:
+            strategy: A string representing a downsampling strategy.
+            level_index: An int of the level index.
+
+        Returns:
+            A list of slice names, in order of time.
+        """
+        return self._get_slices(strategy, level_index)[0]
+
+    def get_slice_starts(self, strategy, level_index):
+        """Gets the start times of slices of a level.
+
+        Args:
+            strategy: A string representing a downsampling strategy.
+            level_index: An int of the level index.
+
+        Returns:
+            A list of start times, in the order of slice names of the level.
+        """
+        return self._get_slices(strategy, level_index)[1]
+
+    def _get_slices(self, strategy, level_index):
+        """Loads the slice names and start times of a level.
+
+        Args:
+            strategy: A string representing a downsampling strategy.
+            level_index: An int of the level index.
+
+        Returns:
+            A tuple of lists of slice names and start times, in order of time.
+        """
+        level_name = self.level_names[level_index]
+        key = self._get_key(strategy, level_name)
+        with self._lock:
+            slices = self._slices.get(key)
+        if slices is None:
+            level_metadata = Metadata(self._preprocess_dir, key[0], level_name,
+                                      bucket=self._bucket)
+            level_metadata.load()
+            # Slices are saved in order of time.
+            names = list(level_metadata.data)
+            slices = (names, [level_metadata[slice_name] for slice_name in names])
+            with self._lock:
+                self._slices[key] = slices
+        return slices
+
+    def get_slice_stats(self, strategy, level_index):
+        """Gets the stats of slices of a level.
+
+        Args:
+            strategy: A string representing a downsampling strategy.
+            level_index: An int of the level index.
+
+        Returns:
+            A dict of slice stats keyed by slice name, empty if the file was
+            preprocessed without stats.
+        """
+        level_name = self.level_names[level_index]
+        key = self._get_key(strategy, level_name)
+        with self._lock:
+            stats = self._slice_stats.get(key)
+        if stats is None:
+            level_stats = Metadata(self._preprocess_dir, key[0], level_name,
+                                   bucket=self._bucket, filename=STATS)
+            level_stats.load()
+            stats = level_stats.data
+            with self._lock:
+                self._slice_stats[key] = stats
+        return stats
+
+    def get_prefix_sums(self):
+        """Gets the prefix sums of level0 slices.
+
+        Returns:
+            A dict keyed by slice name, of dicts of prefixes keyed by channel. Empty
+            if the file was preprocessed without prefix sums.
+        """
+        with self._lock:
+            prefix_sums = self._prefix_sums
+        if prefix_sums is None:
+            metadata = Metadata(self._preprocess_dir, None, RAW_LEVEL_DIR,
+                                bucket=self._bucket, filename=PREFIX_SUMS)
+            metadata.load()
+            prefix_sums = metadata.data
+            with self._lock:
+                self._prefix_sums = prefix_sums
+        return prefix_sums
+
+    def get_range_extremes(self):
+        """Gets the index of min and max power over ranges of level0 slices.
+
+        Returns:
+            A RangeExtremes object, None if the file was preprocessed without stats.
+        """
+        with self._lock:
+            range_extremes = self._range_extremes
+        if range_extremes is None:
+            slice_stats = self.get_slice_stats(None, 0)
+            if not slice_stats:
+                return None
+            range_extremes = RangeExtremes(self.get_slice_names(None, 0), slice_stats)
+            with self._lock:
+                self._range_extremes = range_extremes
+        return range_extremes
+
+    def get_last_times(self):
+        """Gets the time of the last record of each channel in the file.
+
+        Returns:
+            A dict of timestamps keyed by channel, empty if the file was
+            preprocessed without stats.
+        """
+        with self._lock:
+            last_times = self._last_times
+        if last_times is None:
+            last_times = dict()
+            for slice_stats in self.get_slice_stats(None, 0).values():
+                for channel, stats in slice_stats.items():
+                    last_times[channel] = max(last_times.get(channel, stats[STATS_LAST]),
+                                              stats[STATS_LAST])
+            with self._lock:
+                self._last_times = last_times
+        return last_times
+
+    def get_raw_ranges(self):
+        """Gets the byte ranges of level0 slices in the raw file.
+
+        Returns:
+            A dict of tuples of the offset of the first byte and of the byte after
+            the last one, keyed by path of level0 slice. Empty if level0 slices
+            are copies of the raw file.
+        """
+        if self.data.get('level0_mode') != INDEX_LEVEL0:
+            return dict()
+        with self._lock:
+            raw_ranges = self._raw_ranges
+        if raw_ranges is None:
+            raw_index = Metadata(self._preprocess_dir, None, RAW_LEVEL_DIR,
+                                 bucket=self._bucket, filename=RAW_INDEX)
+            raw_index.load()
+            raw_ranges = {
+                utils.get_slice_path(self._preprocess_dir, RAW_LEVEL_DIR, slice_name):
+                tuple(byte_range) for slice_name, byte_range in raw_index.data.items()}
+            with self._lock:
+                self._raw_ranges = raw_ranges
+        return raw_ranges
+
+    def _get_key(self, strategy, level_name):
+        """Gets the key of a level, level0 is shared by all strategies.
+
+        Args:
+            strategy: A string representing a downsampling strategy.
+            level_name: A string of the level name.
+
+        Returns:
+            A tuple of strategy and level name.
+        """
+        if level_name == RAW_LEVEL_DIR:
+            return None, level_name
+        return strategy, level_name
+
+
+class MetadataCache:
+    """A thread-safe cache of FileMetadata objects.
+
+    Cached metadata is trusted for ttl seconds. After that, the generation of the
+    metadata file is checked, which costs no download, and the metadata is only
+    loaded again if it changed.
+    """
+
+    def __init__(self, ttl=METADATA_TTL_SECONDS):
+        """Initializes the cache.
+
+        Args:
+            ttl: A number of seconds to use cached metadata without checking it.
+        """
+        self._ttl = ttl
+        # key: (bucket name, preprocess dir), value: (FileMetadata, time of last check).
+        self._entries = dict()
+        self._lock = Lock()
+        self.hits = 0
+        self.revalidations = 0
+        self.loads = 0
+
+    def get(self, preprocess_dir, bucket=None):
+        """Gets metadata of a preprocessed file.
+
+        Args:
+            preprocess_dir: A string of the directory of preprocess files.
+            bucket: A GCP bucket object or StorageBackend object for preprocess
+                files, None if local.
+
+        Returns:
+            A FileMetadata object, None if the file is not preprocessed.
+        """
+        key = (None if bucket is None else bucket.name, preprocess_dir)
+        with self._lock:
+            entry = self._entries.get(key)
+        now = monotonic()
+        if entry is not None and now - entry[1] < self._ttl:
+            with self._lock:
+                self.hits += 1
+            return entry[0]
+
+        metadata = Metadata(preprocess_dir, bucket=bucket)
+        generation = metadata.get_generation()
+        if entry is not None and generation == entry[0].generation:
+            with self._lock:
+                self._entries[key] = (entry[0], now)
+                self.revalidations += 1
+            return entry[0]
+
+        file_metadata = None
+        while generation is not None:
+            metadata.load()
+            # Metadata saved while loading may not match the generation found before.
+            loaded_generation = metadata.get_generation()
+            if loaded_generation == generation:
+                file_metadata = FileMetadata(preprocess_dir, bucket, metadata, generation)
+                break
+            generation = loaded_generation
+        with self._lock:
+            self.loads += 1
+            if file_metadata is None:
+                self._entries.pop(key, None)
+            else:
+                self._entries[key] = (file_metadata, now)
+        return file_metadata
+
+    def invalidate(self, preprocess_dir, bucket=None):
+        """Drops cached metadata of a file.
+
+        Args:
+            preprocess_dir: A string of the directory of preprocess files.
+            bucket: A GCP bucket object or StorageBackend object for preprocess
+                files, None if local.
+        """
+        key = (None if bucket is None else bucket.name, preprocess_dir)
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get_stats(self):
+        """Gets the counters of the cache.
+
+        Returns:
+            A dict of the number of files, hits, revalidations and loads.
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'revalidations': self.revalidations,
+                'loads': self.loads
+            }
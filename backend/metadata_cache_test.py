@@ -0,0 +1,110 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Test module for MetadataCache Class."""
+# pylint: disable=W0212
+
+import os
+from tempfile import TemporaryDirectory
+
+import pytest
+from data_fetcher import DataFetcher
+from metadata import Metadata
+from metadata import STATS
+from metadata_cache import MetadataCache
+
+
+class TestMetadataCache:
+    """A Test Class for MetadataCache Class."""
+
+    @pytest.fixture
+    def preprocess_dir(self):
+        """Saves metadata of a file with level0 and one level of avg."""
+        with TemporaryDirectory() as preprocess_dir:
+            os.makedirs('/'.join([preprocess_dir, 'level0']))
+            os.makedirs('/'.join([preprocess_dir, 'avg', 'level1']))
+            metadata = Metadata(preprocess_dir)
+            metadata['start'] = 0
+            metadata['end'] = 100
+            metadata['levels'] = {
+                'names': ['level0', 'level1'],
+                'level0': {'names': ['level0/s0.bin', 'level0/s1.bin', 'level0/s2.bin'],
+                           'frequency': 0.3, 'number': 30},
+                'level1': {'names': ['level1/s0.bin'], 'frequency': 0.1, 'number': 10}
+            }
+            metadata.save()
+            level_metadata = Metadata(preprocess_dir, level='level0')
+            level_metadata.data = {'level0/s0.bin': 0, 'level0/s1.bin': 40,
+                                   'level0/s2.bin': 80}
+            level_metadata.save()
+            level_metadata = Metadata(preprocess_dir, 'avg', 'level1')
+            level_metadata.data = {'level1/s0.bin': 0}
+            level_metadata.save()
+            level_stats = Metadata(preprocess_dir, 'avg', 'level1', filename=STATS)
+            level_stats.data = {'level1/s0.bin': {'SYS': [10, 1, 5, 30, 0, 99]}}
+            level_stats.save()
+            yield preprocess_dir
+
+    @pytest.mark.parametrize('frequency', [1, 0.3, 0.2, 0.1, 0.05])
+    def test_find_level(self, preprocess_dir, frequency):
+        """Tests finding levels is the same as binary search in frequencies."""
+        file_metadata = MetadataCache().get(preprocess_dir)
+        expected = DataFetcher('dummy', 'dummy')._binary_search([0.3, 0.1], frequency, True)
+        assert file_metadata.find_level(frequency) == expected
+
+    @pytest.mark.parametrize('start,end', [(-1, 0), (0, 40), (1, 41), (50, 200)])
+    def test_find_slices(self, preprocess_dir, start, end):
+        """Tests finding slices is the same as binary search in slice start times."""
+        file_metadata = MetadataCache().get(preprocess_dir)
+        fetcher = DataFetcher('dummy', 'dummy')
+        expected = (fetcher._binary_search([0, 40, 80], start),
+                    fetcher._binary_search([0, 40, 80], end))
+        assert file_metadata.find_slices('avg', 0, start, end) == expected
+        assert file_metadata.find_slices('max', 0, start, end) == expected
+        assert file_metadata.find_slices('avg', 1, start, end) == (0, 0)
+
+    def test_get_slice_stats(self, preprocess_dir):
+        """Tests getting slice stats, empty if they are not saved."""
+        file_metadata = MetadataCache().get(preprocess_dir)
+        assert file_metadata.get_slice_stats('avg', 1) == {
+            'level1/s0.bin': {'SYS': [10, 1, 5, 30, 0, 99]}}
+        assert file_metadata.get_slice_stats('avg', 0) == {}
+
+    def test_revalidate(self, preprocess_dir):
+        """Tests metadata is only loaded again when it changes."""
+        cache = MetadataCache(ttl=0)
+        file_metadata = cache.get(preprocess_dir)
+        assert cache.get(preprocess_dir) is file_metadata
+        assert cache.get_stats() == {'entries': 1, 'hits': 0, 'revalidations': 1, 'loads': 1}
+
+        metadata = Metadata(preprocess_dir)
+        metadata.load()
+        metadata['end'] = 200
+        metadata.save()
+        stat = os.stat('/'.join([preprocess_dir, 'metadata.json']))
+        os.utime('/'.join([preprocess_dir, 'metadata.json']),
+                 ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        assert cache.get(preprocess_dir)['end'] == 200
+        assert cache.loads == 2
+
+    def test_ttl(self, preprocess_dir):
+        """Tests metadata is not checked within ttl."""
+        cache = MetadataCache(ttl=float('inf'))
+        file_metadata = cache.get(preprocess_dir)
+        os.remove('/'.join([preprocess_dir, 'metadata.json']))
+        assert cache.get(preprocess_dir) is file_metadata
+        assert cache.hits == 1
+
+        cache.invalidate(preprocess_dir)
+        assert cache.get(preprocess_dir) is None
@@ -13,13 +13,30 @@
 # =============================================================================
 
 """Multiple-level preprocess module."""
+from collections import defaultdict
 from math import ceil
 from time import time
 
+from downsample import AGGREGATE_LEVELS
+from downsample import AGGREGATE_STRATEGIES
+from downsample import AGGREGATES
+from downsample import COUNT_BUCKETS
+from downsample import SECOND_TO_MICROSECOND
 from downsample import STRATEGIES
+from downsample import STRATEGY_LEVELS
+from downsample import TIME_BUCKET_STRATEGIES
+from downsample import TIME_BUCKETS
+from level_cascade import LevelCascade
 from level_slice import LevelSlice
+from metadata import COPY_LEVEL0
 from metadata import Metadata
+from metadata import PREFIX_SUMS
+from metadata import RAW_INDEX
+from metadata import STATS
+from prefix_sums import PrefixSums
 from raw_data_processor import RawDataProcessor
+from slice_format import CSV_FORMAT
+from slice_format import from_records
 import utils
 
 PREPROCESS_DIR = 'mld-preprocess'
@@ -37,6 +54,8 @@ class MultipleLevelPreprocess:
     To manage the knowledge of each level, a metadata.json file is genereted for the entire
     file and each slice, including names, start time of slice, start, end, and frequency, etc.
     Metadata is saved in json format, and one for raw data, one for each level in each strategy.
+    Slices are saved in the format chosen for the run, CSV or binary columnar (see
+    slice_format), and the file extension of each slice name tells its format.
     Example metadata for raw:
     {
 
@@ -44,6 +63,10 @@ class MultipleLevelPreprocess:
         "end": 1565201659080140,
         "raw_number": 731,
         "raw_file": "DMM_result_multiple_channel.csv",
+        "generation": 1596831403112233,
+        "format": "csv",
+        "power_dtype": "float64",
+        "bucket_mode": "count",
         "levels": {
             "names": ["level0"],
             "level0": {
@@ -53,8 +76,14 @@ class MultipleLevelPreprocess:
             }
         }
     }
+    With time buckets, the metadata of each level from level1 also has "bucket_width",
+    the width of its time bins in microseconds.
     Example metadata for one level:
     {"level1/s0.csv": 1596831217804342, "level1/s1.csv": 1596831304045319}
+    Each level also keeps a stats.json, with the count, min, max and sum of power, and
+    the first and last timestamp of each channel in each slice:
+    {"level1/s0.csv": {"SYS": [1000, 10.5, 830.25, 250112.5, 1596831217804342,
+                               1596831304045100]}, ...}
     """
 
     def __init__(self, file_path, root_dir=PREPROCESS_DIR, preprocess_bucket=None, raw_bucket=None):
@@ -63,8 +92,10 @@ class MultipleLevelPreprocess:
         Args:
             root_dir: A string that represents the folder containing all preprocess files.
             file_path: A string that represents the path to raw data.
-            preprocess_bucket: A GCP bucket object for preprocess files.
-            raw_bucket: A GCP bucket object for raw files.
+            preprocess_bucket: A GCP bucket object or StorageBackend object for
+                preprocess files, None for local disk.
+            raw_bucket: A GCP bucket object or StorageBackend object for raw files,
+                None for local disk.
         """
         self._rawfile = file_path
         self._preprocess_bucket = preprocess_bucket
@@ -73,6 +104,14 @@ class MultipleLevelPreprocess:
         original_file_name = utils.get_file_name(file_path)
         self._preprocess_dir = '/'.join([root_dir, original_file_name])
 
+    def get_preprocess_dir(self):
+        """Gets the directory of preprocess files of the raw file.
+
+        Returns:
+            A string of the directory.
+        """
+        return self._preprocess_dir
+
     def is_preprocessed(self):
         """Returns if the raw data is preprocessed.
 
@@ -86,7 +125,12 @@ class MultipleLevelPreprocess:
     def preprocess(self,
                    number_per_slice,
                    downsample_level_factor,
-                   minimum_number_level):
+                   minimum_number_level,
+                   slice_format=CSV_FORMAT,
+                   power_dtype='float64',
+                   bucket_mode=COUNT_BUCKETS,
+                   level_mode=STRATEGY_LEVELS,
+                   level0_mode=COPY_LEVEL0):
         """Multiple level downsampling entry point.
 
         Downsamples the raw data from given filename with each of the strategy,
@@ -100,6 +144,17 @@ class MultipleLevelPreprocess:
             downsample_level_factor: An int that represents downsample factor between levels.
                 (e.g. factor=100, level1 has 100x less data than level0)
             minimum_number_level: An int that represents the minimum number of records for a level.
+            slice_format: A string of the format of saved slices, csv or bin.
+            power_dtype: A string of the dtype of power values in binary slices,
+                float32 or float64.
+            bucket_mode: A string of how records are grouped for downsampling, count
+                for a constant number of records, time for a constant time width.
+            level_mode: A string of how levels are stored, strategies for a tree per
+                strategy, aggregates for one tree of aggregates in place of the
+                max, min and avg trees.
+            level0_mode: A string of how level0 is stored, copy for slices copied
+                from the raw file, index for byte ranges of the raw file, which is
+                then read in place.
 
         Returns:
             Error string if an error occurs, None if complete.
@@ -107,26 +162,44 @@ class MultipleLevelPreprocess:
         self._number_per_slice = number_per_slice
         self._downsample_level_factor = downsample_level_factor
         self._minimum_number_level = minimum_number_level
+        self._slice_format = slice_format
+        self._power_dtype = power_dtype
+        self._bucket_mode = bucket_mode
+        # Levels are kept for each of these, of which the first sets level sizes.
+        self._level_strategies = STRATEGIES
+        if bucket_mode == TIME_BUCKETS:
+            self._level_strategies = TIME_BUCKET_STRATEGIES
+        if level_mode == AGGREGATE_LEVELS:
+            self._level_strategies = [AGGREGATES] + [
+                strategy for strategy in self._level_strategies
+                if strategy not in AGGREGATE_STRATEGIES]
         self._metadata = Metadata(
             self._preprocess_dir, bucket=self._preprocess_bucket)
         self._metadata['raw_file'] = self._rawfile
+        # Tells apart slices of different runs, for caches of decoded slices.
+        self._metadata['generation'] = int(time() * SECOND_TO_MICROSECOND)
+        self._metadata['format'] = slice_format
+        self._metadata['power_dtype'] = power_dtype
+        self._metadata['bucket_mode'] = bucket_mode
+        self._metadata['level_mode'] = level_mode
+        self._metadata['level0_mode'] = level0_mode
         self._metadata['levels'] = dict()
 
         start = time()
         error = self._raw_preprocess(number_per_slice)
         if error is not None:
             return error
-        utils.warning(('raw time is: ', time()-start))
-
-        for strategy in STRATEGIES:
-            start = time()
-            self._preprocess_single_startegy(strategy)
-            utils.warning((strategy, ' time is: ', time()-start))
+        utils.warning(('preprocess time is: ', time()-start))
         self._metadata.save()
         return None
 
     def _raw_preprocess(self, number_per_slice):
-        """Splits raw data into slices. keep start time of each slice in a json file.
+        """Splits raw data into slices, and downsamples them to all levels as they are read.
+
+        Raw data is read once. Each raw slice is saved to level0, or its byte range in
+        the raw file is kept in the raw index, and passed through a cascade of
+        downsample levels, which saves slices of every level and strategy as they
+        fill. Start time of each slice is kept in a json file per level.
 
         Args:
             number_per_slice: An int of records to keep for each slice.
@@ -137,26 +210,58 @@ class MultipleLevelPreprocess:
         raw_slice_metadata = Metadata(
             self._preprocess_dir, strategy=None, level=RAW_LEVEL_DIR,
             bucket=self._preprocess_bucket)
+        raw_slice_stats = Metadata(
+            self._preprocess_dir, strategy=None, level=RAW_LEVEL_DIR,
+            bucket=self._preprocess_bucket, filename=STATS)
+        raw_prefix_sums = Metadata(
+            self._preprocess_dir, strategy=None, level=RAW_LEVEL_DIR,
+            bucket=self._preprocess_bucket, filename=PREFIX_SUMS)
+        raw_index = Metadata(
+            self._preprocess_dir, strategy=None, level=RAW_LEVEL_DIR,
+            bucket=self._preprocess_bucket, filename=RAW_INDEX)
+        copy_level0 = self._metadata['level0_mode'] == COPY_LEVEL0
+        prefix_sums = PrefixSums()
         raw_data = RawDataProcessor(
             self._metadata['raw_file'], number_per_slice, self._raw_bucket)
+        cascade = None
 
         slice_index = 0
+        raw_slice_names = list()
         raw_start_times = list()
         record_count = 0
         timespan_start = timespan_end = -1
         while raw_data.readable():
-            slice_name = utils.get_slice_path(
-                self._preprocess_dir, RAW_LEVEL_DIR, utils.get_slice_name(slice_index))
-            print("Slice name: " + slice_name)
+            # Byte ranges of the raw file are read as csv slices.
+            slice_name = utils.get_slice_name(
+                slice_index, self._slice_format if copy_level0 else CSV_FORMAT)
+            slice_path = utils.get_slice_path(
+                self._preprocess_dir, RAW_LEVEL_DIR, slice_name)
+            print("Slice name: " + slice_path)
             level_slice = LevelSlice(
-                slice_name, bucket=self._preprocess_bucket)
+                slice_path, self._preprocess_bucket, self._power_dtype)
             raw_slice = raw_data.read_next_slice()
+            if not isinstance(raw_slice, str):
+                raw_slice = [record for record in raw_slice if record]
             if len(raw_slice) > 0 and len(raw_slice[0]) > 0:
-                print(raw_slice)
                 if isinstance(raw_slice, str):
                     return raw_slice
-                level_slice.save(raw_slice)
+                raw_slice_names.append('/'.join([RAW_LEVEL_DIR, slice_name]))
+                if copy_level0:
+                    level_slice.save(raw_slice)
+                else:
+                    raw_index[raw_slice_names[-1]] = raw_data.get_slice_range()
                 raw_start_times.append(raw_slice[0][0])
+                raw_columns = from_records([record for record in raw_slice if record])
+                raw_slice_stats[raw_slice_names[-1]] = raw_columns.get_stats()
+                raw_prefix_sums[raw_slice_names[-1]] = prefix_sums.add_slice(raw_columns)
+
+                channeled_records = defaultdict(list)
+                for record in raw_slice:
+                    if record:
+                        channeled_records[record[2]].append(record)
+                if cascade is None:
+                    cascade = self._new_cascade(raw_slice)
+                cascade.add_records(channeled_records)
 
                 slice_index += 1
                 record_count += len(raw_slice)
@@ -171,40 +276,78 @@ class MultipleLevelPreprocess:
         self._metadata['start'] = timespan_start
         self._metadata['end'] = timespan_end
 
-        levels, level_names = self._get_levels_metadata(
-            record_count, timespan_end-timespan_start)
+        duration = timespan_end-timespan_start
+        _, level_names = self._get_levels_metadata(record_count, duration)
+        if cascade is None:
+            cascade = self._new_cascade([])
+        level_writers = cascade.close(len(level_names))
+
         self._metadata['levels']['names'] = level_names
-        for name, level in zip(level_names, levels):
-            self._metadata["levels"][name] = level
+        self._metadata['levels'][RAW_LEVEL_DIR] = {
+            'names': raw_slice_names,
+            'frequency': record_count / duration,
+            'number': record_count
+        }
         for index, raw_slice_start in enumerate(raw_start_times):
-            raw_slice_metadata[self._metadata['levels']
-                               [RAW_LEVEL_DIR]['names'][index]] = raw_slice_start
+            raw_slice_metadata[raw_slice_names[index]] = raw_slice_start
         raw_slice_metadata.save()
+        raw_slice_stats.save()
+        raw_prefix_sums.save()
+        if not copy_level0:
+            raw_index.save()
+
+        for index, (level_name, writers) in enumerate(zip(level_names[1:], level_writers)):
+            for strategy, writer in writers.items():
+                level_metadata = Metadata(self._preprocess_dir, strategy, level_name,
+                                          bucket=self._preprocess_bucket)
+                level_stats = Metadata(self._preprocess_dir, strategy, level_name,
+                                       bucket=self._preprocess_bucket, filename=STATS)
+                for slice_name, slice_start, slice_stats in zip(
+                        writer.slice_names, writer.slice_starts, writer.slice_stats):
+                    level_metadata[slice_name] = slice_start
+                    level_stats[slice_name] = slice_stats
+                level_metadata.save()
+                level_stats.save()
+            # Buckets are the same for every strategy, and so are the slices, except
+            # for m4 whose slice names are only kept in its level metadata.
+            writer = writers[self._level_strategies[0]]
+            self._metadata['levels'][level_name] = {
+                'names': writer.slice_names,
+                'frequency': writer.number / duration,
+                'number': writer.number
+            }
+            bucket_width = cascade.get_bucket_width(index)
+            if bucket_width is not None:
+                self._metadata['levels'][level_name]['bucket_width'] = bucket_width
         return None
 
-    def _preprocess_single_startegy(self, strategy):
-        """Downsamples given data by the defined levels and strategy.
+    def _new_cascade(self, records):
+        """Creates the cascade of downsample levels.
 
-        Preprocesses the raw data with the given downsanpling startegy.
-        Raw data is downsampeld to a set of levels of different downsample rate,
-        data of each level broken down to small slices of constant size.
-        Number of levels is determined by if number of records in the highest level
-        reaches minimum_number_level.
-        Info regarding levels and slices is kept in a metadata json file.
+        With time buckets, level1 bins are as wide as downsample_level_factor records
+        of a channel take on average in the first raw slice, so that levels have
+        about as many records as with buckets by number of records. Time bins only
+        keep aggregates, so there is no lttb level.
 
         Args:
-            strategy: A string representing a downsampling strategy.
+            records: A list of records of the first raw slice.
+
+        Returns:
+            A LevelCascade object.
         """
-        if len(self._metadata['levels']['names']) <= 1:
-            return
-        prev_level = self._metadata['levels']['names'][0]
-        for curr_level in self._metadata['levels']['names'][1:]:
-            level_metadata = Metadata(
-                self._preprocess_dir, strategy, curr_level, bucket=self._preprocess_bucket)
-            self._single_level_downsample(
-                strategy, prev_level, curr_level, level_metadata)
-            level_metadata.save()
-            prev_level = curr_level
+        bucket_width = None
+        if self._bucket_mode == TIME_BUCKETS:
+            records = [record for record in records if record]
+            bucket_width = 1
+            if len(records) > 1:
+                number_channels = len(set(record[2] for record in records))
+                bucket_width = max(1, ceil(
+                    (records[-1][0] - records[0][0]) * number_channels *
+                    self._downsample_level_factor / (len(records) - 1)))
+        return LevelCascade(self._preprocess_dir, self._level_strategies,
+                            self._downsample_level_factor, self._number_per_slice,
+                            self._preprocess_bucket, self._slice_format,
+                            self._power_dtype, bucket_width)
 
     def _get_levels_metadata(self, raw_number_records, duration):
         """Gets level meta infomation for each level.
@@ -242,50 +385,3 @@ class MultipleLevelPreprocess:
             index += 1
             number_records = number_records // self._downsample_level_factor
         return levels, level_names
-
-    def _single_level_downsample(self, strategy, prev_level, curr_level, level_metadata):
-        """Downsamples for one single level.
-
-        Args:
-            strategy: A string representing a downsampling strategy.
-            prev_level: A string of the name of the current level.
-            curr_level: A string of the name of the previous level.
-            level_metadata: A metadata object for this level.
-
-        Returns:
-            A dict of metadata for the current level.
-        """
-        curr_slice_names = self._metadata['levels'][curr_level]['names']
-        prev_slice_names = self._metadata['levels'][prev_level]['names']
-
-        slice_index = 0
-        curr_slice_path = utils.get_slice_path(self._preprocess_dir,
-                                               curr_level, utils.get_slice_name(
-                                                   slice_index), strategy)
-        curr_level_slice = LevelSlice(
-            curr_slice_path, bucket=self._preprocess_bucket)
-
-        for prev_slice_name in prev_slice_names:
-            prev_slice_path = utils.get_slice_path(self._preprocess_dir,
-                                                   prev_level, prev_slice_name, strategy)
-            prev_level_slice = LevelSlice(
-                prev_slice_path, bucket=self._preprocess_bucket)
-            prev_level_slice.read()
-            prev_level_downsample = prev_level_slice.downsample(
-                strategy, self._downsample_level_factor)
-            curr_level_slice.add_records(prev_level_downsample)
-            if curr_level_slice.get_records_count() >= self._number_per_slice:
-                curr_level_slice.save()
-                level_metadata[curr_slice_names
-                               [slice_index]] = curr_level_slice.get_first_timestamp()
-                slice_index += 1
-                curr_slice_path = utils.get_slice_path(self._preprocess_dir,
-                                                       curr_level, utils.get_slice_name(
-                                                           slice_index), strategy)
-                curr_level_slice = LevelSlice(
-                    curr_slice_path, bucket=self._preprocess_bucket)
-
-        curr_level_slice.save()
-        level_metadata[curr_slice_names
-                       [slice_index]] = curr_level_slice.get_first_timestamp()
-        return level_metadata
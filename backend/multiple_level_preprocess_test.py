@@ -20,7 +20,9 @@ from tempfile import NamedTemporaryFile
 import os
 import pytest
 
+from data_fetcher import DataFetcher
 from multiple_level_preprocess import MultipleLevelPreprocess
+from storage_backend import MemoryBackend
 from utils import convert_to_csv
 
 
@@ -70,3 +72,57 @@ class TestMlpClass:
         assert len(levels) == expected_number_levels
         assert len(levels) == len(level_names)
         assert len(levels[0]['names']) == ceil(raw_number/number_per_slice)
+
+    def test_preprocess_in_memory(self):
+        """Tests a file is preprocessed and fetched without touching the disk."""
+        records = [[1573149236256988 + index * 100, index % 50, 'SYS' if index % 3 else 'SOC']
+                   for index in range(1000)]
+        raw_storage = MemoryBackend()
+        preprocess_storage = MemoryBackend()
+        raw_storage.put('raw.csv', convert_to_csv(records))
+        preprocess = MultipleLevelPreprocess('raw.csv', 'mld-preprocess',
+                                             preprocess_storage, raw_storage)
+        assert not preprocess.is_preprocessed()
+
+        assert preprocess.preprocess(100, 10, 10, 'bin') is None
+        assert preprocess.is_preprocessed()
+        assert preprocess_storage.list('mld-preprocess/raw/level0/s')[0] == \
+            'mld-preprocess/raw/level0/s0.bin'
+
+        fetcher = DataFetcher('raw.csv', 'mld-preprocess', preprocess_storage)
+        data, _ = fetcher.fetch('max', 10000, None, None)
+        assert {channel['name']: len(channel['data']) for channel in data} == {
+            'SYS': 666, 'SOC': 334}
+
+    def test_preprocess_raw_index(self):
+        """Tests level0 read in place from the raw file matches copied level0."""
+        records = [[1573149236256988 + index * 100, index % 50, 'SYS' if index % 3 else 'SOC']
+                   for index in range(1000)]
+        raw_storage = MemoryBackend()
+        raw_storage.put('raw.csv', convert_to_csv(records))
+        fetchers = dict()
+        for level0_mode in ['copy', 'index']:
+            preprocess_storage = MemoryBackend()
+            preprocess = MultipleLevelPreprocess('raw.csv', 'mld-preprocess',
+                                                 preprocess_storage, raw_storage)
+            assert preprocess.preprocess(100, 10, 10, 'bin',
+                                         level0_mode=level0_mode) is None
+            fetchers[level0_mode] = DataFetcher('raw.csv', 'mld-preprocess',
+                                                preprocess_storage, raw_bucket=raw_storage)
+        assert not preprocess_storage.exists('mld-preprocess/raw/level0/s0.csv')
+        assert not preprocess_storage.exists('mld-preprocess/raw/level0/s0.bin')
+        assert preprocess_storage.exists('mld-preprocess/raw/level0/raw_index.json')
+
+        start = 1573149236256988 + 123 * 100
+        end = 1573149236256988 + 876 * 100
+        for level0_mode in ['copy', 'index']:
+            fetcher = fetchers[level0_mode]
+            data, _ = fetcher.fetch('max', 10000, start, end)
+            assert {channel['name']: len(channel['data']) for channel in data} == {
+                'SYS': 502, 'SOC': 252}
+        assert fetchers['index'].fetch('max', 10000, start, end) == \
+            fetchers['copy'].fetch('max', 10000, start, end)
+        assert sorted(fetchers['index'].fetch_stats(start, end), key=str) == \
+            sorted(fetchers['copy'].fetch_stats(start, end), key=str)
+        assert fetchers['index'].search('SYS', 40, True, start, end, 5) == \
+            fetchers['copy'].search('SYS', 40, True, start, end, 5)
@@ -0,0 +1,135 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Module for prefix sums of level0, for mean and energy over any range.
+
+Power of a channel is taken as constant from one record until the next record
+of the channel, and as zero after the last record of the channel in the file,
+once the channel has ended. Energy is the integral of power over time, in power units
+times seconds. For each level0 slice, the prefix of a channel summarizes all
+its records before the slice: the number of records, the sum of power, the
+energy up to the last of them in power times microseconds, and the time and
+power of the last of them.
+"""
+import numpy as np
+
+from downsample import SECOND_TO_MICROSECOND
+
+# Fields of the prefix of one channel before a slice.
+PREFIX_COUNT, PREFIX_SUM, PREFIX_ENERGY, PREFIX_LAST_TIME, PREFIX_LAST_POWER = range(5)
+_EMPTY_PREFIX = [0, 0.0, 0.0, None, None]
+
+
+class PrefixSums:
+    """Accumulates the prefixes of level0 slices, in the order slices are saved."""
+
+    def __init__(self):
+        # key: channel name, value: prefix of records added so far.
+        self._totals = dict()
+
+    def add_slice(self, columns):
+        """Adds the records of a slice.
+
+        Args:
+            columns: A SliceColumns object of the slice, sorted by time.
+
+        Returns:
+            A dict of prefixes before the slice, keyed by channel.
+        """
+        prefixes = {channel: list(prefix) for channel, prefix in self._totals.items()}
+        for channel, (times, powers) in _split_channels(columns).items():
+            total = self._totals.get(channel, list(_EMPTY_PREFIX))
+            total[PREFIX_ENERGY] += _integrate(total, times, powers, times[-1])
+            total[PREFIX_COUNT] += len(times)
+            total[PREFIX_SUM] += powers.sum().item()
+            total[PREFIX_LAST_TIME] = times[-1].item()
+            total[PREFIX_LAST_POWER] = powers[-1].item()
+            self._totals[channel] = total
+        return prefixes
+
+
+def get_cumulative(prefixes, columns, time, inclusive, last_times=None):
+    """Gets the count, sum and energy of every channel from the start to a time.
+
+    Args:
+        prefixes: A dict of prefixes before the slice, keyed by channel.
+        columns: A SliceColumns object of the records of the slice, at least up to
+            the time. The slice is the last one to start before the time, or at
+            the time if inclusive.
+        time: An int of the time.
+        inclusive: A boolean indicating if records at the time are counted.
+        last_times: A dict of the time of the last record in the file keyed by
+            channel, after which power of the channel is not held. None to hold
+            power of every channel up to the time.
+
+    Returns:
+        A dict keyed by channel, of tuples of number of records, sum of power and
+        energy in power times seconds.
+    """
+    records = _split_channels(columns)
+    cumulative = dict()
+    for channel in set(prefixes) | set(records):
+        prefix = prefixes.get(channel, _EMPTY_PREFIX)
+        times, powers = records.get(channel, (np.array([]), np.array([])))
+        number = int(np.searchsorted(times, time, 'right' if inclusive else 'left'))
+        end = time
+        if last_times is not None and channel in last_times:
+            end = min(time, last_times[channel])
+        energy = prefix[PREFIX_ENERGY] + _integrate(prefix, times, powers, end)
+        cumulative[channel] = (prefix[PREFIX_COUNT] + number,
+                               prefix[PREFIX_SUM] + powers[:number].sum().item(),
+                               energy / SECOND_TO_MICROSECOND)
+    return cumulative
+
+
+def _split_channels(columns):
+    """Splits columns of a slice by channel.
+
+    Args:
+        columns: A SliceColumns object.
+
+    Returns:
+        A dict of tuples of numpy arrays of time and power, keyed by channel.
+    """
+    split = dict()
+    for code, channel in enumerate(columns.channels):
+        indices = np.flatnonzero(columns.codes == code)
+        if len(indices):
+            split[channel] = (columns.times[indices], columns.powers[indices])
+    return split
+
+
+def _integrate(prefix, times, powers, end):
+    """Integrates power from the last record of a prefix to a time.
+
+    Args:
+        prefix: A list of the prefix before the records.
+        times: A sorted numpy array of times of the records.
+        powers: A numpy array of powers of the records.
+        end: An int of the time to integrate to, not before the last record of
+            the prefix.
+
+    Returns:
+        A float of energy in power times microseconds.
+    """
+    number = int(np.searchsorted(times, end, 'right'))
+    times = times[:number]
+    powers = powers[:number]
+    if prefix[PREFIX_LAST_TIME] is not None:
+        times = np.concatenate(([prefix[PREFIX_LAST_TIME]], times))
+        powers = np.concatenate(([prefix[PREFIX_LAST_POWER]], powers))
+    if len(times) == 0:
+        return 0.0
+    durations = np.diff(np.append(times, end))
+    return float(np.dot(powers, durations))
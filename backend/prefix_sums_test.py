@@ -0,0 +1,94 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Test module for prefix_sums.py"""
+# pylint: disable=W0212
+
+from bisect import bisect_left
+from bisect import bisect_right
+from random import randint
+from random import seed
+
+import pytest
+from prefix_sums import PrefixSums
+from prefix_sums import get_cumulative
+from slice_format import from_records
+
+
+class TestPrefixSums:
+    """A Test Class for prefix_sums.py"""
+
+    @pytest.fixture
+    def records(self):
+        """Generates sorted records of two channels, with one channel starting late."""
+        seed(0)
+        records = list()
+        time = 1573149236256988
+        for index in range(300):
+            time += randint(0, 100)
+            channel = 'SYS' if index < 50 or index % 2 else 'PPX_ASYS'
+            records.append([time, randint(0, 500), channel])
+        return records
+
+    def expected_totals(self, records, channel, start, end):
+        """Counts and integrates records of a channel one at a time."""
+        records = [record for record in records if record[2] == channel]
+        powers = [record[1] for record in records if start <= record[0] <= end]
+        energy = 0
+        for index, record in enumerate(records):
+            next_time = records[index + 1][0] if index + 1 < len(records) else end
+            duration = min(next_time, end) - max(record[0], start)
+            if duration > 0:
+                energy += record[1] * duration
+        return len(powers), sum(powers), energy / 1E6
+
+    @pytest.mark.parametrize('number_per_slice', [1, 7, 100, 300])
+    def test_cumulative_ranges(self, records, number_per_slice):
+        """Tests totals between two times are the same as from the records."""
+        slices = [records[index:index+number_per_slice]
+                  for index in range(0, len(records), number_per_slice)]
+        starts = [slice_records[0][0] for slice_records in slices]
+        prefix_sums = PrefixSums()
+        prefixes = [prefix_sums.add_slice(from_records(slice_records))
+                    for slice_records in slices]
+
+        for start, end in [(records[0][0], records[-1][0]),
+                           (records[10][0], records[10][0]),
+                           (records[10][0] + 1, records[200][0]),
+                           (records[60][0], records[299][0] - 1)]:
+            start_index = max(bisect_left(starts, start) - 1, 0)
+            end_index = max(bisect_right(starts, end) - 1, 0)
+            before = get_cumulative(prefixes[start_index],
+                                    from_records(slices[start_index]), start, False)
+            until = get_cumulative(prefixes[end_index],
+                                   from_records(slices[end_index]), end, True)
+            for channel in ['SYS', 'PPX_ASYS']:
+                count, total, energy = self.expected_totals(records, channel, start, end)
+                count_before, total_before, energy_before = before.get(channel, (0, 0, 0))
+                count_until, total_until, energy_until = until.get(channel, (0, 0, 0))
+                assert count_until - count_before == count
+                assert total_until - total_before == pytest.approx(total)
+                assert energy_until - energy_before == pytest.approx(energy)
+
+    def test_prefixes(self, records):
+        """Tests prefixes summarize the records before each slice."""
+        prefix_sums = PrefixSums()
+        assert prefix_sums.add_slice(from_records(records[:40])) == {}
+        prefixes = prefix_sums.add_slice(from_records(records[40:]))
+        assert list(prefixes) == ['SYS']
+        count, total, energy, last_time, last_power = prefixes['SYS']
+        assert (count, total, last_time, last_power) == (
+            40, sum(record[1] for record in records[:40]), records[39][0], records[39][1])
+        assert energy == sum(record[1] * (records[index + 1][0] - record[0])
+                             for index, record in enumerate(records[:39]))
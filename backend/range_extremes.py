@@ -0,0 +1,145 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Module for exact min and max power over ranges of level0 slices."""
+import numpy as np
+
+from slice_format import STATS_MAX
+from slice_format import STATS_MIN
+
+
+class SparseTable:
+    """Answers the min or max over any range of columns in constant time.
+
+    Row k holds the reduction over 2^k columns from each column, so any range is
+    covered by two overlapping rows of the same k.
+    """
+
+    def __init__(self, values, reduce):
+        """Builds the table.
+
+        Args:
+            values: A 2-D numpy array, of which every row is reduced separately.
+            reduce: A numpy ufunc of two arrays, np.minimum or np.maximum.
+        """
+        self._reduce = reduce
+        self._rows = [values]
+        width = 1
+        while 2 * width <= values.shape[1]:
+            previous = self._rows[-1]
+            self._rows.append(reduce(previous[:, :-width], previous[:, width:]))
+            width *= 2
+
+    def query(self, first, last):
+        """Reduces a range of columns.
+
+        Args:
+            first: An int of the index of the first column.
+            last: An int of the index of the last column, included.
+
+        Returns:
+            A numpy array of the reduction of each row.
+        """
+        level = (last - first + 1).bit_length() - 1
+        row = self._rows[level]
+        return self._reduce(row[:, first], row[:, last - (1 << level) + 1])
+
+    def find_first(self, row, first, threshold):
+        """Finds the first column from a column on, that is beyond a threshold.
+
+        Beyond is above for a max table, and below for a min table. Ranges that
+        are not beyond are skipped from the widest down, so the search takes one
+        step per row of the table.
+
+        Args:
+            row: An int of the index of the row to search.
+            first: An int of the index of the column to start from.
+            threshold: A number to compare the values with.
+
+        Returns:
+            An int of the index of the column, the number of columns if none is.
+        """
+        beyond = np.greater if self._reduce is np.maximum else np.less
+        for level in range(len(self._rows) - 1, -1, -1):
+            values = self._rows[level][row]
+            if first < len(values) and not beyond(values[first], threshold):
+                first += 1 << level
+        return first
+
+
+class RangeExtremes:
+    """Min and max power of each channel over any range of level0 slices."""
+
+    def __init__(self, slice_names, slice_stats):
+        """Indexes the slice stats.
+
+        Args:
+            slice_names: A list of names of level0 slices in order of time.
+            slice_stats: A dict of stats of channels keyed by slice name, as in
+                SliceColumns.get_stats().
+        """
+        self._number_slices = len(slice_names)
+        self._channels = sorted({channel for stats in slice_stats.values() for channel in stats})
+        minimums = np.full((len(self._channels), len(slice_names)), np.inf)
+        maximums = np.full((len(self._channels), len(slice_names)), -np.inf)
+        rows = {channel: row for row, channel in enumerate(self._channels)}
+        for column, slice_name in enumerate(slice_names):
+            for channel, stats in slice_stats.get(slice_name, {}).items():
+                minimums[rows[channel], column] = stats[STATS_MIN]
+                maximums[rows[channel], column] = stats[STATS_MAX]
+        self._minimums = SparseTable(minimums, np.minimum)
+        self._maximums = SparseTable(maximums, np.maximum)
+
+    def query(self, first, last):
+        """Gets the min and max power of each channel over a range of slices.
+
+        Args:
+            first: An int of the index of the first slice.
+            last: An int of the index of the last slice, included.
+
+        Returns:
+            A tuple of two dicts, of min and max power keyed by channel, of
+            channels with records in the range. Empty if the range is empty.
+        """
+        if first > last:
+            return dict(), dict()
+        minimums = self._minimums.query(first, last).tolist()
+        maximums = self._maximums.query(first, last).tolist()
+        return ({channel: value for channel, value in zip(self._channels, minimums)
+                 if value != np.inf},
+                {channel: value for channel, value in zip(self._channels, maximums)
+                 if value != -np.inf})
+
+    def find_first(self, channel, first, threshold, above=True):
+        """Finds the first slice from a slice on, with power of a channel beyond a
+            threshold.
+
+        Args:
+            channel: A string of the channel name.
+            first: An int of the index of the slice to start from.
+            threshold: A number of power.
+            above: A boolean indicating if power is searched above the threshold, or
+                below it.
+
+        Returns:
+            An int of the index of the first slice that has a record of the channel
+            beyond the threshold, None if there is none.
+        """
+        if channel not in self._channels:
+            return None
+        table = self._maximums if above else self._minimums
+        index = table.find_first(self._channels.index(channel), first, threshold)
+        if index >= self._number_slices:
+            return None
+        return index
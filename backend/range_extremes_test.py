@@ -0,0 +1,80 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Test module for range_extremes.py"""
+# pylint: disable=W0212
+
+import numpy as np
+import pytest
+from range_extremes import RangeExtremes
+from range_extremes import SparseTable
+
+
+class TestRangeExtremes:
+    """A Test Class for range_extremes.py"""
+
+    @pytest.mark.parametrize('length', [1, 2, 7, 16, 33])
+    def test_sparse_table(self, length):
+        """Tests every range is reduced the same as all at once."""
+        values = np.random.RandomState(0).randint(0, 1000, (3, length)).astype(np.float64)
+        minimums = SparseTable(values, np.minimum)
+        maximums = SparseTable(values, np.maximum)
+        for first in range(length):
+            for last in range(first, length):
+                assert minimums.query(first, last).tolist() == \
+                    values[:, first:last+1].min(axis=1).tolist()
+                assert maximums.query(first, last).tolist() == \
+                    values[:, first:last+1].max(axis=1).tolist()
+
+    def test_range_extremes(self):
+        """Tests channels are only reported for slices they have records in."""
+        slice_stats = {
+            's0': {'SYS': [2, 10, 20, 30, 0, 1]},
+            's1': {'SYS': [1, 5, 5, 5, 2, 2], 'PPX_ASYS': [1, 50, 50, 50, 3, 3]},
+            's2': {'SYS': [1, 30, 30, 30, 4, 4]},
+        }
+        range_extremes = RangeExtremes(['s0', 's1', 's2', 's3'], slice_stats)
+        assert range_extremes.query(0, 3) == (
+            {'SYS': 5, 'PPX_ASYS': 50}, {'SYS': 30, 'PPX_ASYS': 50})
+        assert range_extremes.query(2, 3) == ({'SYS': 30}, {'SYS': 30})
+        assert range_extremes.query(3, 3) == ({}, {})
+        assert range_extremes.query(1, 0) == ({}, {})
+
+    @pytest.mark.parametrize('threshold', [-1, 0, 500, 998, 999, 1000])
+    def test_sparse_table_find_first(self, threshold):
+        """Tests searching the first column beyond a threshold."""
+        values = np.random.RandomState(0).randint(0, 1000, (2, 37)).astype(np.float64)
+        maximums = SparseTable(values, np.maximum)
+        minimums = SparseTable(values, np.minimum)
+        for row in range(2):
+            for first in range(38):
+                assert maximums.find_first(row, first, threshold) == next(
+                    (index for index in range(first, 37) if values[row, index] > threshold), 37)
+                assert minimums.find_first(row, first, threshold) == next(
+                    (index for index in range(first, 37) if values[row, index] < threshold), 37)
+
+    def test_range_extremes_find_first(self):
+        """Tests searching the first slice with power of a channel beyond a threshold."""
+        slice_stats = {
+            's0': {'SYS': [2, 10, 20, 30, 0, 1]},
+            's1': {'SYS': [1, 5, 5, 5, 2, 2], 'PPX_ASYS': [1, 50, 50, 50, 3, 3]},
+            's2': {'SYS': [1, 30, 30, 30, 4, 4]},
+        }
+        range_extremes = RangeExtremes(['s0', 's1', 's2'], slice_stats)
+        assert range_extremes.find_first('SYS', 0, 20) == 2
+        assert range_extremes.find_first('SYS', 0, 10, above=False) == 1
+        assert range_extremes.find_first('SYS', 2, 10, above=False) is None
+        assert range_extremes.find_first('PPX_ASYS', 0, 40) == 1
+        assert range_extremes.find_first('PPX_ASYS', 2, 40) is None
+        assert range_extremes.find_first('SOC', 0, 0) is None
@@ -12,90 +12,141 @@
 # limitations under the License.
 # =============================================================================
 """A Module for processing raw data."""
-from google.api_core.exceptions import RequestRangeNotSatisfiable
-from google.api_core.exceptions import NotFound
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+
+from storage_backend import get_backend
 from utils import parse_csv_line
 
+# Bytes per line guessed before any line is read.
 SIZE_ONE_LINE = 50
+# Number of ranges downloaded ahead of the lines being read.
+PREFETCH_DEPTH = 2
 
 
 class RawDataProcessor:
     """Class for processing raw data."""
 
     def __init__(self, rawfile, number_per_slice, bucket=None):
-        self._blob = None
-        self._bucket = bucket
+        self._storage = get_backend(bucket)
         self._eof = False
-        self._file = None
+        # If every byte of the file is downloaded.
+        self._downloaded = False
         self._file_pointer = 0
-        self._loaded_records = []
+        # Ranges requested and not read yet, as tuples of size and future.
+        self._requests = deque()
+        self._executor = None
+        # Complete lines downloaded and not read yet, and the line cut by the end
+        # of the last download.
+        self._lines = deque()
+        self._partial_line = b''
+        # Offset of the first byte not read yet, lines read up to it, and byte
+        # range of the last slice.
+        self._offset = 0
+        self._line_count = 0
+        self._slice_range = (0, 0)
         self._number_per_slice = number_per_slice
         self._rawfile = rawfile
 
-        if bucket is None:
-            self._file = open(rawfile, 'r')
-        else:
-            self._blob = self._bucket.blob(self._rawfile)
-
     def read_next_slice(self):
         """Reads raw data for a single slice.
 
+        The raw file is read in ranges of bytes, about as many as the lines of a
+        slice given the average size of lines read so far. The next ranges are
+        downloaded in the background while lines are read, and a line cut by the
+        end of a range is completed by the next one.
+
         Returns:
-            A list of records or a string representing the error if it applies.
+            A list of records, None for lines that cannot be parsed, or a string
+            representing the error if it applies.
         """
-        raw_records = []
         records = []
-
-        if self._bucket is None:
-            counter = 0
-            while counter < self._number_per_slice:
-                line = self._file.readline()
-                if line == '':
-                    self._file.close()
-                    self._eof = True
-                    break
-                records.append(parse_csv_line(line))
-                counter += 1
-            return records if records else 'Empty file'
-
-        if len(self._loaded_records) - 1 >= self._number_per_slice:
-            records = [
-                parse_csv_line(line)
-                for line in self._loaded_records[:self._number_per_slice]
-            ]
-            self._loaded_records = self._loaded_records[self._number_per_slice:]
-            return records
-
-        while len(self._loaded_records) + len(
-                raw_records) - 2 < self._number_per_slice:
-            try:
-                end = self._file_pointer + self._number_per_slice * SIZE_ONE_LINE
-                raw_records.extend(
-                    self._blob.download_as_string(
-                        start=self._file_pointer, end=end).decode().split('\n'))
-                self._file_pointer = end + 1
-            except RequestRangeNotSatisfiable:
-                self._eof = True
+        start = self._offset
+        while len(records) < self._number_per_slice:
+            if self._lines:
+                line = self._lines.popleft()
+                self._offset += len(line) + 1
+            elif not self._downloaded:
+                if not self._download():
+                    return 'File not found!'
+                continue
+            elif self._partial_line:
+                # The last line of a file that does not end with a new line.
+                line = self._partial_line
+                self._partial_line = b''
+                self._offset += len(line)
+            else:
+                self._eof = not records
                 break
-            except NotFound:
-                return 'File not found!'
-        if raw_records and self._loaded_records:
-            raw_records[0] = self._loaded_records[-1] + raw_records[0]
-            self._loaded_records[-1] = ''
-
-        for index in range(len(self._loaded_records)):
-            record = parse_csv_line(self._loaded_records[index])
-            if record:
-                records.append(record)
-        for index, raw_record in enumerate(raw_records):
-            if len(records) >= self._number_per_slice:
-                self._loaded_records = raw_records[index:]
-                break
-            record = parse_csv_line(raw_record)
-            if record:
-                records.append(record)
+            self._line_count += 1
+            # Empty lines are skipped, lines that cannot be parsed are kept as None.
+            if line:
+                records.append(parse_csv_line(line.decode()))
+        if self._offset == 0:
+            return 'Empty file'
+        self._slice_range = (start, self._offset)
         return records
 
+    def _download(self):
+        """Splits the next range of the raw file into lines.
+
+        Returns:
+            A boolean indicating if the raw file exists.
+        """
+        self._request_ranges()
+        size, future = self._requests.popleft()
+        try:
+            data = future.result()
+        except FileNotFoundError:
+            self._stop_downloads()
+            return False
+        # Lines are split once per range, and only the cut line is joined again.
+        lines = (self._partial_line + data).split(b'\n')
+        self._partial_line = lines.pop()
+        self._lines.extend(lines)
+        if len(data) < size:
+            # Ranges after the end of the file are empty.
+            self._stop_downloads()
+        else:
+            self._request_ranges()
+        return True
+
+    def _request_ranges(self):
+        """Requests ranges of the raw file until PREFETCH_DEPTH are in flight."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(PREFETCH_DEPTH)
+        while len(self._requests) < PREFETCH_DEPTH:
+            size = self._number_per_slice * self._get_line_size()
+            future = self._executor.submit(
+                self._storage.get_range, self._rawfile, self._file_pointer,
+                self._file_pointer + size - 1)
+            self._requests.append((size, future))
+            self._file_pointer += size
+
+    def _get_line_size(self):
+        """Gets the average size of lines read so far, SIZE_ONE_LINE before any."""
+        if self._line_count == 0:
+            return SIZE_ONE_LINE
+        return max(1, ceil(self._offset / self._line_count))
+
+    def _stop_downloads(self):
+        """Drops the ranges in flight, once the file is downloaded or missing."""
+        self._downloaded = True
+        for _, future in self._requests:
+            future.cancel()
+        self._requests.clear()
+        self._executor.shutdown(wait=False)
+
+    def get_slice_range(self):
+        """Gets the range of bytes of the raw file that the last slice was read from.
+
+        Returns:
+            A tuple of ints of the offset of the first byte, and of the byte after
+            the last one.
+        """
+        return self._slice_range
+
     def readable(self):
         """Checks if the raw file is readable.
 
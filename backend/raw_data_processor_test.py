@@ -19,9 +19,23 @@ from tempfile import NamedTemporaryFile
 
 import pytest
 from raw_data_processor import RawDataProcessor
+from raw_data_processor import SIZE_ONE_LINE
+from storage_backend import MemoryBackend
 from utils import convert_to_csv
 
 
+class CountingBackend(MemoryBackend):
+    """A backend in memory that keeps the sizes of ranges requested."""
+
+    def __init__(self):
+        super().__init__()
+        self.range_sizes = list()
+
+    def get_range(self, path, start, end):
+        self.range_sizes.append(end - start + 1)
+        return super().get_range(path, start, end)
+
+
 class TestRawDataProcessor:
     """Test class for RawDataProcessor class."""
 
@@ -97,3 +111,39 @@ class TestRawDataProcessor:
         assert records == [None, None, None]
 
         bad_data.close()
+
+    def test_read_next_slice_returns_error_message_for_missing_file(self):
+        """Tests to ensure it returns an error message for missing files."""
+        raw_data = RawDataProcessor('missing.csv', 10, MemoryBackend())
+
+        assert raw_data.read_next_slice() == 'File not found!'
+
+    def test_slice_ranges(self):
+        """Tests slices are read from the byte ranges of their lines."""
+        lines = ['1,1,SYS', '', '2,2,caf\u00e9', '3,3,SYS', '4,4,SYS']
+        storage = MemoryBackend()
+        storage.put('raw.csv', '\n'.join(lines))
+        raw_data = RawDataProcessor('raw.csv', 2, storage)
+
+        slices = list()
+        while raw_data.readable():
+            slices.append((raw_data.read_next_slice(), raw_data.get_slice_range()))
+        assert slices == [
+            ([[1.0, 1.0, 'SYS'], [2.0, 2.0, 'caf\u00e9']], (0, 19)),
+            ([[3.0, 3.0, 'SYS'], [4.0, 4.0, 'SYS']], (19, 34)),
+            ([], (34, 34))]
+
+    def test_adaptive_ranges(self):
+        """Tests ranges are sized by the lines read so far, and cut lines are read whole."""
+        records = [[1573149236256988 + index, index, 'A' * 150] for index in range(1000)]
+        storage = CountingBackend()
+        storage.put('raw.csv', convert_to_csv(records))
+        raw_data = RawDataProcessor('raw.csv', 100, storage)
+
+        read_records = list()
+        while raw_data.readable():
+            read_records += raw_data.read_next_slice()
+        assert read_records == records
+        assert storage.range_sizes[0] == 100 * SIZE_ONE_LINE
+        assert max(storage.range_sizes) > 100 * 150
+        assert len(storage.range_sizes) < 20
@@ -0,0 +1,36 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Test module for generating records shared by tests."""
+
+
+START = 1573149236256988
+
+
+def make_records():
+    """Generates records of a dense channel, one that ends early, and a sparse one.
+
+    Returns:
+        A list of records of SYS every 100 us, SOC for the first 20 of them, and GPU
+        every 97 of them.
+    """
+    records = list()
+    for index in range(1000):
+        time = START + index * 100
+        records.append([time, index % 50, 'SYS'])
+        if index < 20:
+            records.append([time + 10, 5 + index % 3, 'SOC'])
+        if index % 97 == 0:
+            records.append([time + 20, 200 + index % 7, 'GPU'])
+    return records
@@ -0,0 +1,76 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Module for caching encoded responses in memory."""
+from hashlib import sha1
+
+from slice_cache import LruCache
+
+# Rough size of a cached entry aside from its body, including the key.
+ENTRY_OVERHEAD_BYTES = 512
+
+
+class ResponseCache(LruCache):
+    """A thread-safe LRU cache of encoded response bodies, bounded by size.
+
+    Keys are tuples that start with the name of the raw file, and must hold
+    everything the response depends on, including the generation of the
+    preprocess, so that a file preprocessed again is never served from the
+    cache. Each body has an ETag of its content, for conditional requests.
+    """
+
+    def get(self, key):
+        """Gets a cached response.
+
+        Args:
+            key: A tuple of the query, starting with the name of the raw file.
+
+        Returns:
+            A tuple of the body, mimetype and ETag, None if the response is not cached.
+        """
+        return self._get_entry(key)
+
+    def put(self, key, body, mimetype):
+        """Caches a response, evicting least recently used responses when over budget.
+
+        Args:
+            key: A tuple of the query, starting with the name of the raw file.
+            body: A bytes object of the encoded response.
+            mimetype: A string of the mimetype of the body.
+
+        Returns:
+            A string of the ETag of the body.
+        """
+        etag = sha1(body).hexdigest()
+        self._put_entry(key, (body, mimetype, etag))
+        return etag
+
+    def invalidate(self, name):
+        """Drops all responses of a raw file.
+
+        Args:
+            name: A string of the name of the raw file.
+        """
+        self._drop_entries(lambda key: key[0] == name)
+
+    def _get_size(self, entry):
+        """Estimates the memory used by a cached response.
+
+        Args:
+            entry: A tuple of the body, mimetype and ETag.
+
+        Returns:
+            An int of the approximate size in bytes.
+        """
+        return len(entry[0]) + ENTRY_OVERHEAD_BYTES
@@ -0,0 +1,73 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Test module for ResponseCache Class."""
+# pylint: disable=W0212
+
+from response_cache import ENTRY_OVERHEAD_BYTES
+from response_cache import ResponseCache
+
+
+class TestResponseCache:
+    """A Test Class for ResponseCache Class."""
+
+    def test_get_put(self):
+        """Tests hits and misses, and ETags of the content."""
+        cache = ResponseCache(10000)
+        key = ('f', 1, 'avg', 600, 0, 100, None, 'application/json')
+        assert cache.get(key) is None
+        etag = cache.put(key, b'{"data": []}', 'application/json')
+        assert cache.get(key) == (b'{"data": []}', 'application/json', etag)
+        assert cache.get(('f', 2) + key[2:]) is None
+        assert cache.put(('f2',) + key[1:], b'{"data": []}', 'application/json') == etag
+        assert cache.put(key, b'{"data": [1]}', 'application/json') != etag
+        assert cache.get_stats() == {
+            'entries': 2,
+            'size': 2 * ENTRY_OVERHEAD_BYTES + 25,
+            'hits': 1,
+            'misses': 2,
+            'evictions': 0
+        }
+
+    def test_evict_least_recently_used(self):
+        """Tests the least recently used responses are evicted when over budget."""
+        cache = ResponseCache(3 * (ENTRY_OVERHEAD_BYTES + 10))
+        for index in range(3):
+            cache.put(('f', index), b'0123456789', 'application/json')
+        cache.get(('f', 0))
+        cache.put(('f', 3), b'0123456789', 'application/json')
+
+        assert cache.get(('f', 1)) is None
+        for index in [0, 2, 3]:
+            assert cache.get(('f', index)) is not None
+        assert cache.evictions == 1
+        assert cache.size == 3 * (ENTRY_OVERHEAD_BYTES + 10)
+
+    def test_too_large(self):
+        """Tests responses larger than the budget are not cached."""
+        cache = ResponseCache(100)
+        assert cache.put(('f',), b'0123456789', 'application/json')
+        assert cache.get(('f',)) is None
+        assert cache.size == 0
+
+    def test_invalidate(self):
+        """Tests invalidating responses of one raw file."""
+        cache = ResponseCache(10000)
+        cache.put(('f', 1), b'0123456789', 'application/json')
+        cache.put(('f2', 1), b'0123456789', 'application/json')
+        cache.invalidate('f')
+
+        assert cache.get(('f', 1)) is None
+        assert cache.get(('f2', 1)) is not None
+        assert cache.size == ENTRY_OVERHEAD_BYTES + 10
@@ -0,0 +1,109 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Module for the binary encoding of responses of downsampled data.
+
+A binary response starts with the length of a json header as a little-endian
+uint32, followed by the header, padded with spaces so that the body starts at
+a multiple of 8 bytes. The header holds the frequency ratio and, for each
+channel, its name, min and max, number of records, the time of its first
+record, and where its arrays are in the body. Each channel has an array of
+time deltas from the previous record, the first being 0, followed by an array
+of powers as float32. Each array starts at a multiple of 8 bytes, so that it
+can be viewed as a typed array in place.
+"""
+import json
+
+import numpy as np
+
+BINARY_MIMETYPE = 'application/octet-stream'
+_HEADER_LENGTH_DTYPE = np.dtype('<u4')
+_POWER_DTYPE = np.dtype('<f4')
+# Time deltas are uint32 if they fit, which covers gaps up to about 71 minutes.
+_SHORT_TIME_DTYPE = np.dtype('<u4')
+_LONG_TIME_DTYPE = np.dtype('<i8')
+_ALIGNMENT = 8
+
+
+def encode_binary(data, frequency_ratio):
+    """Encodes downsampled data in binary.
+
+    Args:
+        data: A list of dicts of the data of each channel, as in
+            LevelSlices.format_response().
+        frequency_ratio: A float of the precision of the data.
+
+    Returns:
+        A bytes object of the encoded response.
+    """
+    channels = list()
+    arrays = list()
+    offset = 0
+    for channel_response in data:
+        records = channel_response['data']
+        times = np.array([record[0] for record in records], dtype=np.int64)
+        powers = np.array([record[1] for record in records], dtype=_POWER_DTYPE)
+        deltas = np.diff(times, prepend=times[:1])
+        time_dtype = _LONG_TIME_DTYPE
+        if len(deltas) == 0 or (deltas.min() >= 0 and
+                                deltas.max() <= np.iinfo(_SHORT_TIME_DTYPE).max):
+            time_dtype = _SHORT_TIME_DTYPE
+        channel = {key: value for key, value in channel_response.items() if key != 'data'}
+        channel['length'] = len(records)
+        channel['base_time'] = int(times[0]) if len(times) else 0
+        channel['time_dtype'] = time_dtype.str
+        for name, array in [('times_offset', deltas.astype(time_dtype)),
+                            ('powers_offset', powers)]:
+            channel[name] = offset
+            array_bytes = array.tobytes()
+            arrays.append(array_bytes + b'\0' * _get_padding(len(array_bytes)))
+            offset += len(arrays[-1])
+        channels.append(channel)
+
+    header = json.dumps({'frequency_ratio': frequency_ratio,
+                         'channels': channels}).encode()
+    header += b' ' * _get_padding(_HEADER_LENGTH_DTYPE.itemsize + len(header))
+    return b''.join([np.array(len(header), _HEADER_LENGTH_DTYPE).tobytes(), header] + arrays)
+
+
+def decode_binary(data):
+    """Decodes a binary response.
+
+    Args:
+        data: A bytes object of the encoded response.
+
+    Returns:
+        A tuple of a list of dicts of the data of each channel, as in
+        LevelSlices.format_response(), with powers rounded to float32, and the
+        frequency ratio.
+    """
+    header_length = int(np.frombuffer(data, _HEADER_LENGTH_DTYPE, 1)[0])
+    body_offset = _HEADER_LENGTH_DTYPE.itemsize + header_length
+    header = json.loads(data[_HEADER_LENGTH_DTYPE.itemsize:body_offset])
+    response = list()
+    for channel in header['channels']:
+        length = channel.pop('length')
+        deltas = np.frombuffer(data, np.dtype(channel.pop('time_dtype')), length,
+                               body_offset + channel.pop('times_offset'))
+        powers = np.frombuffer(data, _POWER_DTYPE, length,
+                               body_offset + channel.pop('powers_offset'))
+        times = channel.pop('base_time') + np.cumsum(deltas, dtype=np.int64)
+        channel['data'] = [list(record) for record in zip(times.tolist(), powers.tolist())]
+        response.append(channel)
+    return response, header['frequency_ratio']
+
+
+def _get_padding(length):
+    """Gets the number of bytes to pad a length to the alignment."""
+    return -length % _ALIGNMENT
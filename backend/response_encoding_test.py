@@ -0,0 +1,76 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Test module for response_encoding.py"""
+# pylint: disable=W0212
+
+import json
+from random import randint
+from random import seed
+
+import numpy as np
+import pytest
+from response_encoding import decode_binary
+from response_encoding import encode_binary
+
+
+class TestResponseEncoding:
+    """A Test Class for response_encoding.py"""
+
+    @pytest.fixture
+    def data(self):
+        """Generates responses of channels with short and long gaps in time."""
+        seed(0)
+        data = list()
+        for name, max_gap in [('SYS', 1000), ('PPX_ASYS', 10 ** 10)]:
+            time = 1573149236256988
+            records = list()
+            for _ in range(500):
+                time += randint(0, max_gap)
+                records.append([time, randint(0, 5000) / 8])
+            data.append({'name': name, 'data': records,
+                         'min': min(record[1] for record in records),
+                         'max': max(record[1] for record in records)})
+        data.append({'name': 'SOC', 'data': [], 'min': 0, 'max': 0})
+        return data
+
+    def test_round_trip(self, data):
+        """Tests decoded data is the same as the data encoded."""
+        encoded = encode_binary(data, 0.25)
+        decoded, frequency_ratio = decode_binary(encoded)
+        assert frequency_ratio == 0.25
+        assert decoded == data
+
+    def test_alignment(self, data):
+        """Tests arrays are aligned, and time deltas are short when they fit."""
+        encoded = encode_binary(data, 1)
+        header_length = int(np.frombuffer(encoded, '<u4', 1)[0])
+        assert (4 + header_length) % 8 == 0
+        header = json.loads(encoded[4:4 + header_length])
+        time_dtypes = [channel['time_dtype'] for channel in header['channels']]
+        assert time_dtypes == ['<u4', '<i8', '<u4']
+        for channel in header['channels']:
+            assert channel['times_offset'] % 8 == 0
+            assert channel['powers_offset'] % 8 == 0
+
+    def test_smaller_than_json(self, data):
+        """Tests the binary encoding is smaller than json."""
+        assert len(encode_binary(data, 1)) * 2 < len(json.dumps(
+            {'data': data, 'frequency_ratio': 1}))
+
+    def test_unsorted_times(self):
+        """Tests times out of order are encoded as signed deltas."""
+        data = [{'name': 'SYS', 'data': [[10, 1.0], [5, 2.0], [20, 3.0]]}]
+        decoded, _ = decode_binary(encode_binary(data, 1))
+        assert decoded == data
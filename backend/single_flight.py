@@ -0,0 +1,82 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Module for coalescing identical concurrent calls."""
+from concurrent.futures import Future
+from threading import Lock
+
+
+class SingleFlight:
+    """Runs a call once for all callers that ask for the same key at once.
+
+    The first caller of a key runs the call, and callers of the same key that
+    come while it runs wait for its result, or its exception, instead of running
+    the call again. Results are not kept once the call is done.
+    """
+
+    def __init__(self):
+        # key: key of a running call, value: Future of its result.
+        self._futures = dict()
+        self._lock = Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, function):
+        """Runs a call, or waits for the running call of the same key.
+
+        Args:
+            key: A hashable key of the call.
+            function: A function without arguments that makes the call.
+
+        Returns:
+            The result of the call.
+
+        Raises:
+            The exception raised by the call.
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            running = future is not None
+            if running:
+                self.shared += 1
+            else:
+                self.calls += 1
+                future = Future()
+                self._futures[key] = future
+        if running:
+            return future.result()
+
+        try:
+            result = function()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                del self._futures[key]
+        return result
+
+    def get_stats(self):
+        """Gets the counters of calls.
+
+        Returns:
+            A dict of the number of calls run, and of calls that waited for them.
+        """
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'shared': self.shared
+            }
@@ -0,0 +1,83 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Test module for SingleFlight Class."""
+# pylint: disable=W0212
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from time import sleep
+
+import pytest
+from single_flight import SingleFlight
+
+
+class TestSingleFlight:
+    """A Test Class for SingleFlight Class."""
+
+    def run_concurrently(self, single_flight, keys, function):
+        """Calls a function for each key at once, once the first call is running."""
+        started = Event()
+        release = Event()
+
+        def call():
+            started.set()
+            release.wait()
+            return function()
+
+        with ThreadPoolExecutor(len(keys)) as executor:
+            first = executor.submit(single_flight.do, keys[0], call)
+            started.wait()
+            others = [executor.submit(single_flight.do, key, call) for key in keys[1:]]
+            while single_flight.calls + single_flight.shared < len(keys):
+                sleep(0.001)
+            release.set()
+            return [future.exception() or future.result() for future in [first] + others]
+
+    def test_coalesce(self):
+        """Tests concurrent calls of the same key are run once."""
+        single_flight = SingleFlight()
+        calls = list()
+
+        def function():
+            calls.append(1)
+            return object()
+
+        results = self.run_concurrently(single_flight, ['a'] * 5 + ['b'], function)
+        assert len(calls) == 2
+        assert all(result is results[0] for result in results[:5])
+        assert results[5] is not results[0]
+        assert single_flight.get_stats() == {'calls': 2, 'shared': 4}
+        assert single_flight._futures == {}
+
+    def test_exception(self):
+        """Tests an exception of the call is raised to every caller."""
+        single_flight = SingleFlight()
+
+        def function():
+            raise FileNotFoundError('s0.bin')
+
+        results = self.run_concurrently(single_flight, ['a'] * 3, function)
+        assert all(isinstance(result, FileNotFoundError) for result in results)
+        assert single_flight._futures == {}
+
+        with pytest.raises(FileNotFoundError):
+            single_flight.do('a', function)
+
+    def test_sequential(self):
+        """Tests results are not kept once calls are done."""
+        single_flight = SingleFlight()
+        assert single_flight.do('a', lambda: 1) == 1
+        assert single_flight.do('a', lambda: 2) == 2
+        assert single_flight.get_stats() == {'calls': 2, 'shared': 0}
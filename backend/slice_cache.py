@@ -0,0 +1,174 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Module for caching decoded slices in memory."""
+from collections import OrderedDict
+from threading import Lock
+
+# Rough size of a cached entry aside from its arrays, including the key.
+ENTRY_OVERHEAD_BYTES = 1024
+
+
+class LruCache:
+    """A thread-safe LRU cache, bounded by the approximate size of its entries.
+
+    Subclasses define the keys and entries they cache, and estimate the size
+    of an entry in _get_size().
+    """
+
+    def __init__(self, max_bytes):
+        """Initializes the cache.
+
+        Args:
+            max_bytes: An int of the approximate budget of memory for cached entries.
+        """
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_stats(self):
+        """Gets the counters of the cache.
+
+        Returns:
+            A dict of the number of entries, size in bytes, hits, misses and evictions.
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def _get_entry(self, key):
+        """Gets a cached entry and marks it as most recently used.
+
+        Args:
+            key: A hashable key of the entry.
+
+        Returns:
+            The cached entry, None if the key is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def _put_entry(self, key, entry):
+        """Caches an entry, evicting least recently used entries when over budget.
+
+        Entries larger than the whole budget are not cached.
+
+        Args:
+            key: A hashable key of the entry.
+            entry: The entry to cache.
+        """
+        size = self._get_size(entry)
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._get_size(self._entries.pop(key))
+            self._entries[key] = entry
+            self.size += size
+            while self.size > self._max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= self._get_size(evicted)
+                self.evictions += 1
+
+    def _drop_entries(self, predicate):
+        """Drops all entries whose key matches a predicate.
+
+        Args:
+            predicate: A function that takes a key and returns True to drop its entry.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self.size -= self._get_size(self._entries.pop(key))
+
+    def _get_size(self, entry):
+        """Estimates the memory used by a cached entry.
+
+        Args:
+            entry: A cached entry.
+
+        Returns:
+            An int of the approximate size in bytes.
+        """
+        raise NotImplementedError
+
+
+class SliceCache(LruCache):
+    """A thread-safe LRU cache of decoded slices, bounded by an approximate size.
+
+    Slices are keyed by path and the generation of the preprocess that wrote them,
+    so slices of a file that is preprocessed again are never served from the
+    cache. Entries of old generations are evicted as they age out, or dropped
+    at once by invalidate().
+    """
+
+    def get(self, path, generation):
+        """Gets a cached slice.
+
+        Args:
+            path: A string of the path to the slice.
+            generation: The generation of the preprocess that wrote the slice.
+
+        Returns:
+            A SliceColumns object, None if the slice is not cached.
+        """
+        return self._get_entry((path, generation))
+
+    def put(self, path, generation, columns):
+        """Caches a slice, evicting least recently used slices when over budget.
+
+        Args:
+            path: A string of the path to the slice.
+            generation: The generation of the preprocess that wrote the slice.
+            columns: A SliceColumns object of all records in the slice.
+        """
+        self._put_entry((path, generation), columns)
+
+    def invalidate(self, prefix):
+        """Drops all slices under a directory.
+
+        Args:
+            prefix: A string of the directory, e.g. preprocess files of one raw file.
+        """
+        prefix = prefix.rstrip('/') + '/'
+        self._drop_entries(lambda key: key[0].startswith(prefix))
+
+    def _get_size(self, columns):
+        """Estimates the memory used by a cached slice.
+
+        Args:
+            columns: A SliceColumns object.
+
+        Returns:
+            An int of the approximate size in bytes.
+        """
+        size = (columns.times.nbytes + columns.powers.nbytes + columns.codes.nbytes +
+                ENTRY_OVERHEAD_BYTES)
+        if columns.aggregates is not None:
+            size += sum(column.nbytes for column in columns.aggregates)
+        return size
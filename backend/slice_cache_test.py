@@ -0,0 +1,97 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Test module for SliceCache Class."""
+# pylint: disable=W0212
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from slice_cache import ENTRY_OVERHEAD_BYTES
+from slice_cache import SliceCache
+from slice_format import from_records
+
+
+class TestSliceCache:
+    """A Test Class for SliceCache Class."""
+
+    @pytest.fixture
+    def columns(self):
+        """Generates a slice of 10 records, of 1024 + 10 * 18 bytes when cached."""
+        return from_records([[1573149236256988 + index, index, 'SYS']
+                             for index in range(10)])
+
+    def test_get_put(self, columns):
+        """Tests hits and misses, by path and generation."""
+        cache = SliceCache(10000)
+        assert cache.get('f/level0/s0.bin', 1) is None
+        cache.put('f/level0/s0.bin', 1, columns)
+        assert cache.get('f/level0/s0.bin', 1) is columns
+        assert cache.get('f/level0/s0.bin', 2) is None
+        assert cache.get_stats() == {
+            'entries': 1,
+            'size': ENTRY_OVERHEAD_BYTES + 180,
+            'hits': 1,
+            'misses': 2,
+            'evictions': 0
+        }
+
+    def test_evict_least_recently_used(self, columns):
+        """Tests the least recently used slices are evicted when over budget."""
+        cache = SliceCache(3 * (ENTRY_OVERHEAD_BYTES + 180))
+        for index in range(3):
+            cache.put('s{}'.format(index), 1, columns)
+        cache.get('s0', 1)
+        cache.put('s3', 1, columns)
+
+        assert cache.get('s1', 1) is None
+        for index in [0, 2, 3]:
+            assert cache.get('s{}'.format(index), 1) is columns
+        assert cache.evictions == 1
+        assert cache.size == 3 * (ENTRY_OVERHEAD_BYTES + 180)
+
+    def test_too_large(self, columns):
+        """Tests slices larger than the budget are not cached."""
+        cache = SliceCache(100)
+        cache.put('s0', 1, columns)
+        assert cache.get('s0', 1) is None
+        assert cache.size == 0
+
+    def test_invalidate(self, columns):
+        """Tests invalidating slices of one preprocessed file."""
+        cache = SliceCache(10000)
+        cache.put('mld-preprocess/f/level0/s0.bin', 1, columns)
+        cache.put('mld-preprocess/f2/level0/s0.bin', 1, columns)
+        cache.invalidate('mld-preprocess/f')
+
+        assert cache.get('mld-preprocess/f/level0/s0.bin', 1) is None
+        assert cache.get('mld-preprocess/f2/level0/s0.bin', 1) is columns
+        assert cache.size == ENTRY_OVERHEAD_BYTES + 180
+
+    def test_threads(self, columns):
+        """Tests counters and size stay consistent under concurrent access."""
+        cache = SliceCache(5 * (ENTRY_OVERHEAD_BYTES + 180))
+
+        def access(index):
+            path = 's{}'.format(index % 8)
+            if cache.get(path, 1) is None:
+                cache.put(path, 1, columns)
+
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(access, range(2000)))
+
+        stats = cache.get_stats()
+        assert stats['hits'] + stats['misses'] == 2000
+        assert stats['entries'] <= 5
+        assert stats['size'] == stats['entries'] * (ENTRY_OVERHEAD_BYTES + 180)
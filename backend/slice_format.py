@@ -0,0 +1,366 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""Slice file formats.
+
+Slices are stored either as CSV, one record per line, or in a binary columnar
+format. The binary format is laid out as:
+
+    magic (4 bytes) | header length (uint32) | JSON header | padding to 8 bytes |
+    times (int64 x count) | powers (float32 or float64 x count) |
+    channels (uint16 x count)
+
+all little-endian. The header holds the number of records, the power dtype and
+the channel names, and the channel column holds indices into the channel names.
+Slices of aggregate records are flagged in the header, and followed by
+
+    counts (int64 x count) | sums (float64 x count) | mins | maxs
+
+with min and max in the power dtype. In CSV, the aggregate fields follow the
+channel on each line. The format of a slice is given by the extension of its
+file name.
+"""
+from json import dumps
+from json import loads
+from operator import itemgetter
+from struct import pack
+from struct import unpack_from
+
+import numpy as np
+
+from downsample import AGGREGATE_COUNT
+from downsample import AGGREGATE_MAX
+from downsample import AGGREGATE_MIN
+from downsample import AGGREGATE_SUM
+from utils import FLOAT_PRECISION
+from utils import convert_to_csv
+from utils import parse_csv_line
+
+CSV_FORMAT = 'csv'
+BINARY_FORMAT = 'bin'
+SLICE_FORMATS = [CSV_FORMAT, BINARY_FORMAT]
+POWER_DTYPES = ['float32', 'float64']
+# Fields of the summary of one channel in a slice, see SliceColumns.get_stats().
+STATS_COUNT, STATS_MIN, STATS_MAX, STATS_SUM, STATS_FIRST, STATS_LAST = range(6)
+
+_MAGIC = b'PDS1'
+_ALIGNMENT = 8
+_TIME_DTYPE = np.dtype('<i8')
+_CHANNEL_DTYPE = np.dtype('<u2')
+_COUNT_DTYPE = np.dtype('<i8')
+_SUM_DTYPE = np.dtype('<f8')
+
+
+class SliceColumns:
+    """Records of a slice, stored column by column."""
+
+    def __init__(self, times, powers, codes, channels, aggregates=None):
+        """Initializes the columns.
+
+        Args:
+            times: A numpy array of timestamps.
+            powers: A numpy array of float64 power values.
+            codes: A numpy array of indices into channels, one per record.
+            channels: A list of channel names.
+            aggregates: A tuple of numpy arrays of count, sum, min and max of each
+                record, None if records are not aggregates.
+        """
+        self.times = times
+        self.powers = powers
+        self.codes = codes
+        self.channels = channels
+        self.aggregates = aggregates
+
+    def __len__(self):
+        return len(self.times)
+
+    def select(self, indices):
+        """Gets the records at the given indices.
+
+        Args:
+            indices: A slice, boolean mask or array of indices into the columns.
+
+        Returns:
+            A SliceColumns object.
+        """
+        aggregates = None
+        if self.aggregates is not None:
+            aggregates = tuple(column[indices] for column in self.aggregates)
+        return SliceColumns(self.times[indices], self.powers[indices],
+                            self.codes[indices], self.channels, aggregates)
+
+    def trim(self, start=None, end=None):
+        """Gets the records in a time range, for records sorted by time.
+
+        Args:
+            start: An int of the start of the range, None if unbounded.
+            end: An int of the end of the range, both included, None if unbounded.
+
+        Returns:
+            A SliceColumns object, sharing memory with this one.
+        """
+        first, last = _search_range(self.times, start, end)
+        if first == 0 and last == len(self):
+            return self
+        return self.select(slice(first, last))
+
+    def get_stats(self):
+        """Summarizes the records of each channel.
+
+        Aggregate records are summarized by the records they aggregate.
+
+        Returns:
+            A dict keyed by channel, of lists of count, min power, max power, sum of
+            power, first and last timestamp. Use the STATS_* constants as indices.
+        """
+        stats = dict()
+        for code, channel in enumerate(self.channels):
+            indices = np.flatnonzero(self.codes == code)
+            if len(indices) == 0:
+                continue
+            times = self.times[indices]
+            if self.aggregates is None:
+                powers = self.powers[indices]
+                count, minimum, maximum, total = (
+                    len(indices), powers.min(), powers.max(), powers.sum())
+            else:
+                counts, sums, mins, maxs = (column[indices] for column in self.aggregates)
+                count, minimum, maximum, total = (
+                    counts.sum(), mins.min(), maxs.max(), sums.sum())
+            stats[channel] = [int(count), minimum.item(), maximum.item(), total.item(),
+                              int(times.min()), int(times.max())]
+        return stats
+
+    def to_records(self):
+        """Converts the columns to records grouped by channel.
+
+        Returns:
+            A dict of records ([time, power, channel]) keyed by channel, in the
+            order channels first appear. Aggregate records are followed by their
+            count, sum, min and max.
+        """
+        records = dict()
+        for code, channel in enumerate(self.channels):
+            indices = np.flatnonzero(self.codes == code)
+            if len(indices) == 0:
+                continue
+            records[channel] = [
+                [time, power, channel] for time, power in zip(
+                    self.times[indices].tolist(), self.powers[indices].tolist())
+            ]
+            if self.aggregates is not None:
+                for record, *aggregate in zip(records[channel], *(
+                        column[indices].tolist() for column in self.aggregates)):
+                    record.extend(aggregate)
+        return records
+
+
+def get_slice_format(path):
+    """Gets the format of a slice from its file name.
+
+    Args:
+        path: A string of the path to the slice.
+
+    Returns:
+        A string of the slice format.
+    """
+    if path.endswith('.' + BINARY_FORMAT):
+        return BINARY_FORMAT
+    return CSV_FORMAT
+
+
+def from_records(records):
+    """Converts records to columns.
+
+    Args:
+        records: A list of records ([time, power, channel]), or of aggregate records.
+
+    Returns:
+        A SliceColumns object.
+    """
+    channels = dict()
+    codes = [channels.setdefault(record[2], len(channels)) for record in records]
+    aggregates = None
+    if records and len(records[0]) > AGGREGATE_MAX:
+        aggregates = tuple(
+            np.fromiter(map(itemgetter(index), records), dtype, len(records))
+            for index, dtype in [(AGGREGATE_COUNT, np.int64), (AGGREGATE_SUM, np.float64),
+                                 (AGGREGATE_MIN, np.float64), (AGGREGATE_MAX, np.float64)])
+    return SliceColumns(
+        np.fromiter(map(itemgetter(0), records), np.float64, len(records)),
+        np.fromiter(map(itemgetter(1), records), np.float64, len(records)),
+        np.array(codes, dtype=_CHANNEL_DTYPE), list(channels), aggregates)
+
+
+def encode(records, slice_format=CSV_FORMAT, power_dtype='float64'):
+    """Encodes records to the content of a slice file.
+
+    Args:
+        records: A list of records ([time, power, channel]), or of aggregate records,
+            sorted by time.
+        slice_format: A string of the slice format.
+        power_dtype: A string of the dtype of power values, for binary format.
+
+    Returns:
+        A string for CSV format, bytes for binary format.
+    """
+    if slice_format == CSV_FORMAT:
+        return convert_to_csv(records)
+
+    columns = from_records(records)
+    header = {
+        'count': len(columns),
+        'power_dtype': power_dtype,
+        'channels': columns.channels
+    }
+    if columns.aggregates is not None:
+        header['aggregates'] = True
+    header = dumps(header).encode()
+    prefix = _MAGIC + pack('<I', len(header)) + header
+    prefix += b'\0' * (-len(prefix) % _ALIGNMENT)
+
+    power_dtype = np.dtype(power_dtype).newbyteorder('<')
+    parts = [
+        prefix,
+        columns.times.astype(_TIME_DTYPE).tobytes(),
+        columns.powers.astype(power_dtype).tobytes(),
+        columns.codes.tobytes()
+    ]
+    if columns.aggregates is not None:
+        parts.extend(column.astype(dtype).tobytes() for column, dtype in zip(
+            columns.aggregates, _get_aggregate_dtypes(power_dtype)))
+    return b''.join(parts)
+
+
+def decode(data, slice_format=CSV_FORMAT, start=None, end=None):
+    """Decodes the content of a slice file.
+
+    Records are sorted by time, so records in the range are found by binary search.
+    For binary format, only the rows in the range are decoded.
+
+    Args:
+        data: Bytes of the slice file.
+        slice_format: A string of the slice format.
+        start: An int of the start of time range, None if unbounded.
+        end: An int of the end of time range, both included, None if unbounded.
+
+    Returns:
+        A SliceColumns object.
+    """
+    if slice_format == CSV_FORMAT:
+        return _decode_csv(data).trim(start, end)
+
+    if data[:len(_MAGIC)] != _MAGIC:
+        raise ValueError('Not a binary slice')
+    header_length, = unpack_from('<I', data, len(_MAGIC))
+    offset = len(_MAGIC) + 4
+    header = loads(data[offset:offset+header_length].decode())
+    offset += header_length
+    offset += -offset % _ALIGNMENT
+
+    count = header['count']
+    power_dtype = np.dtype(header['power_dtype']).newbyteorder('<')
+    times = np.frombuffer(data, _TIME_DTYPE, count, offset)
+    first, last = _search_range(times, start, end)
+    times = times[first:last]
+    offset += count * _TIME_DTYPE.itemsize
+    powers = np.frombuffer(data, power_dtype, last - first,
+                           offset + first * power_dtype.itemsize)
+    offset += count * power_dtype.itemsize
+    codes = np.frombuffer(data, _CHANNEL_DTYPE, last - first,
+                          offset + first * _CHANNEL_DTYPE.itemsize)
+    offset += count * _CHANNEL_DTYPE.itemsize
+
+    aggregates = None
+    if header.get('aggregates'):
+        aggregates = list()
+        for dtype in _get_aggregate_dtypes(power_dtype):
+            aggregates.append(np.frombuffer(data, dtype, last - first,
+                                            offset + first * dtype.itemsize))
+            offset += count * dtype.itemsize
+
+    if power_dtype.itemsize < 8:
+        powers = np.round(powers.astype(np.float64), FLOAT_PRECISION)
+        if aggregates is not None:
+            for index in [2, 3]:
+                aggregates[index] = np.round(
+                    aggregates[index].astype(np.float64), FLOAT_PRECISION)
+    if aggregates is not None:
+        aggregates = tuple(aggregates)
+    return SliceColumns(times, powers, codes, header['channels'], aggregates)
+
+
+def _get_aggregate_dtypes(power_dtype):
+    """Gets the dtypes of the aggregate columns of binary slices.
+
+    Args:
+        power_dtype: A little-endian numpy dtype of power values.
+
+    Returns:
+        A list of dtypes of count, sum, min and max.
+    """
+    return [_COUNT_DTYPE, _SUM_DTYPE, power_dtype, power_dtype]
+
+
+def _search_range(times, start, end):
+    """Searches the records in a time range.
+
+    Args:
+        times: A sorted numpy array of timestamps.
+        start: An int of the start of the range, None if unbounded.
+        end: An int of the end of the range, both included, None if unbounded.
+
+    Returns:
+        A tuple of the index of the first record in range, and the index after the last.
+    """
+    first = 0 if start is None else int(np.searchsorted(times, start, 'left'))
+    last = len(times) if end is None else int(np.searchsorted(times, end, 'right'))
+    return first, max(first, last)
+
+
+def _decode_csv(data):
+    """Decodes a CSV slice file.
+
+    Args:
+        data: Bytes of the slice file.
+
+    Returns:
+        A SliceColumns object.
+    """
+    times = list()
+    powers = list()
+    codes = list()
+    channels = dict()
+    aggregates = list()
+    for line in data.decode().split('\n'):
+        fields = line.split(',')
+        if len(fields) == AGGREGATE_MAX + 1:
+            record = parse_csv_line(','.join(fields[:3]))
+            if record:
+                aggregates.append([int(fields[AGGREGATE_COUNT])] + [
+                    float(field) for field in fields[AGGREGATE_SUM:]])
+        else:
+            record = parse_csv_line(line)
+        if record:
+            times.append(record[0])
+            powers.append(record[1])
+            codes.append(channels.setdefault(record[2], len(channels)))
+    columns = None
+    if aggregates:
+        columns = tuple(np.array(column, dtype=dtype) for column, dtype in zip(
+            zip(*aggregates), [np.int64, np.float64, np.float64, np.float64]))
+    return SliceColumns(np.array(times, dtype=np.float64),
+                        np.array(powers, dtype=np.float64),
+                        np.array(codes, dtype=_CHANNEL_DTYPE),
+                        list(channels), columns)
@@ -0,0 +1,159 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""Test Module for slice_format.py"""
+
+import numpy as np
+import pytest
+
+import slice_format
+
+
+class TestSliceFormat:
+    """Test class for slice_format.py"""
+
+    @pytest.fixture
+    def records(self):
+        return [
+            [1573149236256988, 100.1234, 'PPX_ASYS'],
+            [1573149236257088, 0.5, 'SYS'],
+            [1573149236257188, 300, 'PPX_ASYS'],
+            [1573149236257288, 812.0001, 'PP1800_SOC'],
+            [1573149236257388, 100, 'SYS'],
+        ]
+
+    def expected_records(self, records):
+        """Groups records by channel, in the order channels first appear."""
+        expected = dict()
+        for record in records:
+            expected.setdefault(record[2], []).append(record)
+        return expected
+
+    @pytest.mark.parametrize('path,expected', [
+        ('mld-preprocess/f/level0/s0.csv', 'csv'),
+        ('mld-preprocess/f/avg/level1/s12.bin', 'bin'),
+        ('s0', 'csv'),
+    ])
+    def test_get_slice_format(self, path, expected):
+        """Tests the slice format is given by file extension."""
+        assert slice_format.get_slice_format(path) == expected
+
+    @pytest.mark.parametrize('fmt,power_dtype', [
+        ('csv', 'float64'),
+        ('bin', 'float64'),
+        ('bin', 'float32'),
+    ])
+    def test_round_trip(self, records, fmt, power_dtype):
+        """Tests decoded records are the same as encoded ones."""
+        data = slice_format.encode(records, fmt, power_dtype)
+        if isinstance(data, str):
+            data = data.encode()
+        columns = slice_format.decode(data, fmt)
+
+        assert len(columns) == len(records)
+        assert columns.channels == ['PPX_ASYS', 'SYS', 'PP1800_SOC']
+        assert columns.to_records() == self.expected_records(records)
+
+    def test_binary_columns(self, records):
+        """Tests binary slices decode to typed columns with dictionary encoded channels."""
+        data = slice_format.encode(records, 'bin', 'float32')
+        columns = slice_format.decode(data, 'bin')
+
+        assert columns.times.dtype == np.int64
+        assert columns.powers.dtype == np.float64
+        assert columns.codes.tolist() == [0, 1, 0, 2, 1]
+
+    def test_empty(self):
+        """Tests empty slices."""
+        columns = slice_format.decode(slice_format.encode([], 'bin'), 'bin')
+        assert len(columns) == 0
+        assert columns.to_records() == {}
+        assert slice_format.encode([], 'csv') == ''
+
+    def test_select(self, records):
+        """Tests selecting part of the records."""
+        columns = slice_format.decode(slice_format.encode(records, 'bin'), 'bin')
+        selected = columns.select(columns.times >= records[2][0])
+        assert selected.to_records() == self.expected_records(records[2:])
+
+    @pytest.mark.parametrize('fmt,power_dtype', [
+        ('csv', 'float64'),
+        ('bin', 'float64'),
+        ('bin', 'float32'),
+    ])
+    @pytest.mark.parametrize('start,end', [
+        (None, None),
+        (1573149236257088, None),
+        (None, 1573149236257288),
+        (1573149236257000, 1573149236257300),
+        (1573149236257188, 1573149236257188),
+        (1573149236257500, None),
+        (1573149236257300, 1573149236257200),
+    ])
+    def test_decode_range(self, records, fmt, power_dtype, start, end):
+        """Tests decoding only the records in a time range."""
+        data = slice_format.encode(records, fmt, power_dtype)
+        if isinstance(data, str):
+            data = data.encode()
+        expected = [record for record in records
+                    if (start is None or record[0] >= start) and (end is None or record[0] <= end)]
+
+        columns = slice_format.decode(data, fmt, start, end)
+        assert columns.to_records() == self.expected_records(expected)
+        trimmed = slice_format.decode(data, fmt).trim(start, end)
+        assert trimmed.to_records() == self.expected_records(expected)
+
+    @pytest.mark.parametrize('fmt', ['csv', 'bin'])
+    def test_get_stats(self, records, fmt):
+        """Tests summaries of each channel."""
+        data = slice_format.encode(records, fmt)
+        if isinstance(data, str):
+            data = data.encode()
+        stats = slice_format.decode(data, fmt).get_stats()
+
+        assert stats == slice_format.from_records(records).get_stats()
+        assert stats == {
+            'PPX_ASYS': [2, 100.1234, 300, 400.1234, 1573149236256988, 1573149236257188],
+            'SYS': [2, 0.5, 100, 100.5, 1573149236257088, 1573149236257388],
+            'PP1800_SOC': [1, 812.0001, 812.0001, 812.0001, 1573149236257288,
+                           1573149236257288],
+        }
+        assert isinstance(stats['SYS'][slice_format.STATS_FIRST], int)
+
+    @pytest.mark.parametrize('fmt,power_dtype', [
+        ('csv', 'float64'),
+        ('bin', 'float64'),
+        ('bin', 'float32'),
+    ])
+    def test_aggregates(self, fmt, power_dtype):
+        """Tests aggregate records keep their fields, and are summarized by count."""
+        records = [
+            [1573149236256988, 150.0617, 'SYS', 2, 300.1234, 100.1234, 200],
+            [1573149236257088, 0.5, 'PPX_ASYS', 1, 0.5, 0.5, 0.5],
+            [1573149236257188, 200, 'SYS', 3, 600, 100, 300.5],
+        ]
+        data = slice_format.encode(records, fmt, power_dtype)
+        if isinstance(data, str):
+            data = data.encode()
+        columns = slice_format.decode(data, fmt, 1573149236257000)
+
+        assert columns.to_records() == self.expected_records(records[1:])
+        assert slice_format.decode(data, fmt).get_stats()['SYS'] == [
+            5, 100, 300.5, 900.1234, 1573149236256988, 1573149236257188]
+
+    def test_not_binary(self, records):
+        """Tests decoding a CSV slice as binary."""
+        with pytest.raises(ValueError):
+            slice_format.decode(
+                slice_format.encode(records, 'csv').encode(), 'bin')
@@ -0,0 +1,312 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Module for storage of files on GCS, on local disk or in memory.
+
+Every backend reads and writes whole files by path, reads byte ranges, and
+raises FileNotFoundError for missing files, so that preprocess and fetch
+behave the same wherever files are stored. A RangeBackend serves byte ranges
+of a file as files of their own.
+"""
+import os
+from itertools import count
+from threading import Lock
+
+from google.api_core.exceptions import NotFound
+from google.api_core.exceptions import RequestRangeNotSatisfiable
+from utils import mkdir
+
+
+class StorageBackend:
+    """The interface of storage backends."""
+
+    # A string identifying the storage, e.g. the bucket name.
+    name = None
+
+    def get(self, path):
+        """Reads a file.
+
+        Args:
+            path: A string of the path to the file.
+
+        Returns:
+            A bytes object of the content.
+
+        Raises:
+            FileNotFoundError: The file does not exist.
+        """
+        raise NotImplementedError
+
+    def get_range(self, path, start, end):
+        """Reads a range of bytes of a file.
+
+        Args:
+            path: A string of the path to the file.
+            start: An int of the offset of the first byte.
+            end: An int of the offset of the last byte, included.
+
+        Returns:
+            A bytes object of the content in the range, shorter if the file ends
+            before the range does, empty if it ends before the range starts.
+
+        Raises:
+            FileNotFoundError: The file does not exist.
+        """
+        raise NotImplementedError
+
+    def put(self, path, data):
+        """Writes a file, replacing it if it exists.
+
+        Args:
+            path: A string of the path to the file.
+            data: A bytes object or a string of the content.
+        """
+        raise NotImplementedError
+
+    def exists(self, path):
+        """Checks if a file exists.
+
+        Args:
+            path: A string of the path to the file.
+
+        Returns:
+            A boolean indicating if the file exists.
+        """
+        return self.get_generation(path) is not None
+
+    def list(self, prefix):
+        """Lists files by prefix of path.
+
+        Args:
+            prefix: A string of the start of paths.
+
+        Returns:
+            A sorted list of strings of paths of files.
+        """
+        raise NotImplementedError
+
+    def get_generation(self, path):
+        """Gets the generation of a file, which changes every time it is written.
+
+        Args:
+            path: A string of the path to the file.
+
+        Returns:
+            An int of the generation, None if the file does not exist.
+        """
+        raise NotImplementedError
+
+
+class GCSBackend(StorageBackend):
+    """Files in a GCS bucket."""
+
+    def __init__(self, bucket):
+        """Initializes the backend.
+
+        Args:
+            bucket: A GCP bucket object.
+        """
+        self._bucket = bucket
+        self.name = bucket.name
+
+    def get(self, path):
+        try:
+            return self._bucket.blob(path).download_as_string()
+        except NotFound as error:
+            raise FileNotFoundError(path) from error
+
+    def get_range(self, path, start, end):
+        try:
+            return self._bucket.blob(path).download_as_string(start=start, end=end)
+        except RequestRangeNotSatisfiable:
+            return b''
+        except NotFound as error:
+            raise FileNotFoundError(path) from error
+
+    def put(self, path, data):
+        self._bucket.blob(path).upload_from_string(data)
+
+    def exists(self, path):
+        return self._bucket.blob(path).exists()
+
+    def list(self, prefix):
+        return sorted(blob.name for blob in self._bucket.list_blobs(prefix=prefix))
+
+    def get_generation(self, path):
+        blob = self._bucket.get_blob(path)
+        if blob is None:
+            return None
+        return blob.generation
+
+
+class LocalBackend(StorageBackend):
+    """Files on local disk."""
+
+    def __init__(self, root=None):
+        """Initializes the backend.
+
+        Args:
+            root: A string of the directory paths are relative to, None for paths
+                as they are given.
+        """
+        self._root = root
+        self.name = root
+
+    def get(self, path):
+        with open(self._get_path(path), 'rb') as filereader:
+            return filereader.read()
+
+    def get_range(self, path, start, end):
+        with open(self._get_path(path), 'rb') as filereader:
+            filereader.seek(start)
+            return filereader.read(end - start + 1)
+
+    def put(self, path, data):
+        path = self._get_path(path)
+        if os.path.dirname(path):
+            mkdir(os.path.dirname(path))
+        with open(path, 'wb' if isinstance(data, bytes) else 'w') as filewriter:
+            filewriter.write(data)
+
+    def list(self, prefix):
+        directory = os.path.dirname(prefix)
+        paths = list()
+        for dirpath, _, filenames in os.walk(self._get_path(directory)):
+            relative_dir = os.path.relpath(dirpath, self._get_path(directory))
+            for filename in filenames:
+                path = os.path.normpath(os.path.join(directory, relative_dir, filename))
+                if path.startswith(prefix):
+                    paths.append(path)
+        return sorted(paths)
+
+    def get_generation(self, path):
+        try:
+            return os.stat(self._get_path(path)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _get_path(self, path):
+        """Gets the path to a file on disk."""
+        if self._root is None:
+            return path or '.'
+        return os.path.join(self._root, path)
+
+
+class MemoryBackend(StorageBackend):
+    """Files in memory, for tests and offline benchmarks."""
+
+    _names = count()
+
+    def __init__(self):
+        # key: path, value: tuple of content and generation.
+        self._files = dict()
+        self._generations = count(1)
+        self._lock = Lock()
+        self.name = 'memory-{}'.format(next(MemoryBackend._names))
+
+    def get(self, path):
+        with self._lock:
+            if path not in self._files:
+                raise FileNotFoundError(path)
+            return self._files[path][0]
+
+    def get_range(self, path, start, end):
+        return self.get(path)[start:end + 1]
+
+    def put(self, path, data):
+        if isinstance(data, str):
+            data = data.encode()
+        with self._lock:
+            self._files[path] = (bytes(data), next(self._generations))
+
+    def list(self, prefix):
+        with self._lock:
+            return sorted(path for path in self._files if path.startswith(prefix))
+
+    def get_generation(self, path):
+        with self._lock:
+            entry = self._files.get(path)
+        return None if entry is None else entry[1]
+
+
+class RangeBackend(StorageBackend):
+    """Files that are byte ranges of a source file, in front of other files.
+
+    Files of the ranges are read from the source file, and cannot be written.
+    Other files are those of the backend in front of which the ranges are.
+    """
+
+    def __init__(self, storage, source_storage, source_path, ranges):
+        """Initializes the backend.
+
+        Args:
+            storage: A StorageBackend object of the other files.
+            source_storage: A StorageBackend object of the source file.
+            source_path: A string of the path to the source file.
+            ranges: A dict of tuples of the offset of the first byte and of the byte
+                after the last one in the source file, keyed by path.
+        """
+        self._storage = storage
+        self._source_storage = source_storage
+        self._source_path = source_path
+        self._ranges = ranges
+        self.name = storage.name
+
+    def get(self, path):
+        if path not in self._ranges:
+            return self._storage.get(path)
+        start, end = self._ranges[path]
+        return self.get_range(path, 0, end - start - 1)
+
+    def get_range(self, path, start, end):
+        if path not in self._ranges:
+            return self._storage.get_range(path, start, end)
+        range_start, range_end = self._ranges[path]
+        end = min(range_start + end, range_end - 1)
+        if range_start + start > end:
+            return b''
+        return self._source_storage.get_range(self._source_path, range_start + start, end)
+
+    def put(self, path, data):
+        if path in self._ranges:
+            raise PermissionError(path)
+        self._storage.put(path, data)
+
+    def exists(self, path):
+        return path in self._ranges or self._storage.exists(path)
+
+    def list(self, prefix):
+        return sorted(set(self._storage.list(prefix)) |
+                      {path for path in self._ranges if path.startswith(prefix)})
+
+    def get_generation(self, path):
+        if path in self._ranges:
+            return self._source_storage.get_generation(self._source_path)
+        return self._storage.get_generation(path)
+
+
+def get_backend(bucket):
+    """Gets the storage backend of a bucket.
+
+    Args:
+        bucket: A StorageBackend object, a GCP bucket object, or None for local disk.
+
+    Returns:
+        A StorageBackend object.
+    """
+    if bucket is None:
+        return LocalBackend()
+    if isinstance(bucket, StorageBackend):
+        return bucket
+    return GCSBackend(bucket)
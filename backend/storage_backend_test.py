@@ -0,0 +1,106 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Test module for storage_backend.py"""
+# pylint: disable=W0212
+
+from tempfile import TemporaryDirectory
+
+import pytest
+from storage_backend import LocalBackend
+from storage_backend import MemoryBackend
+from storage_backend import RangeBackend
+from storage_backend import get_backend
+
+
+class TestStorageBackend:
+    """A Test Class for storage_backend.py"""
+
+    @pytest.fixture(params=['local', 'memory'])
+    def storage(self, request):
+        """Gives an empty backend of each kind."""
+        if request.param == 'memory':
+            yield MemoryBackend()
+            return
+        with TemporaryDirectory() as root:
+            yield LocalBackend(root)
+
+    def test_get_put(self, storage):
+        """Tests files are read as they were written, and missing files raise."""
+        with pytest.raises(FileNotFoundError):
+            storage.get('f/level0/s0.bin')
+        assert not storage.exists('f/level0/s0.bin')
+        assert storage.get_generation('f/level0/s0.bin') is None
+
+        storage.put('f/level0/s0.bin', b'\x00\x01')
+        storage.put('f/metadata.json', '{"start": 1}')
+        assert storage.get('f/level0/s0.bin') == b'\x00\x01'
+        assert storage.get('f/metadata.json') == b'{"start": 1}'
+        assert storage.exists('f/level0/s0.bin')
+        assert storage.get_generation('f/level0/s0.bin') is not None
+
+    def test_get_range(self, storage):
+        """Tests ranges include both ends, and are cut by the end of the file."""
+        storage.put('raw.csv', b'0123456789')
+        assert storage.get_range('raw.csv', 0, 3) == b'0123'
+        assert storage.get_range('raw.csv', 8, 20) == b'89'
+        assert storage.get_range('raw.csv', 10, 20) == b''
+        with pytest.raises(FileNotFoundError):
+            storage.get_range('missing.csv', 0, 3)
+
+    def test_list(self, storage):
+        """Tests files are listed by prefix of path."""
+        for path in ['f/level0/s0.bin', 'f/level0/s1.bin', 'f/avg/level1/s0.bin',
+                     'f2/level0/s0.bin']:
+            storage.put(path, b'')
+        assert storage.list('f/level0/') == ['f/level0/s0.bin', 'f/level0/s1.bin']
+        assert storage.list('f/') == ['f/avg/level1/s0.bin', 'f/level0/s0.bin',
+                                      'f/level0/s1.bin']
+        assert storage.list('f/level0/s1') == ['f/level0/s1.bin']
+        assert storage.list('g/') == []
+
+    def test_generation_changes(self):
+        """Tests the generation in memory changes when a file is written again."""
+        storage = MemoryBackend()
+        storage.put('f/metadata.json', '{}')
+        generation = storage.get_generation('f/metadata.json')
+        storage.put('f/metadata.json', '{"start": 1}')
+        assert storage.get_generation('f/metadata.json') != generation
+
+    def test_range_backend(self):
+        """Tests ranges of the source file are read as files, in front of others."""
+        source = MemoryBackend()
+        source.put('raw.csv', b'0123456789')
+        storage = MemoryBackend()
+        storage.put('f/level0/metadata.json', b'{}')
+        ranges = RangeBackend(storage, source, 'raw.csv', {
+            'f/level0/s0.csv': (0, 4), 'f/level0/s1.csv': (4, 10)})
+        assert ranges.get('f/level0/s0.csv') == b'0123'
+        assert ranges.get('f/level0/s1.csv') == b'456789'
+        assert ranges.get_range('f/level0/s1.csv', 1, 2) == b'56'
+        assert ranges.get_range('f/level0/s0.csv', 2, 20) == b'23'
+        assert ranges.get_range('f/level0/s0.csv', 4, 20) == b''
+        assert ranges.get('f/level0/metadata.json') == b'{}'
+        assert ranges.list('f/level0/') == ['f/level0/metadata.json', 'f/level0/s0.csv',
+                                            'f/level0/s1.csv']
+        assert ranges.get_generation('f/level0/s0.csv') == \
+            source.get_generation('raw.csv')
+        with pytest.raises(PermissionError):
+            ranges.put('f/level0/s0.csv', b'')
+
+    def test_get_backend(self):
+        """Tests buckets are wrapped, and backends are used as they are."""
+        storage = MemoryBackend()
+        assert get_backend(storage) is storage
+        assert isinstance(get_backend(None), LocalBackend)
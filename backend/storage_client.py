@@ -0,0 +1,99 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Module for the GCS client shared by all requests of a process."""
+from threading import Lock
+
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import storage
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 32
+
+
+class StorageClient:
+    """A thread-safe GCS client, created on first use and then reused.
+
+    Requests share one HTTP session, so connections are kept alive between
+    requests, up to pool_size of them at once. Bucket handles are resolved once
+    per name.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE):
+        """Initializes the client, without connecting yet.
+
+        Args:
+            pool_size: An int of the maximum number of connections kept open.
+        """
+        self._pool_size = pool_size
+        self._client = None
+        # key: bucket name, value: GCP bucket object.
+        self._buckets = dict()
+        self._lock = Lock()
+
+    def get_client(self):
+        """Gets the shared client, creating it on first use.
+
+        Returns:
+            A google.cloud.storage.Client object.
+        """
+        with self._lock:
+            if self._client is None:
+                self._client = _create_client(self._pool_size)
+            return self._client
+
+    def bucket(self, name):
+        """Gets the shared handle of a bucket.
+
+        Args:
+            name: A string of the bucket name.
+
+        Returns:
+            A GCP bucket object.
+        """
+        client = self.get_client()
+        with self._lock:
+            bucket = self._buckets.get(name)
+            if bucket is None:
+                bucket = client.bucket(name)
+                self._buckets[name] = bucket
+            return bucket
+
+    def list_blobs(self, name):
+        """Lists the blobs of a bucket.
+
+        Args:
+            name: A string of the bucket name.
+
+        Returns:
+            An iterator of GCP blob objects.
+        """
+        return self.get_client().list_blobs(self.bucket(name))
+
+
+def _create_client(pool_size):
+    """Creates a client with a pool of connections of the given size.
+
+    Args:
+        pool_size: An int of the maximum number of connections kept open.
+
+    Returns:
+        A google.cloud.storage.Client object.
+    """
+    credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    return storage.Client(project=project, credentials=credentials, _http=session)
@@ -0,0 +1,59 @@
+# Copyright 2020 Google LLC
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""A Test module for StorageClient Class."""
+# pylint: disable=W0212
+
+from concurrent.futures import ThreadPoolExecutor
+
+import storage_client
+from storage_client import StorageClient
+
+
+class FakeClient:
+    """A client that counts the bucket handles it creates."""
+
+    def __init__(self):
+        self.buckets = list()
+
+    def bucket(self, name):
+        self.buckets.append(name)
+        return object()
+
+    def list_blobs(self, bucket):
+        return [bucket]
+
+
+class TestStorageClient:
+    """A Test Class for StorageClient Class."""
+
+    def test_shared(self, monkeypatch):
+        """Tests the client and bucket handles are created once for all threads."""
+        clients = list()
+
+        def create_client(pool_size):
+            clients.append(FakeClient())
+            return clients[-1]
+
+        monkeypatch.setattr(storage_client, '_create_client', create_client)
+        client = StorageClient(4)
+        assert clients == []
+
+        with ThreadPoolExecutor(8) as executor:
+            buckets = list(executor.map(
+                lambda index: client.bucket('raw' if index % 2 else 'preprocess'), range(64)))
+        assert len(clients) == 1
+        assert sorted(clients[0].buckets) == ['preprocess', 'raw']
+        assert len({id(bucket) for bucket in buckets}) == 2
+        assert client.list_blobs('raw') == [client.bucket('raw')]
@@ -100,16 +100,17 @@ def get_level_name(index):
     return 'level' + str(index)
 
 
-def get_slice_name(index):
+def get_slice_name(index, slice_format='csv'):
     """Gets the name of slice.
 
     Args:
         index: An int representing the index of the slice.
+        slice_format: A string of the slice format, used as file extension.
 
     Returns:
         A string representing the name of the slice.
     """
-    filename = 's{}.csv'.format(index)
+    filename = 's{}.{}'.format(index, slice_format)
     return filename
 
 